@@ -0,0 +1,723 @@
+#!/usr/bin/env python2
+"""
+Local stand-ins for the grid commands used by the tools, backed by a
+directory instead of grid services, so that the transfer code can be run
+and timed without a proxy.
+
+    ./FakeGrid.py install /tmp/grid --files 1000 --dirs 1
+
+creates /tmp/grid with
+
+    bin/             a link to this script for every command below
+    catalogue.json   the file catalogue, in the DIRACWorker fixture format
+    se/<host>/...    the files stored on each SE (sparse, only the size
+                     is real)
+    fts/<job>.json   FTS jobs
+    calls.log        one line per command run, for counting subprocesses
+
+and prints the environment to use it. The commands are
+
+    lcg-ls, lcg-cp, lcg-rep, lcg-del, lcg-bringonline, lcg-get-checksum
+    fts-transfer-submit, -status, -list, -cancel (and glite-transfer-*)
+    dirac-dms-find-lfns, -lfn-replicas, -lfn-metadata, -data-size,
+    dirac-dms-remove-files, -add-file, -replicate-lfn, dirac-proxy-info
+    dirac-wms-job-status, with the states in wms.json or made up from
+    the job ID, and dirac-wms-job-kill, setting them to Killed
+    curl, answering the FTS REST queries of ND280Transfers.ChannelMonitor
+    for $FAKEGRID_FTS as FTS3 does (a single job ID with the job, or a
+    plain 404 once it is purged) and running the real curl for anything
+    else
+    ldapsearch, answering the GlueSA space queries of ND280Space
+
+Their behaviour is set with
+
+    FAKEGRID_LATENCY    seconds every command takes (default 0)
+    FAKEGRID_FAILRATE   fraction of commands and FTS files that fail (0)
+    FAKEGRID_BANDWIDTH  MB/s of copies and FTS transfers (default 1000)
+    FAKEGRID_RECALL     seconds to bring a file online from tape (0)
+    FAKEGRID_BROKEN     comma separated SE hosts whose BDII entries never
+                        answer
+
+Files on tape SEs (RAL) are NEARLINE until lcg-bringonline has been run
+on them, unless installed with --online.
+"""
+
+import fcntl
+from hashlib import sha1
+import json
+import optparse
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import DIRACWorker
+
+COMMANDS = ['lcg-ls', 'lcg-cp', 'lcg-rep', 'lcg-del', 'lcg-bringonline',
+            'lcg-get-checksum',
+            'fts-transfer-submit', 'fts-transfer-status',
+            'fts-transfer-list', 'fts-transfer-cancel',
+            'glite-transfer-status', 'glite-transfer-cancel',
+            'dirac-dms-find-lfns', 'dirac-dms-lfn-replicas',
+            'dirac-dms-lfn-metadata', 'dirac-dms-data-size',
+            'dirac-dms-remove-files', 'dirac-dms-add-file',
+            'dirac-dms-replicate-lfn',
+            'dirac-wms-job-status', 'dirac-wms-job-kill',
+            'dirac-proxy-info', 'curl',
+            'ldapsearch']
+
+# Commands that never fail, a failing proxy check waits for renewal
+RELIABLE = ('dirac-proxy-info', 'curl')
+
+TAPE_SES = ('srm-t2k.gridpp.rl.ac.uk',)
+
+# States of jobs not in wms.json
+JOB_STATES = [('Done', 'Execution Complete', 'LCG.RAL-LCG2.uk'),
+              ('Failed', 'Application Finished With Errors',
+               'LCG.UKI-LT2-QMUL.uk'),
+              ('Running', 'Application', 'LCG.UKI-NORTHGRID-LIV-HEP.uk'),
+              ('Waiting', 'Pilot Agent Submission', 'ANY')]
+# Reasons given for failed FTS transfers
+REASONS = ['SOURCE [2] srm-ls error: No such file or directory',
+           'TRANSFER [110] Operation timed out',
+           'DESTINATION [28] No space left on device',
+           'TRANSFER [70] Communication error on send']
+SOURCE_ROOT = 'srm://srm-t2k.gridpp.rl.ac.uk/castor/ads.rl.ac.uk/prod'
+
+# FTS file states
+kSubmitted = 'SUBMITTED'
+kActive = 'ACTIVE'
+kFinished = 'FINISHED'
+kFailed = 'FAILED'
+kCanceled = 'CANCELED'
+
+
+class FakeGrid(object):
+    """the state of a fake grid in root"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.latency = float(os.getenv('FAKEGRID_LATENCY', 0))
+        self.failrate = float(os.getenv('FAKEGRID_FAILRATE', 0))
+        self.bandwidth = float(os.getenv('FAKEGRID_BANDWIDTH', 1000)) * \
+            1024**2
+        self.recall = float(os.getenv('FAKEGRID_RECALL', 0))
+        self.fts = os.getenv('FAKEGRID_FTS', 'http://fakefts')
+        self.broken = [host for host in
+                       os.getenv('FAKEGRID_BROKEN', '').split(',') if host]
+        self.catalogue_path = os.path.join(self.root, 'catalogue.json')
+        self.catalogue = None
+
+    # Paths
+    def Path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def SEPath(self, surl):
+        """where surl is stored"""
+        rest = surl.split('://', 1)[-1]
+        host, path = (rest.split('/', 1) + [''])[:2]
+        path = path.split('?SFN=')[-1]
+        return self.Path('se', host.split(':')[0], path.lstrip('/'))
+
+    def Online(self, surl):
+        return self.Path('online', sha1(surl).hexdigest())
+
+    # Bookkeeping
+    def LogCall(self, command):
+        with open(self.Path('calls.log'), 'a') as log:
+            log.write(command + '\n')
+
+    def Calls(self):
+        """{command: times run}"""
+        calls = dict()
+        if os.path.exists(self.Path('calls.log')):
+            for line in open(self.Path('calls.log')):
+                calls[line.strip()] = calls.get(line.strip(), 0) + 1
+        return calls
+
+    def Fails(self):
+        return random.random() < self.failrate
+
+    # The catalogue
+    def Lock(self):
+        lock = open(self.Path('catalogue.lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def Load(self):
+        if self.catalogue is None:
+            with open(self.catalogue_path) as catalogue:
+                self.catalogue = json.load(catalogue)
+        return self.catalogue
+
+    def Save(self):
+        temporary = self.catalogue_path + '.%d' % os.getpid()
+        with open(temporary, 'w') as catalogue:
+            json.dump(self.catalogue, catalogue)
+        os.rename(temporary, self.catalogue_path)
+
+    def Backend(self):
+        backend = DIRACWorker.FixtureBackend('')
+        backend.catalogue = self.Load()
+        return backend
+
+    def Replicas(self):
+        """{surl: (lfn, size)} of every replica in the catalogue"""
+        replicas = dict()
+        for lfn, entry in self.Load().iteritems():
+            for surl in entry.get('replicas', {}).itervalues():
+                replicas[surl] = (lfn, entry.get('size', 0))
+        return replicas
+
+    def Size(self, surl, replicas=None):
+        """the size of surl, None if it is not there"""
+        path = self.SEPath(surl)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        if replicas is None:
+            replicas = self.Replicas()
+        if surl in replicas:
+            return replicas[surl][1]
+        return None
+
+    def Directory(self, surl, replicas):
+        """sorted (name, size) of what is in the directory surl, on disk
+        or catalogued, size None for subdirectories; None if surl is not
+        a directory"""
+        path = self.SEPath(surl)
+        entries = dict()
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                child = os.path.join(path, name)
+                entries[name] = None if os.path.isdir(child) else \
+                    os.path.getsize(child)
+        for replica, (lfn, size) in replicas.iteritems():
+            relative = os.path.relpath(self.SEPath(replica), path)
+            if relative.startswith('..') or relative == '.':
+                continue
+            parts = relative.split(os.sep)
+            entries.setdefault(parts[0], size if len(parts) == 1 else None)
+        if not entries and not os.path.isdir(path):
+            return None
+        return sorted(entries.iteritems())
+
+    def Option(self, args, flag, default):
+        """the value following flag in args"""
+        if flag in args and args.index(flag) + 1 < len(args):
+            return args[args.index(flag) + 1]
+        return default
+
+    def Store(self, surl, size):
+        """put a (sparse) file of size bytes on surl"""
+        path = self.SEPath(surl)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+        with open(path, 'a') as stored:
+            stored.truncate(size)
+
+    def Wait(self, size):
+        time.sleep(size / self.bandwidth)
+
+    # Installation
+    def Install(self, nfiles, ndirs=1, size=100, online=False):
+        """make the directories, command links and a catalogue of nfiles
+        processed files of size MB in ndirs directories"""
+        for directory in ('bin', 'se', 'fts', 'online',
+                          os.path.join('fts_logs', 'failures'),
+                          os.path.join('fts_logs', 'completed')):
+            if not os.path.isdir(self.Path(directory)):
+                os.makedirs(self.Path(directory))
+        for command in COMMANDS:
+            link = self.Path('bin', command)
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.splitext(os.path.realpath(__file__))[0] + '.py',
+                       link)
+
+        self.catalogue = dict()
+        per_dir = -(-nfiles // ndirs)
+        for index in xrange(nfiles):
+            directory = '/t2k.org/nd280/benchmark/dir%03d' % (index // per_dir)
+            name = 'oa_nd_spl_%08d-%04d_%s_anal_000_bench.root' % \
+                (4000 + index // 1000, index % 1000,
+                 sha1(str(index)).hexdigest()[:12])
+            lfn = directory + '/' + name
+            surl = SOURCE_ROOT + lfn
+            self.catalogue[lfn] = {'size': size * 1024**2,
+                                   'guid': str(uuid.UUID(int=index)),
+                                   'checksum': '%08x' % index,
+                                   'replicas': {'RAL-disk': surl}}
+            if online:
+                open(self.Online(surl), 'w').close()
+        self.Save()
+        open(self.Path('calls.log'), 'w').close()
+
+    def Environment(self):
+        """the environment variables that put this grid in use"""
+        return {'PATH': self.Path('bin') + os.pathsep + os.getenv('PATH', ''),
+                'FAKEGRID_ROOT': self.root,
+                'FTS_SERVICE': self.fts,
+                'ND280FTSREST': self.fts,
+                'MYPROXY_SERVER': 'fakeproxy',
+                # RemoveFailedFTS.py rewrites every 'transfers' in the
+                # path of a log, so the directory must not contain it
+                'ND280TRANSFERS': self.Path('fts_logs'),
+                'ND280REPLICASTATS': self.Path('replica_stats.json'),
+                'ND280SPACECACHE': self.Path('space.json'),
+                'ND280SPACEHISTORY': self.Path('space_history.log')}
+
+    # lcg-*
+    def DoLcgLs(self, args):
+        replicas = None
+        long_listing = '-l' in args
+        status = 0
+        for surl in [arg for arg in args if '://' in arg]:
+            if replicas is None:
+                replicas = self.Replicas()
+            entries = self.Directory(surl, replicas)
+            if entries is not None:
+                count = int(self.Option(args, '-c', len(entries)))
+                offset = int(self.Option(args, '-o', 0))
+                directory = '/' + surl.split('://', 1)[-1].split('/', 1)[-1]
+                for name, size in entries[offset:offset + count]:
+                    name = directory.rstrip('/') + '/' + name
+                    if not long_listing:
+                        print name
+                    elif size is None:
+                        print 'drwxr-xr-x   1     2     2 0 ONLINE ' + name
+                    else:
+                        print '-rw-r--r--   1     2     2 %d ONLINE %s' % \
+                            (size, name)
+                continue
+            size = self.Size(surl, replicas)
+            if size is None:
+                sys.stderr.write('[SE][Ls] %s: No such file or directory\n'
+                                 % surl)
+                status = 1
+                continue
+            name = '/' + surl.split('://', 1)[-1].split('/', 1)[-1]
+            if long_listing:
+                locality = 'ONLINE_AND_NEARLINE'
+                if surl.split('/')[2] in TAPE_SES and \
+                        not os.path.exists(self.Online(surl)):
+                    locality = 'NEARLINE'
+                print '-rw-r--r--   1     2     2 %d %s %s' % \
+                    (size, locality, name)
+            else:
+                print name
+        return status
+
+    def DoLcgGetChecksum(self, args):
+        catalogue = self.Load()
+        by_surl = dict((surl, entry) for entry in catalogue.itervalues()
+                       for surl in entry.get('replicas', {}).itervalues())
+        status = 0
+        for surl in [arg for arg in args if '://' in arg]:
+            if surl in by_surl:
+                checksum = by_surl[surl].get('checksum') or '(null)'
+            elif os.path.isfile(self.SEPath(surl)):
+                # a file that is not catalogued, checksumming a sparse
+                # file is slow so make one up
+                checksum = '%08x' % (zlib.adler32(surl) & 0xffffffff)
+            else:
+                sys.stderr.write('[SE][Checksum] %s: No such file or '
+                                 'directory\n' % surl)
+                status = 1
+                continue
+            print '%s %s' % (checksum, surl)
+        return status
+
+    def DoLcgBringonline(self, args):
+        surls = [arg for arg in args if '://' in arg]
+        time.sleep(self.recall)
+        for surl in surls:
+            open(self.Online(surl), 'w').close()
+        return 0
+
+    def DoLcgCp(self, args):
+        source, dest = [arg for arg in args if ':' in arg][-2:]
+        size = self.Size(source)
+        if size is None:
+            sys.stderr.write('%s: No such file or directory\n' % source)
+            return 1
+        self.Wait(size)
+        path = dest.replace('file://', '').replace('file:', '')
+        with open(path, 'a') as copy:
+            copy.truncate(size)
+        return 0
+
+    def DoLcgRep(self, args):
+        dest = args[args.index('-d') + 1]
+        source = [arg for arg in args if ':' in arg and arg != dest][-1]
+        lock = self.Lock()
+        try:
+            catalogue = self.Load()
+            lfn = source.replace('lfn:', '')
+            if lfn not in catalogue:
+                lfn = self.Replicas().get(source, (None, 0))[0]
+            if lfn is None:
+                sys.stderr.write('%s: No such file or directory\n' % source)
+                return 1
+            size = catalogue[lfn].get('size', 0)
+            self.Wait(size)
+            self.Store(dest, size)
+            catalogue[lfn]['replicas'][dest.split('/')[2]] = dest
+            self.Save()
+        finally:
+            lock.close()
+        print 'Replicated %s to %s' % (lfn, dest)
+        return 0
+
+    def DoLcgDel(self, args):
+        for surl in [arg for arg in args if '://' in arg]:
+            if os.path.isfile(self.SEPath(surl)):
+                os.remove(self.SEPath(surl))
+        return 0
+
+    # FTS
+    def JobPath(self, job_id):
+        return self.Path('fts', job_id + '.json')
+
+    def LoadJob(self, job_id):
+        path = self.JobPath(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as job_file:
+            return json.load(job_file)
+
+    def Jobs(self):
+        for name in sorted(os.listdir(self.Path('fts'))):
+            if name.endswith('.json'):
+                yield self.LoadJob(name[:-len('.json')])
+
+    def FileState(self, job, entry, now=None):
+        """the state of one file of job, FTS moves a file through
+        SUBMITTED and ACTIVE to FINISHED (or FAILED) by the clock"""
+        if job.get('canceled'):
+            return kCanceled
+        now = now or time.time()
+        if now < entry['start']:
+            return kSubmitted
+        if now < entry['finish']:
+            return kActive
+        if entry['fails']:
+            return kFailed
+        if not os.path.exists(self.SEPath(entry['dest'])):
+            self.Store(entry['dest'], entry['size'])
+        return kFinished
+
+    def JobState(self, job):
+        states = [self.FileState(job, entry) for entry in job['files']]
+        for state in (kCanceled, kActive, kSubmitted):
+            if state in states:
+                return state
+        if kFailed in states:
+            return kFinished + 'DIRTY' if kFinished in states else kFailed
+        return kFinished
+
+    def DoFtsTransferSubmit(self, args):
+        pairs = list()
+        if '-f' in args:
+            for line in open(args[args.index('-f') + 1]):
+                if line.split():
+                    pairs.append(line.split()[:2])
+        else:
+            pairs.append([arg for arg in args if arg.startswith('srm://')][:2])
+        replicas = self.Replicas()
+        job_id = str(uuid.uuid4())
+        start = time.time() + self.latency
+        files = list()
+        for source, dest in pairs:
+            size = self.Size(source, replicas) or 0
+            # transfers on a job run one after the other
+            finish = start + size / self.bandwidth
+            files.append({'source': source, 'dest': dest, 'size': size,
+                          'start': start, 'finish': finish,
+                          'fails': self.Fails() and random.choice(REASONS)})
+            start = finish
+        with open(self.JobPath(job_id), 'w') as job_file:
+            json.dump({'job_id': job_id, 'files': files}, job_file)
+        print job_id
+        return 0
+
+    def DoFtsTransferStatus(self, args):
+        job = self.LoadJob(args[-1])
+        if job is None:
+            sys.stderr.write('No information about request %s, it was not '
+                             'found\n' % args[-1])
+            return 1
+        print self.JobState(job).capitalize()
+        if '-l' in args:
+            for entry in job['files']:
+                state = self.FileState(job, entry)
+                print
+                print '  Source:      %s' % entry['source']
+                print '  Destination: %s' % entry['dest']
+                print '  State:       %s' % state.capitalize()
+                print '  Reason:      %s' % (entry['fails']
+                                             if state == kFailed else '')
+                print '  Duration:    %d' % (entry['finish'] - entry['start'])
+                print '  Staging:     0'
+                print '  Retries:     0'
+        return 0
+
+    def DoFtsTransferList(self, args):
+        source = dest = ''
+        if '--source_se' in args:
+            source = args[args.index('--source_se') + 1]
+        if '--dest_se' in args:
+            dest = args[args.index('--dest_se') + 1]
+        found = False
+        for job in self.Jobs():
+            state = self.JobState(job)
+            if state not in (kSubmitted, kActive):
+                continue
+            first = job['files'][0]
+            if source and source not in first['source'] or \
+                    dest and dest not in first['dest']:
+                continue
+            found = True
+            print 'Request ID: %s' % job['job_id']
+            print 'Status: %s' % state
+            print
+        if not found:
+            print 'No data have been found for the specified state(s) ' \
+                'and/or user VO/VOMS roles.'
+        return 0
+
+    def DoFtsTransferCancel(self, args):
+        job = self.LoadJob(args[-1])
+        if job is None:
+            sys.stderr.write('%s was not found\n' % args[-1])
+            return 1
+        job['canceled'] = True
+        with open(self.JobPath(job['job_id']), 'w') as job_file:
+            json.dump(job, job_file)
+        print 'Canceled %s' % job['job_id']
+        return 0
+
+    DoGliteTransferStatus = DoFtsTransferStatus
+    DoGliteTransferCancel = DoFtsTransferCancel
+
+    def DoCurl(self, args):
+        url = [arg for arg in args if '://' in arg][-1].strip("'")
+        if not url.startswith(self.fts):
+            # the first curl on the PATH that is not this one
+            for directory in os.getenv('PATH', '').split(os.pathsep):
+                real = os.path.join(directory, 'curl')
+                if directory != self.Path('bin') and os.access(real, os.X_OK):
+                    os.execv(real, [real] + args)
+            return 127
+        path, dummy, query = url[len(self.fts):].partition('?')
+        if path.rstrip('/') == '/jobs':
+            reply = [{'job_id': job['job_id'],
+                      'job_state': self.JobState(job)}
+                     for job in self.Jobs()
+                     if self.JobState(job) in (kSubmitted, kActive)]
+        else:
+            reply = list()
+            job_ids = path[len('/jobs/'):].split(',')
+            for job_id in job_ids:
+                job = self.LoadJob(job_id)
+                if job is None and len(job_ids) == 1:
+                    # a single job is answered with a plain HTTP status
+                    sys.stderr.write('curl: (22) The requested URL returned '
+                                     'error: 404 Not Found\n')
+                    return 22
+                if job is None:
+                    reply.append({'job_id': job_id,
+                                  'http_status': '404 Not Found'})
+                    continue
+                files = list()
+                for entry in job['files']:
+                    state = self.FileState(job, entry)
+                    files.append({'file_state': state,
+                                  'source_surl': entry['source'],
+                                  'dest_surl': entry['dest'],
+                                  'filesize': entry['size'],
+                                  'tx_duration': entry['finish'] -
+                                  entry['start'],
+                                  'reason': entry['fails']
+                                  if state == kFailed else ''})
+                reply.append({'job_id': job_id,
+                              'job_state': self.JobState(job),
+                              'files': files})
+            if len(job_ids) == 1:
+                reply = reply[0]
+        print json.dumps(reply)
+        return 0
+
+    # dirac-*
+    def Print(self, lines, errors):
+        for line in lines:
+            print line
+        for error in errors:
+            sys.stderr.write(error + '\n')
+        return 1 if errors else 0
+
+    def DoDiracDmsFindLfns(self, args):
+        path = name = ''
+        for arg in args:
+            if arg.startswith('--Path='):
+                path = arg[len('--Path='):]
+            elif arg.startswith('Name='):
+                name = arg[len('Name='):]
+        return self.Print(*self.Backend().DoFind(path, name or '*'))
+
+    def DoDiracDmsLfnReplicas(self, args):
+        return self.Print(*self.Backend().DoReplicas(args))
+
+    def DoDiracDmsLfnMetadata(self, args):
+        return self.Print(*self.Backend().DoMetadata(args))
+
+    def DoDiracDmsDataSize(self, args):
+        unit = 'MB'
+        for arg in args:
+            if arg.startswith('--Unit='):
+                unit = arg[len('--Unit='):]
+        lfns = [arg for arg in args if not arg.startswith('-')]
+        return self.Print(*self.Backend().DoSize(lfns, unit))
+
+    def DoDiracDmsRemoveFiles(self, args):
+        lock = self.Lock()
+        try:
+            status = self.Print(*self.Backend().DoRemove(args))
+            self.Save()
+        finally:
+            lock.close()
+        return status
+
+    def DoDiracDmsAddFile(self, args):
+        lock = self.Lock()
+        try:
+            status = self.Print(*self.Backend().DoAdd(*args[:3]))
+            self.Save()
+        finally:
+            lock.close()
+        return status
+
+    def DoDiracDmsReplicateLfn(self, args):
+        lock = self.Lock()
+        try:
+            lfn, se = args[:2]
+            status = self.Print(*self.Backend().DoReplicate(lfn, se))
+            if status == 0:
+                entry = self.Load()[lfn]
+                self.Store(entry['replicas'][se], entry.get('size', 0))
+            self.Save()
+        finally:
+            lock.close()
+        return status
+
+    # dirac-wms-*
+    def DoDiracWmsJobStatus(self, args):
+        jobids = [arg for arg in args if arg.isdigit()]
+        if '-f' in args:
+            jobids += [line.strip() for line in open(self.Option(args, '-f',
+                                                                 ''))
+                       if line.strip().isdigit()]
+        states = dict()
+        if os.path.exists(self.Path('wms.json')):
+            states = json.load(open(self.Path('wms.json')))
+        for jobid in jobids:
+            status, minor, site = states.get(jobid) or random.Random(
+                int(jobid)).choice(JOB_STATES)
+            print 'JobID=%s Status=%s; MinorStatus=%s; Site=%s;' % \
+                (jobid, status, minor, site)
+        return 0
+
+    def DoDiracWmsJobKill(self, args):
+        lock = self.Lock()
+        try:
+            states = dict()
+            if os.path.exists(self.Path('wms.json')):
+                states = json.load(open(self.Path('wms.json')))
+            for jobid in [arg for arg in args if arg.isdigit()]:
+                states[jobid] = ('Killed', 'Marked for termination', 'ANY')
+            with open(self.Path('wms.json'), 'w') as wms:
+                json.dump(states, wms)
+        finally:
+            lock.close()
+        return 0
+
+    # ldapsearch
+    def DoLdapsearch(self, args):
+        search = [arg for arg in args if 'GlueSEUniqueID=' in arg]
+        if not search:
+            return 0
+        host = search[0].split('GlueSEUniqueID=', 1)[1].split(')')[0]
+        if host in self.broken:
+            time.sleep(24 * 3600)
+        used = 0
+        for surl, (lfn, size) in self.Replicas().iteritems():
+            if surl.split('/')[2].split(':')[0] == host:
+                used += size
+        for directory, dirs, files in os.walk(self.Path('se', host)):
+            used += sum(os.path.getsize(os.path.join(directory, name))
+                        for name in files)
+        print 'dn: GlueSALocalID=t2k.org:T2KORGDISK,GlueSEUniqueID=%s,' \
+            'Mds-Vo-name=local,o=grid' % host
+        print 'GlueSAName: t2k.org:T2KORGDISK'
+        print 'GlueSAUsedOnlineSize: %d' % (used // 1024**3)
+        print 'GlueSAFreeOnlineSize: %d' % (100 * 1024)
+        print 'GlueSAUsedNearlineSize: 0'
+        print 'GlueSAFreeNearlineSize: 0'
+        print
+        return 0
+
+    def DoDiracProxyInfo(self, args):
+        print 'subject      : /C=UK/O=eScience/CN=fakegrid'
+        print 'timeleft     : 23:59:59'
+        return 0
+
+    def Run(self, command, args):
+        """run one command, returns its exit code"""
+        self.LogCall(command)
+        method = 'Do' + ''.join(part.capitalize()
+                                for part in command.split('-'))
+        time.sleep(self.latency)
+        if command not in RELIABLE and self.Fails():
+            sys.stderr.write('%s: fakegrid failure\n' % command)
+            return 1
+        return getattr(self, method)(args)
+
+
+def main():
+    command = os.path.basename(sys.argv[0])
+    if command in COMMANDS:
+        grid = FakeGrid(os.environ['FAKEGRID_ROOT'])
+        sys.exit(grid.Run(command, sys.argv[1:]))
+
+    parser = optparse.OptionParser(
+        usage='usage: %prog install|env root [options]')
+    parser.add_option('-n', '--files', type='int', default=1000,
+                      help='Files in the catalogue')
+    parser.add_option('-d', '--dirs', type='int', default=1,
+                      help='Directories the files are spread over')
+    parser.add_option('-s', '--size', type='int', default=100,
+                      help='Size of each file in MB')
+    parser.add_option('-o', '--online', action='store_true', default=False,
+                      help='Start with the tape files online')
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] not in ('install', 'env'):
+        parser.print_help()
+        sys.exit(1)
+
+    grid = FakeGrid(args[1])
+    if args[0] == 'install':
+        grid.Install(options.files, options.dirs, options.size,
+                     options.online)
+    for key, value in sorted(grid.Environment().iteritems()):
+        print 'export %s=%s' % (key, value)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python2
+"""
+Time the data management workflows against a FakeGrid.
+
+For every number of files a fresh fake grid is installed with that many
+files in one directory on RAL, and each workflow is run in its own
+process against it:
+
+    dir       ND280Dir construction (bulk catalogue queries)
+    sync      SyncSRM of the directory to TRIUMF with FTS, including
+              the tape recall and the wait for the transfers to finish
+    rep       SyncSRM of the directory to TRIUMF with lcg-rep workers
+    resync    PlanSyncSRM of the directory to TRIUMF again, failing if
+              a file rep put there is planned for copying
+    cleanup   RemoveFailedFTS.py over the FTS jobs left by sync (one
+              bulk query per 100 jobs)
+
+The report gives the wall time of each workflow and how many grid
+commands (subprocesses) it ran, in total and for the busiest commands.
+
+Example
+     ./RunBenchmarks.py -n 1000,10000,100000 -w dir,sync,cleanup
+
+     FAKEGRID_LATENCY=0.5 FAKEGRID_FAILRATE=0.01 ./RunBenchmarks.py -n 1000
+
+the second one with half a second per grid command and 1% failures.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+TOOLS = os.path.join(HERE, '..', 'tools')
+SCRIPTS = os.path.join(HERE, '..', 'data_scripts')
+
+import FakeGrid
+
+DIRECTORY = 'lfn:/t2k.org/nd280/benchmark/dir000'
+DESTINATION = 't2ksrm.nd280.org'
+
+# The code each workflow runs, in a fresh python process
+PROLOGUE = """
+import ND280GRID
+d = ND280GRID.ND280Dir(%r, bulk=True)
+""" % DIRECTORY
+
+WORKFLOWS = {
+    'dir': PROLOGUE,
+    'sync': PROLOGUE + """
+import ND280Transfers
+d.SyncSRM(%r, 1, '', 0)
+scheduler = ND280Transfers.GetTransferScheduler()
+ND280Transfers.GetChannelMonitor().WaitForCapacity(
+    [channel for job, channel, n in scheduler.jobs], 0)
+""" % DESTINATION,
+    'resync': PROLOGUE + """
+import sys
+import ND280DIRACAPI
+# forget the replicas, so the plan has to refresh them
+for f in d.ND280Files:
+    f.reps = list()
+plan = d.PlanSyncSRM(%r)
+plan.Print()
+replicas, failed = ND280DIRACAPI.GetBulkReplicas([f.alias for f in plan.copy])
+there = [lfn for lfn, reps in replicas.iteritems()
+         if [pfn for pfn in reps.values() if %r in pfn]]
+if there:
+    print '%%d files already on the SE planned for copying' %% len(there)
+    sys.exit(1)
+""" % (DESTINATION, DESTINATION),
+    'rep': PROLOGUE + """
+d.SyncSRM(%r, 0, '', 0, max_workers=8)
+""" % DESTINATION,
+    'cleanup': os.path.join(SCRIPTS, 'RemoveFailedFTS.py'),
+}
+ORDER = ['dir', 'sync', 'rep', 'resync', 'cleanup']
+
+
+def RunWorkflow(grid, name, session=False, verbose=False):
+    """run one workflow, returns (wall time, {command: times run},
+    exit code)"""
+    environment = dict(os.environ)
+    environment.update(grid.Environment())
+    environment['PYTHONPATH'] = TOOLS + os.pathsep + \
+        environment.get('PYTHONPATH', '')
+    if session:
+        environment['ND280DIRACSESSION'] = grid.catalogue_path
+
+    workflow = WORKFLOWS[name]
+    if workflow.endswith('.py'):
+        command = [sys.executable, workflow]
+    else:
+        command = [sys.executable, '-c', workflow]
+
+    before = grid.Calls()
+    output = None if verbose else open(os.devnull, 'w')
+    start = time.time()
+    code = subprocess.call(command, env=environment, cwd=grid.root,
+                           stdout=output, stderr=subprocess.STDOUT)
+    wall = time.time() - start
+    calls = grid.Calls()
+    for command_name, count in before.iteritems():
+        calls[command_name] -= count
+    return wall, dict((c, n) for c, n in calls.iteritems() if n), code
+
+
+def Report(results):
+    print '%-10s %8s %10s %10s  %s' % ('workflow', 'files', 'wall [s]',
+                                        'commands', 'busiest commands')
+    for result in results:
+        calls = result['calls']
+        busiest = sorted(calls.iteritems(), key=lambda (c, n): -n)[:3]
+        print '%-10s %8d %10.1f %10d  %s%s' % \
+            (result['workflow'], result['files'], result['wall'],
+             sum(calls.itervalues()),
+             ', '.join('%s %d' % call for call in busiest),
+             '' if result['code'] == 0 else '  (exit %d)' % result['code'])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n","--files",    dest="files",    type="string",help="Comma separated numbers of files",default='1000,10000,100000')
+    parser.add_option("-w","--workflows",dest="workflows",type="string",help="Comma separated workflows: "+','.join(ORDER),default='dir,sync,cleanup')
+    parser.add_option("-s","--size",     dest="size",     type="int",   help="Size of each file in MB",default=1)
+    parser.add_option("-t","--tape",     dest="tape",     type="int",   help="Start with the files on tape 1=yes 0=no",default=0)
+    parser.add_option("-d","--session",  dest="session",  type="int",   help="Answer catalogue queries from a DIRAC session 1=yes 0=no",default=0)
+    parser.add_option("-r","--root",     dest="root",     type="string",help="Directory to install the fake grids in",default='')
+    parser.add_option("-j","--json",     dest="json",     type="string",help="Also write the results to this JSON file",default='')
+    parser.add_option("-v","--verbose",  dest="verbose",  type="int",   help="Show the output of the workflows 1=yes 0=no",default=0)
+    (options, args) = parser.parse_args()
+
+    workflows = options.workflows.split(',')
+    for name in workflows:
+        if name not in WORKFLOWS:
+            parser.error('Unknown workflow %s' % name)
+
+    results = list()
+    for nfiles in [int(n) for n in options.files.split(',')]:
+        root = tempfile.mkdtemp(prefix='fakegrid.%d.' % nfiles,
+                                dir=options.root or None)
+        try:
+            grid = FakeGrid.FakeGrid(root)
+            grid.Install(nfiles, 1, options.size, not options.tape)
+            for name in [w for w in ORDER if w in workflows]:
+                wall, calls, code = RunWorkflow(grid, name, options.session,
+                                                options.verbose)
+                results.append({'workflow': name, 'files': nfiles,
+                                'wall': wall, 'calls': calls, 'code': code})
+                Report(results[-1:])
+        finally:
+            shutil.rmtree(root)
+
+    print
+    Report(results)
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(results, json_file, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+A script to check the completeness of a production over a whole dataset in
+one pass. The raw data directory and every processing level directory are
+listed once and merged by run-subrun, and the runs that are missing or
+duplicated at any level are written to a CSV or JSON report.
+
+Example
+     ./CheckCompleteness.py -s 4 -p 6B -l unpk,cali,reco,anal -o 6B_4.csv
+
+compares lfn:/grid/t2k.org/nd280/raw/ND280/ND280/00004000_00004999 with the
+unpk, cali, reco and anal directories of production006/B/rdp for that run
+range.
+
+     ./CheckCompleteness.py -o diff.json -F json lfn:/dir/A srm://se/dir/B /local/C
+
+compares arbitrary LFC, SRM and local directories.
+
+"""
+
+import ND280DirDiff
+import optparse
+import sys
+import time
+
+# Parser Options
+
+parser = optparse.OptionParser(usage='usage: %prog [options] [dir dir ...]')
+parser.add_option("-s","--set",    dest="set",    type="string",help="Set of raw data: e.g. 4 for 00004000_00004999")
+parser.add_option("-p","--prod",   dest="prod",   type="string",help="Production, e.g. 6B")
+parser.add_option("-l","--levels", dest="levels", type="string",help="',' delimited processing levels",default='unpk,cali,reco,anal')
+parser.add_option("-e","--evtype", dest="evtype", type="string",help="Only count files of this event type, e.g. spill")
+parser.add_option("-k","--key",    dest="key",    type="string",help="Compare by run, hash or stage",default='run')
+parser.add_option("-o","--output", dest="output", type="string",help="Output report file name")
+parser.add_option("-F","--format", dest="format", type="string",help="Report format csv or json",default='csv')
+parser.add_option("-a","--all",    dest="all",    type="int",   help="Report complete runs too 1=yes 0=no",default=0)
+parser.add_option("-n","--names",  dest="names",  type="int",   help="Report the file names 1=yes 0=no",default=0)
+(options,args) = parser.parse_args()
+
+###############################################################################
+
+# The start time.
+start = time.time()
+
+if options.key not in ND280DirDiff.KEYS or options.format not in ND280DirDiff.WRITERS:
+    parser.print_help()
+    sys.exit(1)
+
+dirs   = list(args)
+labels = list(args)
+if options.set and options.prod:
+    dataset = '%05d000_%05d999' % (int(options.set),int(options.set))
+    prodnr  = 'production%03d' % (int(options.prod[:-1]))
+    basedir = 'lfn:/grid/t2k.org/nd280/'
+
+    dirs   = [basedir + 'raw/ND280/ND280/' + dataset]
+    labels = ['raw']
+    for level in options.levels.split(','):
+        dirs.append(basedir + prodnr + '/' + options.prod[-1] + '/rdp/ND280/' + dataset + '/' + level)
+        labels.append(level)
+
+if len(dirs) < 2:
+    parser.print_help()
+    sys.exit(1)
+
+print 'Comparing contents of directories:'
+print '\n'.join(dirs)
+
+# list every directory once, lazily
+listings = list()
+for d in dirs:
+    names = ND280DirDiff.ListDirectory(d)
+    if options.evtype:
+        names = (n for n in names if 'nd280_' in n or '_' + options.evtype + '_' in n)
+    listings.append(names)
+
+output = sys.stdout
+if options.output:
+    output = open(options.output,'w')
+writer  = ND280DirDiff.WRITERS[options.format](output,labels,options.names)
+summary = ND280DirDiff.DiffListings(listings,labels,options.key,writer,not options.all)
+if options.output:
+    output.close()
+    print 'Wrote report to %s' % options.output
+
+summary.Print()
+print 'Finish time', time.time() - start
@@ -5,9 +5,9 @@ Clean Processed Data from T2:
 
 import os
 import sys
-from time import sleep
 import ND280GRID
 from ND280GRID import *
+import ND280Transfers
 import optparse
 from smtplib import SMTP
 from datetime import datetime
@@ -244,7 +244,7 @@ try:
                     ## Create an ND280Dir object for folder containing processed
                     ## data:
                     print 'Creating ND280Dir object for '+proc_path
-                    proc_dir = ND280Dir(proc_path,skipFailures=True,ls_timeout=3600)
+                    proc_dir = ND280Dir(proc_path,skipFailures=True,ls_timeout=3600,bulk=True)
 
                     ## ignore empty directories!
                     lines,errors = runLCG('lfc-ls '+proc_path.replace('lfn:',''))
@@ -483,26 +483,9 @@ try:
         ## Wait for FTS transfers
         if not is_cleared:
             print 'Waiting for FTS...'
-            while(1):
-                n_active = 0
-
-                # FTS3 ---
-                for source,dest in channel_list:
-                    transfers,statuses = GetActiveTransferList(source,dest)
-
-                    for t in transfers:
-                        active,failed,finished = GetTransferStatus(t,source,dest)
-
-                        # make sure the transfer query succeeded
-                        if type(active) is int:
-                            n_active += active
-                        # otherwise add large number to ensure loop persists
-                        else:
-                            n_active += 100
-
-                if n_active < 20:
-                    break
-                sleep(60)
+            ## Until fewer than 20 files are active on our channels
+            channels = [tuple(channel) for channel in channel_list]
+            ND280Transfers.GetChannelMonitor().WaitForCapacity(channels, 19)
 
         ## Increment counter
         n_repeats += 1
@@ -560,6 +543,7 @@ if message:
 
 
 print 'Finish time:',datetime.now()
+print 'Retries:',ND280GRID.ND280Comp.GetRetryPolicy().Summary()
 
 if options.noRegDark:
     sys.exit(0)
@@ -13,6 +13,8 @@ import os
 import sys
 import commands
 
+import ND280NameParser
+
 #Parser options
 
 parser = optparse.OptionParser()
@@ -152,14 +154,12 @@ for set in sets.split(','):
             # where=rawname.find('0000')
             # tag=rawname[where:where+13]
  
-            l = l.strip()
-
-            # extract the run-subrun tag from string (cheaper than creating ND280File and using GetRun())
-            # by removing the oa_xx_yyy progenitor and extracting the 13 digit aaaaaaaa-bbbb field
-            tag = l.replace('_'.join(l.split('_')[:3])+'_','')[:13]
-            tag = tag.replace('_','-')
-
-            extags.append(tag)
+            # the aaaaaaaa-bbbb run-subrun tag of the file name
+            tag = ND280NameParser.RunSubrunTag(ND280NameParser.ParseFileName(l))
+            if tag:
+                extags.append(tag)
+    # dict for constant time look up (set is the loop variable here)
+    extags = dict.fromkeys(extags)
 
     print 'Comparing ...'
 
@@ -173,81 +173,47 @@ for set in sets.split(','):
     # print 'rawlist:',rawlist
 
     for rawfile in rawlist:
-        rawparsed = rawfile.split('_')
         tag=''
 
         if input and not filename:
             if fstart not in rawfile or funtag in rawfile or funtag2 in rawfile:
                 continue
-            tag = rawparsed[-5]
+            tag = ND280NameParser.RunSubrunTag(ND280NameParser.ParseFileName(rawfile))
 
         elif filename:
-            rawparsed = rawfile.split('/')
-            rawfile2  = rawparsed[-1]
-
             # where=rawfile2.find('0000')
             # tset=rawfile2[where+4]
             # if tset != set:
             #     continue
             # tag=rawfile2[where:where+13]
-             
-            rawfile2 = rawfile2.strip()
-
-            # extract the run-subrun tag from string (cheaper than creating ND280File and using GetRun())
-            # by removing the subdetector_ progenitor and extracting the 13 digit aaaaaaaa-bbbb field that follows
-            if rawfile2.startswith('nd280_'):
-                tag = rawfile2.replace('_'.join(rawfile2.split('_')[:1])+'_','')[:13]
-            # respins, however, observe standard oa_nt_xxx* naming convention
-            else:
-                tag = rawfile2.split('_')[3]
+
+            # raw nd280_ files and respins (standard oa_nt_xxx* naming
+            # convention) both give an aaaaaaaa-bbbb tag
+            tag = ND280NameParser.RunSubrunTag(ND280NameParser.ParseFileName(rawfile))
             
             # print 'tag',tag
 
             if not tag.lstrip('0').startswith(set):
                 continue
-            
-            tag = tag.replace('_','-')
         else:
-            subrun = rawparsed[2].split('.')
-            tag    = rawparsed[1] + '-' + subrun[0]
-
-        skip=0
-        for extag in extags:
-            if tag in extag:
-                skip=1
-        if skip==1:
+            tag = ND280NameParser.RunSubrunTag(ND280NameParser.ParseFileName(rawfile))
+
+        if tag in extags:
             continue
         rawnum.append(tag)
         if filename:
             rawfilelist.append(rawfile.replace('\n',''))
         rawcount += 1
 
-    prolist=prolist_all[:]
-
-
     #Remove those with wrong tags
-    for profile in prolist_all:
-        if (((fstart not in profile) or (funtag in profile) or (funtag2 in profile))
-            and ('timeslip' in level and not 'timeslip' in profile)):
-            prolist.remove(profile)
-
-
-    #Processed tags
-    for profile in prolist:
-        far   = profile.split('/')                
-        pname = far[-1]
+    prolist = [profile for profile in prolist_all
+               if not (((fstart not in profile) or (funtag in profile) or (funtag2 in profile))
+                       and ('timeslip' in level and not 'timeslip' in profile))]
 
-        # where=pname.find('0000')
-        # tag=pname[where:where+13]
 
-        pname = pname.strip()
-
-        # extract the run-subrun tag from string (cheaper than creating ND280File and using GetRun())
-        # by removing the oa_xx_yyy progenitor and extracting the 13 digit aaaaaaaa-bbbb field
-        tag = pname.replace('_'.join(pname.split('_')[:3])+'_','')[:13]
- 
-        pronum.append(tag)
-        procount += 1
+    #Processed tags, parsed in one go
+    pronum   = ND280NameParser.ParseFileNames(prolist).Tags()
+    procount = len(pronum)
 
     #See which raw files have been processed
     processed            = []
@@ -262,30 +228,24 @@ for set in sets.split(','):
     #print 'pronum',pronum
 
 
-    index = 0
-    for num in rawnum:
-        ok = 0
-        pindex = 0
-        pindex_save = 0
-        for pnum in pronum:
-            if 'timeslip' in level: pnum = pnum.replace('_','-')
-            if num == pnum:
-                ok += 1
-                if ok > 1:
-                    multiple_level_lfn.append('lfn:' + prodir + '/' + prolist[pindex])
-                pindex_save = pindex
+    #Index the processed files by tag rather than scanning them for every raw file
+    protags = dict()
+    for pindex, pnum in enumerate(pronum):
+        protags.setdefault(pnum, []).append(pindex)
 
-            pindex += 1
+    for index, num in enumerate(rawnum):
+        pindices = protags.get(num, [])
 
-        if ok == 0:
+        if not pindices:
             if filename:
                 unprocessed_lfn.append(rawfilelist[index])
             else:
                 unprocessed_lfn.append('lfn:' + rawdir + '/' + rawlist[index])
-        elif ok == 1:
-            processed_level_lfn.append('lfn:' + prodir + '/' + prolist[pindex_save])
-
-        index += 1
+        elif len(pindices) == 1:
+            processed_level_lfn.append('lfn:' + prodir + '/' + prolist[pindices[0]])
+        else:
+            for pindex in pindices[1:]:
+                multiple_level_lfn.append('lfn:' + prodir + '/' + prolist[pindex])
 
 
     #Write output files containing the processed and unprocessed files
@@ -11,6 +11,7 @@ import os
 import sys
 import commands
 import ND280GRID
+import ND280NameParser
 
 # parse arguments
 parser = argparse.ArgumentParser()
@@ -39,7 +40,8 @@ def WriteOutFile(tag,outlines) :
 # method for writing an output file path to the list of output lines, returns run and subrun
 # assumes files observe the official naming format, script will barf if not
 def WriteRunLine(name,outlines) : 
-    run,subrun = name.split('_')[3].split('-')
+    record = ND280NameParser.ParseFileName(name)
+    run,subrun = ND280NameParser.FormatRun(record.run),ND280NameParser.FormatSubrun(record.subrun)
     outlines.append(outProj+'/'+args.lfcdir+'/'+name+'\n')
     return run,subrun
     
@@ -2,13 +2,11 @@
 
 #Python script to read and download a list of lfn filenames
 
+import ND280Computing
+import ND280Download
 import optparse
 import os
 import sys
-import time
-import pexpect
-import commands
-import popen2
 
 # Parser Options
 parser = optparse.OptionParser()
@@ -21,7 +19,9 @@ parser.add_option("-d","--dir",dest="dir",type="string",help="LFN dir to downloa
 parser.add_option("-f","--filename",dest="filename",type="string",help="File containing filenames to process")
 
 #Optional
-parser.add_option("-c","--check",dest="check",type="string",help="To check files in directory, otherwise download (1)")
+parser.add_option("-c","--check",dest="check",type="string",help="Checksum files already in the directory rather than trusting the manifest and size (1)")
+parser.add_option("-j","--jobs",dest="jobs",type="int",default=8,help="Number of files to download at once")
+parser.add_option("-p","--perse",dest="perse",type="int",default=3,help="Number of files to download at once from any one SE")
 
 (options,args) = parser.parse_args()
 
@@ -46,8 +46,6 @@ dir=options.dir
 if not dir and not filename:
     sys.exit('Please specify -d or -f')
 
-counter = 0
-
 filelist=[]
 
 standard='/grid/t2k.org/nd280/'
@@ -57,8 +55,9 @@ if dir:
         sys.exit("skip "+standard+" in LFN address")
 
     command = 'lfc-ls '+standard+dir
-    o,i,e=popen2.popen3(command)
-    lines=o.readlines()
+    lines,errors=ND280Computing.GetListPopenCommand(command)
+    if errors:
+        sys.exit('Could not list '+standard+dir)
     for l in lines:
         l.replace('\n','')
         lfn='lfn:'+standard+dir+'/'+l
@@ -73,52 +72,18 @@ elif filename:
 else:
     sys.exit('Please specify -f or -d')
 
-for fl in filelist:
-    fl = fl.replace('\n','')
-    far=fl.split('/')                
-    fname=far[-1]
-
-    print fname
-
-    foutname=outdir + '/' + fname
-
-    print foutname
-
-    if check:
-        if os.path.isfile(foutname):
-            print 'skipping'
-            continue
-        else:
-            print 'missing, downloading'
-
-    command = 'lcg-cp ' + fl + ' ' + foutname
-
-    ii=0
-    trials=0
-    while ii < 3 and trials < 10:
-        rmfile = commands.getstatusoutput('rm -rf ' + foutname)
-        child = pexpect.spawn(command,timeout=4000)
-        ii=child.expect(['Error','error',pexpect.TIMEOUT,'No such file',pexpect.EOF])
-        if ii < 3:
-            trials += 1
-            print 'Retrying...'
-
-    if ii == 4:
-        counter += 1
-        print child.before
-        time.sleep(1)
-    elif trials == 10:
-        print 'Failed, skipping'
-        continue
-    else:
-        sys.exit('Failed to download ' + fname)
-
-
-print 'Downloaded ' + str(counter) + ' files'
-
-
-
-
-
-
-
+# download in parallel, skipping the files that are already complete
+lfns=[fl.strip() for fl in filelist if fl.strip()]
+tasks,missing=ND280Download.TasksFromCatalogue(lfns,lambda lfn: outdir + '/' + os.path.basename(lfn))
+for fl in missing:
+    print 'Could not find ' + fl
+
+downloader=ND280Download.BulkDownloader(options.jobs,options.perse,os.path.join(outdir,'.nd280download.manifest'),bool(check))
+failed=downloader.Run(tasks)
+for task in failed:
+    print 'Failed to download ' + task.lfn + ' ' + ' '.join(task.errors)
+
+print downloader.Summary()
+print 'Downloaded ' + str(downloader.nDone) + ' files'
+if failed or missing:
+    sys.exit(1)
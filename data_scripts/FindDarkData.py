@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""
+A script to find dark data and orphans in an SRM directory tree.
+
+The SRM listing and the catalogue listing of the tree are streamed,
+sorted on disk and merged, so memory stays bounded however many files
+the directories hold. Three lists come out, with sizes:
+
+    dark       files on the SE that are not in the catalogue
+    missing    catalogue files (with a replica on -e, if given) that are
+               not on the SE
+    mismatch   files whose size on the SE differs from the catalogue
+
+written to <prefix>.dark, <prefix>.missing and <prefix>.mismatch, one
+"<relative path> <SE size> <catalogue size>" line per file.
+
+Example
+     ./FindDarkData.py -s srm://t2ksrm.nd280.org/nd280data/production006/B -e CA-TRIUMF-T2K-disk -o prod6B
+
+The LFN directory is the one the SRM directory holds, unless given with -l.
+
+"""
+
+import ND280DarkData
+import optparse
+import sys
+
+# Parser Options
+
+parser = optparse.OptionParser()
+parser.add_option("-s","--srmdir",dest="srmdir",type="string",help="srm directory to search")
+parser.add_option("-l","--lfcdir",dest="lfcdir",type="string",help="LFN directory to compare with",default='')
+parser.add_option("-e","--se",    dest="se",    type="string",help="Only count catalogue files with a replica on this DIRAC SE, e.g. RAL-disk",default='')
+parser.add_option("-o","--output",dest="output",type="string",help="Prefix of the output lists",default='darkdata')
+parser.add_option("-c","--chunk", dest="chunk", type="int",   help="Files sorted in memory at once",default=100000)
+parser.add_option("-j","--jobs",  dest="jobs",  type="int",   help="Catalogue directories listed at once",default=8)
+(options,args) = parser.parse_args()
+
+###############################################################################
+
+if not options.srmdir:
+    parser.print_help()
+    sys.exit(1)
+
+writer  = ND280DarkData.ListWriter(options.output)
+summary = ND280DarkData.DarkSummary()
+try:
+    for row in ND280DarkData.Compare(options.srmdir, options.lfcdir, options.se, options.chunk, options.jobs):
+        summary.Add(row)
+        writer.Write(row)
+except ND280DarkData.DarkDataError as exception:
+    sys.exit(str(exception))
+finally:
+    writer.Close()
+
+summary.Print()
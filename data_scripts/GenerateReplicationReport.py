@@ -149,13 +149,13 @@ def GenerateReplicationReport():
 
 
     # Create the ND280Dir object(s) and generate report(s)
-    LFCDir = ND280Dir(lfc_dir_name,skipFailures=True)
+    LFCDir = ND280Dir(lfc_dir_name,skipFailures=True,bulk=True)
 
     # A T2 style report, one for each raw/ND280/ND280 subdirectory
     if "raw/ND280/ND280" in lfc_dir_name and srm_opt == "ALL":
         for subFile in LFCDir.ND280Files:
             try:
-                LFCSubDir = ND280Dir(subFile.LFN(),skipFailures=True)
+                LFCSubDir = ND280Dir(subFile.LFN(),skipFailures=True,bulk=True)
                 DirectoryReport(report,LFCSubDir,SRMS,srm_opt)
             except:
                 report.append("Couldn't create ND280Dir object for "+subFile.LFN()+'\n')
@@ -167,7 +167,7 @@ def GenerateReplicationReport():
         for detector in DETECTORS:
             try:
                 path = 'lfn:/grid/t2k.org'+ND280GRID.GetCurrentRawDataPath(detector)
-                LFCSubDir = ND280Dir(path,skipFailures=True)
+                LFCSubDir = ND280Dir(path,skipFailures=True,bulk=True)
                 DirectoryReport(report,LFCSubDir,SRMS,srm_opt)
             except:
                 report.append("Couldn't create ND280Dir object for "+path+'\n')
@@ -176,7 +176,7 @@ def GenerateReplicationReport():
 
 
         #include INGRID
-        LFCSubDir = ND280Dir('lfn:/grid/t2k.org'+ND280GRID.GetCurrentRawDataPath('INGRID','INGRID'),skipFailures=True)
+        LFCSubDir = ND280Dir('lfn:/grid/t2k.org'+ND280GRID.GetCurrentRawDataPath('INGRID','INGRID'),skipFailures=True,bulk=True)
         DirectoryReport(report,LFCSubDir,SRMS,srm_opt)
 
     # A generic report for specified directory:
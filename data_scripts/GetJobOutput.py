@@ -1,12 +1,11 @@
 #!/usr/bin/env python 
 
 import optparse
-from ND280GRID import ND280JID, runLCG
+import ND280Computing
+from ND280GRID import ND280JIDResolver, runLCG
 import os
 import sys
 import commands
-import time
-import pexpect
 
 #Parser options
 parser = optparse.OptionParser()
@@ -138,6 +137,7 @@ smidnames = []
 dcounter = 0
 allcounter = 0
 unclear = 0
+todo = []
 for l in lines:
     allcounter += 1
 
@@ -153,54 +153,36 @@ for l in lines:
 
     set = midname[10]
     dataset = '0000' + set + '000_0000' + set + '999'
-    
-    gotit=0
-    for item in jidnames:
-        if jidname == item:
-            gotit = 1
-    if gotit == 1:
+
+    if jidname in jidnames:
         continue
-    
-    #Get job output
-    fjid = open(l,"r")
-    flines = fjid.readlines()
-    joblink = flines[1]
-    print joblink
-
-    #command = 'glite-wms-job-output --dir ' + outdir + ' ' + joblink
-    command = 'dirac-wms-job-get-output -f ' + self.jidfilename + ' --Dir ' + outdir
-
-    ii=0
-    timeouts = 0
-    while ii == 0:
-        child = pexpect.spawn(command,timeout=20)
-        #ii=child.expect([pexpect.TIMEOUT,'Error','ABORTED',pexpect.EOF])
-        ii = child.expect([pexpect.TIMEOUT, 'Error', pexpect.EOF])
-        # soph - dirac returns Error in the case you feed it rubbish
-        # soph - and it returns Error if the job was killed
-        #
-        #if ii == 3:
-        if ii == 2:
-            dcounter += 1
-            print child.before
-            time.sleep(1)
-        #elif ii == 1 or ii == 2:
-        elif ii == 1:
-            jj=child.expect([pexpect.EOF,'.* : '])
-            # soph - TODO - dont know what situation causes you to write 'n' ?
-            # soph - so hard to work out what the dirac equivalent is... no files to test on
-            if jj == 1:
-                child.sendline('n')
-            print 'Error' + child.before
-            unclear_out.write(lfnbase + dataset + '/' + midname + '\n')
-            unclear += 1
-        else:
-            print 'Timeout!'
-            timeouts += 1
-            if timeouts == 10:
-                ii = 1
-                unclear_out.write(lfnbase + dataset + '/' + midname + '\n')
-                unclear += 1
+    todo.append((l, lfnbase + dataset + '/' + midname))
+
+#Look up the status of every job at once, and get the output of the
+#finished ones many jobs per dirac-wms-job-get-output call
+resolver = ND280JIDResolver()
+finished = []
+for (l, rawname), j in zip(todo, resolver.Resolve([jidpath for jidpath, dummy in todo])):
+    if j is None or j.status not in ('Done', 'Failed'):
+        print 'No output for ' + l + ' ' + (j.status if j else 'unknown job')
+        unclear_out.write(rawname + '\n')
+        unclear += 1
+        continue
+    finished.append((j.jobid, rawname))
+
+nBatch = 100
+for first in range(0, len(finished), nBatch):
+    batch   = finished[first:first+nBatch]
+    command = 'dirac-wms-job-get-output --Dir ' + outdir + ' ' + ' '.join([jobid for jobid, rawname in batch])
+    result  = ND280Computing.GetRetryPolicy().Run(command, ND280Computing.StatusWait.kTimeout)
+    print '\n'.join(result.lines)
+    if result.returncode == 0 and not result.timedout:
+        dcounter += len(batch)
+        continue
+    print 'Error' + ' '.join(result.errors)
+    for jobid, rawname in batch:
+        unclear_out.write(rawname + '\n')
+        unclear += 1
 
 
 #Look at all the job output
@@ -1,13 +1,17 @@
 #!/usr/bin/env python 
 
+"""
+Write the status lists of an MC production, from the job-state store
+(see ND280JobStore and GetJobStatus.py).
+"""
+
+import glob
 import optparse
 import ND280GRID
-from ND280GRID import ND280JID, runLCG
+import ND280JobStore
 import os
 import sys
-import commands
 import time
-import pexpect
 
 #Parser Options
 parser = optparse.OptionParser()
@@ -23,6 +27,9 @@ parser.add_option("-b","--bigrun", dest="bigrun", type="string",help="[mandatory
 parser.add_option("-j","--job",     dest="job",     default='MC', help="Job type: MC or Custom")
 parser.add_option("-f","--filename",dest="filename",default='',   help="File containing filenames to process")
 parser.add_option("-r","--runno",   dest="runno",   default='',   help="Run number, or start of - used for listing")
+parser.add_option(     "--nBatch",  dest="nBatch",  type=int, default=250, help="Number of statuses to check per dirac-wms-job-status call")
+parser.add_option("-w","--workers", dest="workers", type=int, default=8,   help="Number of dirac-wms-job-status calls to run at once")
+parser.add_option(     "--db",      dest="db",      default='',   help="Job-state store, default <outdir>/jobs.db")
 
 (options,args) = parser.parse_args()
 
@@ -91,69 +98,35 @@ for tag in prod, job, version, set, bigrun, runno:
         nameend += '_' + tag
 nameend += '.list'
 
-#Write file with running runs
-running_filename = 'running_status' + nameend
-rmrunning = commands.getstatusoutput('rm -rf ' + running_filename)
-running_out = open(running_filename,'w')
-
-#Write file with waiting runs
-waiting_filename = 'waiting_status' + nameend
-rmwaiting = commands.getstatusoutput('rm -rf ' + waiting_filename)
-waiting_out = open(waiting_filename,'w')
-
-#Write file with unclear runs
-unclear_filename = 'unclear_status' + nameend
-rmunclear = commands.getstatusoutput('rm -rf ' + unclear_filename)
-unclear_out = open(unclear_filename,'w')
-
-#Write file with cleared runs
-clear_filename = 'cleared_status' + nameend
-rmclear = commands.getstatusoutput('rm -rf ' + clear_filename)
-clear_out = open(clear_filename,'w')
-
-#Write file with failed runs
-failed_filename = 'failed_status' + nameend
-rmfailed = commands.getstatusoutput('rm -rf ' + failed_filename)
-failed_out = open(failed_filename,'w')
-
-#Write file with failed runs
-failedce_filename = 'failed_ce_info_' + nameend
-rmfailedce = commands.getstatusoutput('rm -rf ' + failedce_filename)
-failedce_out = open(failedce_filename,'w')
-
-#Write file with OK runs
-OK_filename = 'ok_status' + nameend
-rmok = commands.getstatusoutput('rm -rf ' + OK_filename)
-OK_out = open(OK_filename,'w')
+#The status lists, written from the job-state store
+listnames = {ND280JobStore.kRunning : 'running_status' + nameend,
+             ND280JobStore.kWaiting : 'waiting_status' + nameend,
+             ND280JobStore.kUnclear : 'unclear_status' + nameend,
+             ND280JobStore.kCleared : 'cleared_status' + nameend,
+             ND280JobStore.kFailed  : 'failed_status'  + nameend,
+             'failed_ce'            : 'failed_ce_info_'+ nameend,
+             ND280JobStore.kOK      : 'ok_status'      + nameend}
 
 #Write file with missing runs
 missing_filename = 'missing_status' + nameend
-rmmissing = commands.getstatusoutput('rm -rf ' + missing_filename)
 missing_out = open(missing_filename,'w')
 
-#File of jids to be checked
-tmpjid = outdir + '/tmpjid.'+str(os.getpid())+'.txt'
-
-
+pattern = outdir + '/' + basename + '_' + version + '_' + bigrun
+if runno:
+    pattern += runno
+pattern += '*.jid'
+print pattern
+djids = sorted(glob.glob(pattern))
 
 ninput=0
 nmissing=0
 jids=[]
+inputs={}
 #Input file
 #-----------------------------
 if filename:
     print 'Status from file'
 
-    command = 'ls ' + outdir + '/' + basename + '_' + version 
-    command += '_'+bigrun
-
-    if runno:
-        command += runno
-    command += '*.jid'
-    print command
-    lines,errors  = runLCG(command,is_pexpect=False)
-    djids = lines
-
     listfile=open(filename,'r')
     filelist=listfile.readlines()
     
@@ -174,18 +147,15 @@ if filename:
         tag=rawname[where:where+13]
         tag=tag.replace('-','_')
         rname=basename + '_' + version + '_' + tag
-        
-        lname=outdir + '/'
-        indir=0
+        inputs[tag]=lfnbase+mcname
+
+        lname=''
         for d in djids:
             if rname in d:
-                d=d.replace('\n','')
-                dar=d.split('/') 
-                indir=1
-                lname+=dar[-1]
+                lname=d
                 break
 
-        if indir == 1 and os.path.isfile(lname):
+        if lname and os.path.isfile(lname):
             jids.append(lname)
         else:
             nmissing+=1
@@ -197,236 +167,50 @@ if filename:
 #-----------------------------
 else:
     print 'Loop over jid files...'
-    command = 'ls ' + outdir + '/' + basename + '_' + version 
-    command += '_'+bigrun
-    if runno:
-        command += runno
-    command += '*.jid'
-    print command
-    lines,errors = runLCG(command,is_pexpect=False)
-    jids         = lines
-    jiderrors    = errors
-
-#----------------------------------------------
-allcounter = 0
-unclear    = 0
-ok         = 0
-failed     = 0
-running    = 0
-waiting    = 0
-counter    = 0
-clear      = 0
-
-#Call glite-wms-job-status in packets of size nl
-nl = 250
-njids=len(jids)
-print njids
-for i in range(0,njids/nl+1):
-    print str(i) + ' ' + str(counter)
-
-    #Write file with jid addresses
-    rmtmp = commands.getstatusoutput('rm -rf '+ tmpjid)
-    tmpout = open(tmpjid,'w')
-    jidlines = {}
-    for j,l in enumerate(jids):
-        if j < i*nl:
-            continue
-        if j >= (i+1)*nl:
-            break
-        lname = l.replace('\n','')
-        try:
-            fout = open(lname,"r")
-            flines = fout.readlines()            
-        except:
-            # if this is running in parallel with job submission, the jid file may
-            # disappear, in which case ignore the job
-            flines = []
-        
-        for fline in flines:
-            if not 'http' in fline:
-                continue
-            tmpout.write(fline)
-            jidlines[str(fline.replace('\n',''))] = str(lname)
-            counter += 1
-
-        fout.close()
-
-    tmpout.close()
-
-    #Get status
-    #--------------------------------------------
-    print 'Getting status'
-    command = "glite-wms-job-status --noint -i " + tmpjid
-    child = pexpect.spawn(command,timeout=300)
-    #child.expect('.*:')
-    #child.sendline('a')
-
-    ii = 0
-    timeouts = 0
-    index = -1
-    while ii < 3 and timeouts < 10:
-        ii = child.expect(["Success ===========",pexpect.TIMEOUT,pexpect.EOF])
-        if ii == 1:
-            print 'Timeout!'
-            timeouts += 1
-            time.sleep(10)
-            continue
-        if ii == 2:
-            break
-        
-        ii = child.expect(["Error",pexpect.TIMEOUT,"https://[a-zA-Z0-9_:/.-]+",pexpect.EOF])
-
-        if ii == 0:
-            print 'glite-wms-job-status error'
-            continue
-        if ii == 1:
-            print 'Timeout!'
-            timeouts += 1
-            time.sleep(10)
-            continue
-        if ii == 3:
-            break
-
-        print '-----------------------------------'
-        allcounter += 1
-        index += 1
-
-        site = str(child.after)
-        print site
-
-        #Get jid name
-        if not site in jidlines:
-            print 'Site error:', site
-            continue
-        
-        jid = jidlines[site]
-        jid = jid.replace('\n','')
-        jar=jid.split('/')                
-        jidname=jar[-1]
-        midname=jidname.replace(basename + '_','nd280')
-        midname=midname.replace(version,'')
-        numtag=midname[6:19]
-
-        for l in filelist:
-            l = l.replace('\n','')
-            far=l.split('/')
-            mcname=far[-1]
-            where=mcname.find(bigrun)
-            mctag=mcname[where:where+13]
-            mctag=mctag.replace('-','_')
-
-
-            if numtag == mctag:
-                rawname=lfnbase+mcname
-
-        print jid
-        print rawname
-
-        sar = site.split('/')
-        sitelong = sar[-2]
-        sitelongar = sitelong.split(':')
-        site = sitelongar[0]
-        print 'WMS:  ' + site
-
-        ii = child.expect(["Current Status: \s+([a-zA-Z0-9_() ]+)",pexpect.EOF])
-
-        #### Get the current status
-        status=''
-        exitcode=''
-        dest=''
-        if ii == 0:
-            status = child.match.groups()[0]
-        else:
-            print 'Info failed'
-            unclear_out.write(rawname + '\n')
-            unclear += 1
-            continue 
-        """
-        if 'Cancelled' in status:
-            print 'Cancelled'
-            unclear_out.write(rawname + '\n')
-            unclear += 1
-            continue 
-        """
-        
-        if "Done" in status:
-            ii=child.expect(["Exit code: \s+([0-9]+)",pexpect.EOF])
-            if ii == 0:
-                exitcode = child.match.groups()[0]
-            else:
-                print 'Unclear 1 ' + str(ii)
-                unclear_out.write(rawname + '\n')
-                unclear += 1
-                continue
-        elif "Waiting" in status:
-            print status
-            waiting_out.write(rawname + '\n')
-            waiting += 1
-            continue
-
-        ii=child.expect(["Status Reason:  \s+([a-zA-Z0-9_' ]+)",pexpect.EOF])
-        if ii == 0:
-            statusreason=child.match.groups()[0]
-        else:
-            print 'Unclear 2 ' + str(ii)
-            unclear_out.write(rawname + '\n')
-            unclear += 1
-            continue
-
-        
-        ii=child.expect(["Destination:   \s+([a-zA-Z0-9_.]+)",pexpect.EOF])
-        if ii == 0:
-            dest=child.match.groups()[0]
-            print 'CE:   ' + dest
-        else:
-            print 'Unclear 3 ' + str(ii)
-            unclear_out.write(rawname + '\n')
-            unclear += 1
-            continue
-
-        if 'Done' in status:
-            if exitcode == '0' and not 'Failed' in status:
-                print 'OK'
-                OK_out.write(rawname + '\n')
-                ok += 1
-            else:
-                print 'Failed'
-                failed_out.write(rawname + '\n')
-                failedce_out.write(dest + ' ' + rawname + '\n')
-                failed += 1
-        elif 'Aborted' in status or 'Undef' in status or 'Unknown' in status or 'Cancelled' in status:
-            print status + ' ' + statusreason
-            unclear_out.write(rawname + '\n')
-            unclear += 1
-        elif 'Running' in status:
-            print status
-            running_out.write(rawname + '\n')
-            running += 1
-        elif 'Scheduled' in status or 'Ready' in status or 'Waiting' in status or 'Submitted' in status:
-            print status
-            waiting_out.write(rawname + '\n')
-            waiting += 1
-        elif 'Cleared' in status:
-            print 'Cleared'
-            clear_out.write(rawname + '\n')
-            clear += 1
-        else:
-            print 'Strange value: ' + status
+    jids = djids
+missing_out.close()
+
+def MCInput(jidfile):
+    """the input LFN of a jid file, from the tag in its name"""
+    jidname=jidfile.split('/')[-1]
+    midname=jidname.replace(basename + '_','nd280')
+    midname=midname.replace(version,'')
+    numtag=midname[6:19]
+    return inputs.get(numtag,jidname)
+
+#Update the store from the jid files that changed and the jobs that have not finished
+#-------------------------------------------------------------
+start = time.time()
+store = ND280JobStore.JobStore(options.db or outdir + '/jobs.db')
+nnew  = store.ScanJIDFiles(jids, MCInput)
+print str(nnew) + ' new jobs, ' + str(len(store.Active())) + ' to check'
+nchanged = store.Refresh(options.workers, options.nBatch)
+print str(nchanged) + ' jobs changed state in ' + str(store.nQueries) + ' dirac-wms-job-status calls, %.0f s' % (time.time() - start)
 
+jobs   = store.Jobs(jids)
+counts = ND280JobStore.WriteLists(jobs, listnames)
+store.Close()
 
 #-------------------------------------------------------------
+allcounter = len(jobs)
+running = counts.get(ND280JobStore.kRunning,0)
+waiting = counts.get(ND280JobStore.kWaiting,0)
+ok      = counts.get(ND280JobStore.kOK,0)
+failed  = counts.get(ND280JobStore.kFailed,0)
+unclear = counts.get(ND280JobStore.kUnclear,0)
+clear   = counts.get(ND280JobStore.kCleared,0)
+
 print 'Checked ' + str(allcounter) + ' jobs'
 if filename:
     print str(ninput) + ' input files'
-print str(counter) + ' jid files'
-print str(running) + ' running jobs written to '   + running_filename
-print str(waiting) + ' waiting jobs written to '   + waiting_filename
-print str(ok)      + ' OK runs written to '        + OK_filename
-print str(failed)  + ' failed runs written to '    + failed_filename
-print str(failed)  + ' failed ce info written to ' + failedce_filename
-print str(unclear) + ' unclear runs written to '   + unclear_filename
-print str(clear)   + ' cleared runs written to '   + clear_filename
+print str(len(jids)) + ' jid files'
+print str(running) + ' running jobs written to '   + listnames[ND280JobStore.kRunning]
+print str(waiting) + ' waiting jobs written to '   + listnames[ND280JobStore.kWaiting]
+print str(ok)      + ' OK runs written to '        + listnames[ND280JobStore.kOK]
+print str(failed)  + ' failed runs written to '    + listnames[ND280JobStore.kFailed]
+print str(failed)  + ' failed ce info written to ' + listnames['failed_ce']
+print str(unclear) + ' unclear runs written to '   + listnames[ND280JobStore.kUnclear]
+print str(clear)   + ' cleared runs written to '   + listnames[ND280JobStore.kCleared]
 if filename:
     print str(nmissing) + ' missing runs written to ' + missing_filename
 print 'Checksum ' + str(unclear + failed + ok + running + waiting + clear) + ' ' + str(allcounter)
-
@@ -8,9 +8,11 @@ Any other suggestions please e-mail me, b.still@qmul.ac.uk
 
 import ND280GRID
 from ND280GRID import ND280Dir
-from ND280GRID import ND280File
+import ND280Download
+import ND280NameParser
 import optparse
 import os
+import sys
 
 # Parser Options
 
@@ -59,19 +61,20 @@ except:
     sys.exit('Could not see ' + destination + ' please double check it exists.')
 
 
-for file_name,size in source_dir.dir_dic.iteritems():
-    if not run in file_name:
+# pick the files of this run (and subrun) by name, no need to look each one up
+lfns=[]
+for file_name in source_dir.dir_dic:
+    record=ND280NameParser.ParseFileName(file_name)
+    if record.run < 0 or ND280NameParser.FormatRun(record.run) != run:
         continue
-    f=ND280File(source_dir.dir + '/' + file_name)
-    print 'Run ' + run + ' not in ' + f.GetRunNumber()
-    if run == f.GetRunNumber():
-        if not subrun:
-            f.Copy(dest_dir)
-        elif subrun == f.GetSubRunNumber():
-            f.Copy(dest_dir)
-        else:
-            continue
-    else:
+    if subrun and int(subrun) != record.subrun:
         continue
-
-    
+    lfns.append(source_dir.dir.rstrip('/') + '/' + file_name)
+
+# download them in parallel
+tasks,missing=ND280Download.TasksFromCatalogue(lfns,lambda lfn: dest_dir.dir.rstrip('/') + '/' + os.path.basename(lfn))
+downloader=ND280Download.BulkDownloader(manifest=os.path.join(destination,'.nd280download.manifest'))
+failed=downloader.Run(tasks)
+for f in missing + [t.lfn for t in failed]:
+    print 'Failed to get ' + f
+print downloader.Summary()
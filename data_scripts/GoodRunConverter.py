@@ -3,6 +3,8 @@
 import optparse
 import sys
 
+import ND280NameParser
+
 parser = optparse.OptionParser()
 parser.add_option("-f","--filename",dest="filename",type="string",help="File containing filenames to process")
 parser.add_option("-o","--outname",dest="outname",type="string",help="Output file name")
@@ -23,8 +25,6 @@ listfile.close()
 outfile=open(outname,'w')
 
 lfnbase='lfn:/grid/t2k.org/nd280/raw/ND280/ND280/'
-filebase='nd280_0000'
-fileend='.daq.mid.gz'
 
 for i,f in enumerate(filelist):
 
@@ -35,18 +35,10 @@ for i,f in enumerate(filelist):
     run=str(thisline[0])
     subrun=str(thisline[1])
 
-    setnr=str(run[0])
-    set='0000'+setnr+'000_0000'+setnr+'999/'
-
-    if len(subrun) == 3:
-        subrun = '0'+subrun
-    elif len(subrun) == 2:
-        subrun = '00'+subrun
-    elif len(subrun) == 1:
-        subrun = '000'+subrun
-    else:
+    if len(subrun) > 4:
         sys.exit('Bad length: '+str(f))
-    filename=lfnbase+set+filebase+run+'_'+subrun+fileend
+    set=ND280NameParser.FormatRunRange(run)+'/'
+    filename=lfnbase+set+ND280NameParser.FormatRawName(run, subrun)
     outfile.write(filename+'\n')
 
 outfile.close()
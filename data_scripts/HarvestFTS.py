@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""
+A long running script that harvests failed FTS transfers and resubmits them.
+
+Every interval it queries all the FTS jobs in $ND280TRANSFERS/transfers*log
+in parallel, sorts the failed files by reason (source missing, timeout,
+destination full, other), resubmits the retryable ones in new batched FTS
+jobs with a backoff that doubles with each attempt, and adds missing sources
+to the dud list $ND280TRANSFERS/duds.log. Retries waiting for their backoff
+are kept in $ND280TRANSFERS/harvest.json, so the script can be restarted.
+
+Example
+     ./HarvestFTS.py -i 600 -a 5
+
+-i 0 harvests once and exits, -r 0 only classifies and logs the failures.
+
+"""
+
+import ND280Harvester
+import optparse
+import os
+import sys
+
+# Parser Options
+
+parser = optparse.OptionParser()
+parser.add_option("-i","--interval",dest="interval",type="int",help="Seconds between harvests, 0 harvests once",default=600)
+parser.add_option("-a","--attempts",dest="attempts",type="int",help="Transfer attempts before giving up on a file",default=5)
+parser.add_option("-j","--jobs",    dest="jobs",    type="int",help="FTS queries run at once",default=8)
+parser.add_option("-r","--resubmit",dest="resubmit",type="int",help="Resubmit failed transfers 1=yes 0=no",default=1)
+(options,args) = parser.parse_args()
+
+###############################################################################
+
+if not os.getenv("ND280TRANSFERS"):
+    sys.exit("Please set $ND280TRANSFERS")
+
+harvester = ND280Harvester.FailureHarvester(max_workers=options.jobs,
+                                            max_attempts=options.attempts,
+                                            resubmit=options.resubmit)
+if options.interval > 0:
+    harvester.Run(options.interval)
+else:
+    harvester.Harvest()
+    print harvester.Summary()
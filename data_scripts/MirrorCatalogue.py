@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+A script to create or refresh the local SQLite mirror of the file catalogue.
+Only directories whose modification time changed since the last run are
+listed again, so it is cheap to run from cron before the scripts that read
+the mirror (set ND280CATALOGUE to the database to have ND280Dir use it).
+
+Example
+     ./MirrorCatalogue.py -d catalogue.db /t2k.org/nd280/production006/B/mcp
+
+     ./MirrorCatalogue.py -d catalogue.db -s RAL-disk /t2k.org/nd280/raw
+
+prints the files and replicas of each tree, the second one also lists the
+files with no replica on RAL-disk.
+
+"""
+
+import ND280Catalogue
+import optparse
+import os
+import sys
+import time
+
+# Parser Options
+
+parser = optparse.OptionParser(usage='usage: %prog [options] path [path ...]')
+parser.add_option("-d","--db",      dest="db",      type="string",help="Mirror database",default=os.getenv('ND280CATALOGUE',''))
+parser.add_option("-j","--jobs",    dest="jobs",    type="int",   help="Directories listed in parallel",default=8)
+parser.add_option("-f","--force",   dest="force",   type="int",   help="Re-list every directory and replica 1=yes 0=no",default=0)
+parser.add_option("-r","--replicas",dest="replicas",type="int",   help="Look up replicas 1=yes 0=no",default=1)
+parser.add_option("-x","--fixture", dest="fixture", type="string",help="Crawl a JSON fixture catalogue instead of DIRAC",default='')
+parser.add_option("-l","--local",   dest="local",   type="string",help="Crawl this local directory tree instead of DIRAC",default='')
+parser.add_option("-s","--se",      dest="se",      type="string",help="Also list the files without a replica on this SE")
+(options,args) = parser.parse_args()
+
+###############################################################################
+
+if not options.db or not args:
+    parser.print_help()
+    sys.exit(1)
+
+# The start time.
+start = time.time()
+
+if options.local:
+    lister = ND280Catalogue.LocalLister(options.local, args[0])
+else:
+    lister = ND280Catalogue.DIRACLister(options.fixture)
+
+mirror = ND280Catalogue.CatalogueMirror(options.db)
+try:
+    for path in args:
+        print 'Refreshing %s' % path
+        mirror.Refresh(path, lister, options.jobs, options.replicas,
+                       options.force)
+        if options.force and options.replicas:
+            mirror.RefreshReplicas(path, lister, options.jobs)
+        print 'Listed %d directories, %d unchanged' % (mirror.nListed,
+                                                       mirror.nSkipped)
+
+        nFiles, size = mirror.Size(path)
+        print '%10d files, %.3f GB in %s' % (nFiles, size/1024.**3, path)
+        for se, count in sorted(mirror.ReplicaCounts(path).iteritems()):
+            print '%10d replicas on %s' % (count, se)
+
+        if options.se:
+            missing = mirror.FilesOnSE(options.se, path, present=False)
+            print '%10d files without a replica on %s' % (len(missing),
+                                                          options.se)
+            print '\n'.join(missing)
+finally:
+    lister.Close()
+    mirror.Close()
+
+print 'Finish time', time.time() - start
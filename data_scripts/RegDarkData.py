@@ -58,7 +58,7 @@ def main():
     # object for those files contained therin if a directory is specified
     if lfc_dir_name:
         print 'Creating ND280Dir object for ',lfc_dir_name
-        lfc_dir   = ND280Dir(lfc_dir_name,skipFailures=True)
+        lfc_dir   = ND280Dir(lfc_dir_name,skipFailures=True,bulk=True)
         lfc_files = lfc_dir.ND280Files
 
     # Keep a list of files that threw an exception
@@ -6,11 +6,17 @@ Sometimes small numbers of dark files are present in SE directories,
 such directories being identified by the archiving/cleanup scripts.
 Use this quick and dirty script to register these dark files.
 
+Dark files are found by merging sorted SRM and catalogue listings of the
+whole tree (see ND280DarkData) and registered in bulk (see
+ND280Registration), the SE is the DIRAC name of the SE holding srmdir,
+e.g. RAL-disk.
+
 jonathan perkin 20120217
 
 """
 
-from ND280GRID import *
+import ND280DarkData
+import ND280Registration
 import optparse
 import sys
 
@@ -18,57 +24,35 @@ import sys
 # Parser Options
 parser = optparse.OptionParser()
 parser.add_option("-s","--srmdir",dest="srmdir",type="string",help="srm directory to register dark data from")
+parser.add_option("-e","--se",    dest="se",    type="string",help="DIRAC name of the SE, e.g. RAL-disk")
+parser.add_option("-j","--jobs",  dest="jobs",  type="int",   help="Checksums run at once",default=8)
 (options,args) = parser.parse_args()
 
-if not options.srmdir:
+if not options.srmdir or not options.se:
     parser.print_help()
     sys.exit(1)
 
 srmdir = options.srmdir.rstrip('/')
-    
-# Get the list of files in this directory - try and avoid limitations of lcg-ls
-files  = []
-nLines = 999
-offset = 0
-
-while 1:
-    command = 'lcg-ls -c %d -o %d %s' % (nLines,offset,srmdir)
-    lines,errors = runLCG(command,in_timeout=3600)
-
-    # break out when end of listing has been reached
-    if not lines : break
-    if lines[0].rstrip('/').split('/')[-1] == srmdir.rstrip('/').split('/')[-1] : break
-
-    files  += [rmNL(line.split('/')[-1]) for line in lines]
-    offset += nLines
-
-
-# Get corresponding lfc path
-srmroot = se_roots[GetSEFromSRM(srmdir)]
-
-# Just in case the dark data isn't in the nd280 folder, truncate it from the SR root directory
-if not 'nd280/' in srmdir : 
-    srmroot = srmroot.rstrip('nd280/')
-
-# Formulate the logical file path
-lfcdir = 'lfn:/grid/t2k.org/nd280'+srmdir.replace(srmroot,'')
-lfcdir = lfcdir.rstrip('/')
-
-# Register them
-for file in files:
-    
-    # does a GUID already exist?
-    command = 'lcg-lg '+lfcdir+'/'+file
-    lines,errors = runLCG(command,in_timeout=3600)
-
-    if lines:
-        guid = rmNL(lines[0])
-        command = 'lcg-rf -g '+guid+' '+srmdir+'/'+file
-        lines,errors = runLCG(command)
-
-    else:
-        command = 'lcg-rf -l '+lfcdir+'/'+file+' '+srmdir+'/'+file
-        lines,errors = runLCG(command)
 
-    if errors: print errors
-    
+# Find the files on the SE without a catalogue replica there, comparing
+# sorted listings of the whole tree rather than paging lcg-ls into a list
+triples = []
+try:
+    lfcdir = ND280DarkData.CatalogueDirectory(srmdir)
+    for row in ND280DarkData.Compare(srmdir, lfcdir, options.se):
+        if row.status == ND280DarkData.kDark:
+            triples.append((srmdir+'/'+row.path, lfcdir+'/'+row.path, options.se))
+        elif row.status == ND280DarkData.kMismatch:
+            print '%s has size %d on the SE but %d in the catalogue' % (row.path, row.se_size, row.catalogue_size)
+except ND280DarkData.DarkDataError as exception:
+    sys.exit(str(exception))
+
+if not triples:
+    print 'No dark files in '+srmdir
+    sys.exit(0)
+
+# Register them, files already registered on the SE are left alone
+tasks, registrar = ND280Registration.RegisterMany(triples, options.jobs)
+
+print registrar.Table([task for task in tasks if task.status != ND280Registration.kExists])
+print registrar.Summary(tasks)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+A script to register many files in the DIRAC file catalogue at once.
+
+The list has one file per line: the source, the LFN and the DIRAC SE, e.g.
+
+/data/prod6/oa_nd_spl_00004000-0000_xxx_anal_000_prod6.root /t2k.org/nd280/production006/.../oa_nd_spl_00004000-0000_xxx_anal_000_prod6.root RAL-disk
+srm://t2ksrm.nd280.org/nd280data/production006/.../file.root /t2k.org/nd280/production006/.../file.root CA-TRIUMF-T2K-disk
+
+Local files are uploaded to the SE, SURLs registered as they are. Existing
+entries are found with one catalogue query, uploads run -j at a time and
+SURLs are registered in batches. Checksums are verified against the
+catalogue, and a table of the result for every file is printed (or
+written to -o).
+
+Example
+     ./RegisterFiles.py -f outputs.txt -j 16 -o registration.txt
+
+"""
+
+import ND280Registration
+import optparse
+import sys
+
+# Parser Options
+
+parser = optparse.OptionParser()
+parser.add_option("-f","--filelist",dest="filelist",type="string",help="File of <source> <LFN> <SE> lines")
+parser.add_option("-j","--jobs",    dest="jobs",    type="int",   help="Uploads run at once",default=8)
+parser.add_option("-c","--chunk",   dest="chunk",   type="int",   help="Files per catalogue query or registration",default=500)
+parser.add_option("-o","--output",  dest="output",  type="string",help="Write the result table to this file",default='')
+(options,args) = parser.parse_args()
+
+###############################################################################
+
+if not options.filelist:
+    parser.print_help()
+    sys.exit(1)
+
+triples = []
+for line in open(options.filelist):
+    words = line.split()
+    if not words or words[0].startswith('#'):
+        continue
+    if len(words) != 3:
+        sys.exit('Expected <source> <LFN> <SE>, not: '+line)
+    triples.append(words)
+
+tasks, registrar = ND280Registration.RegisterMany(triples, options.jobs, options.chunk)
+
+table = registrar.Table(tasks)
+if options.output:
+    open(options.output,'w').write(table+'\n')
+else:
+    print table
+print registrar.Summary(tasks)
+
+if [task for task in tasks if task.status in (ND280Registration.kFailed, ND280Registration.kBadChecksum)]:
+    sys.exit(1)
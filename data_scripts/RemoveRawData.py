@@ -29,7 +29,7 @@ if not lfc_dir_name or not 'lfn:/' in lfc_dir_name or not srm_opt:
     sys.exit(1)
     
 # Create the N280Dir object
-LFCDir = ND280Dir(lfc_dir_name,ls_timeout=3600)
+LFCDir = ND280Dir(lfc_dir_name,ls_timeout=3600,bulk=True)
 
 # Keep list of files that are not at RAL - don't delete!
 missingFromRAL = []
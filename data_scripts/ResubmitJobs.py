@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Resubmit the failed jobs of a processing production and ban the sites
+that fail too many of them.
+
+The job-state store (see ND280JobStore, by default <outdir>/jobs.db) is
+brought up to date as GetJobStatus.py does, then the failed jobs are
+sorted by minor status and resubmitted with a backoff that doubles with
+each attempt, until --attempts attempts have failed (see ND280Resubmit).
+Input data failures are never resubmitted. Sites where a --threshold
+fraction of at least --min-jobs jobs failed in the last --window hours
+are banned for --ban hours, and left out of every resubmission. The
+resubmissions and bans are recorded in the store, so the script can be
+run from cron.
+
+Example
+     ./ResubmitJobs.py -o $ND280JOBS/6B -v v12r15 -a 5 --threshold 0.5
+
+-n only classifies the failures and learns the bans.
+
+"""
+
+import glob
+import optparse
+import ND280GRID
+import ND280JobStore
+import ND280Resubmit
+from ND280Computing import StatusWait
+import os
+import sys
+import time
+
+#Parser Options
+parser = optparse.OptionParser()
+
+#Mandatory (should be args not options!)
+parser.add_option("-o","--outdir",  type="string",help="[mandatory] Output directory path")
+parser.add_option("-v","--version", type="string",help="[mandatory] Version of nd280 software")
+
+#Optional
+parser.add_option("-e","--evtype",                default="spill",help="Event type, spill or cosmic")
+parser.add_option("-j","--job",                   default='Raw',  help="Job type, Raw, Custom, MC")
+parser.add_option("-r","--runno",                 default='',     help="Run number, or start of")
+parser.add_option("-a","--attempts",  type=int,   default=5,      help="Attempts of a job before giving up on it")
+parser.add_option(     "--threshold", type=float, default=0.5,    help="Fraction of failed jobs that bans a site")
+parser.add_option(     "--min-jobs",  type=int,   default=10,     help="Jobs that must have ended at a site before it can be banned", dest="min_jobs")
+parser.add_option(     "--window",    type=float, default=24,     help="Hours of job outcomes a ban is decided on")
+parser.add_option(     "--ban",       type=float, default=24,     help="Hours a site stays banned")
+parser.add_option("-n","--dry-run",               default=False,  help="Classify the failures and learn the bans, do not resubmit", action='store_true', dest="dry_run")
+parser.add_option(     "--nBatch",    type=int,   default=250,    help="Number of statuses to check per dirac-wms-job-status call")
+parser.add_option("-w","--workers",   type=int,   default=8,      help="Number of dirac-wms-job-status calls to run at once")
+parser.add_option(     "--db",                    default='',     help="Job-state store, default <outdir>/jobs.db")
+(options,args) = parser.parse_args()
+
+##############################################################################
+
+# Main Program
+version = options.version
+job     = options.job
+evtype  = options.evtype
+runno   = options.runno
+outdir  = options.outdir
+
+if not version or (evtype!="spill" and evtype!="cosmic") or not outdir:
+    parser.print_help()
+    sys.exit(1)
+
+if not os.path.isdir(outdir):
+    sys.exit('The directory ' + outdir + ' does not exist.')
+
+if not options.dry_run and not ND280GRID.IsValidProxy():
+    sys.exit('Proxy expired')
+
+basename=''
+if job == 'Raw' or job == 'MC':
+    basename = 'ND280' + job + '_' + evtype
+elif job == 'Custom':
+    basename = 'ND280' + job
+
+pattern = outdir + '/' + basename + '_' + version
+if runno:
+    pattern += '_0000' + runno
+pattern += '*.jid'
+print pattern
+jids = sorted(glob.glob(pattern))
+
+#Update the store from the jid files that changed and the jobs that have not finished
+#-------------------------------------------------------------
+start = time.time()
+store = ND280JobStore.JobStore(options.db or outdir + '/jobs.db')
+nnew  = store.ScanJIDFiles(jids)
+print str(nnew) + ' new jobs, ' + str(len(store.Active())) + ' to check'
+nchanged = store.Refresh(options.workers, options.nBatch)
+print str(nchanged) + ' jobs changed state in ' + str(store.nQueries) + ' dirac-wms-job-status calls, %.0f s' % (time.time() - start)
+
+#Resubmit the failed jobs
+#-------------------------------------------------------------
+engine = ND280Resubmit.ResubmissionEngine(store,
+                                          max_attempts=options.attempts,
+                                          threshold=options.threshold,
+                                          min_jobs=options.min_jobs,
+                                          window=options.window*StatusWait.kHour,
+                                          ban_time=options.ban*StatusWait.kHour,
+                                          resubmit=not options.dry_run)
+engine.Run(jids)
+print engine.Summary()
+store.Close()
@@ -1,16 +1,12 @@
 #!/usr/bin/env python 
 
+import glob
 import optparse
-from ND280GRID import ND280JID
+import ND280Computing
+from ND280GRID import ND280JIDResolver
+import ND280JobStore
 import os
 import sys
-from subprocess import Popen, PIPE
-import smtplib
-import commands
-import time
-import pexpect
-
-from email.MIMEText import MIMEText
 
 #Parser options
 parser = optparse.OptionParser()
@@ -66,24 +62,18 @@ elif job == 'Custom':
 filename=options.filename
 
 
-counter = 0
+jidfiles = []
 
 if filename:
 
     print 'Cancelling from file'
 
-    command = 'ls ' + outdir + '/' + basename + '_' + version 
-    command += '_0000'
+    pattern = outdir + '/' + basename + '_' + version + '_0000'
     if runno:
-        command += runno
-    command += '*.jid'
-    print command
-
-    p      = Popen([command],shell=True,stdout=PIPE,stderr=PIPE)
-    lines  = p.stdout.readlines()
-    errors = p.stderr.readlines()
-
-    djids = lines
+        pattern += runno
+    pattern += '*.jid'
+    print pattern
+    djids = glob.glob(pattern)
 
     listfile=open(filename,'r')
     filelist=listfile.readlines()
@@ -102,93 +92,50 @@ if filename:
         tag=tag.replace('-','_')
         rname=basename + '_' + version + '_' + tag
 
-        lname=outdir + '/'
-        indir=0
+        lname=''
         for d in djids:
             if rname in d:
-                d=d.replace('\n','')
-                dar=d.split('/') 
-                indir=1
-                lname+=dar[-1]
+                lname=d
                 break
 
-        if indir == 0 or not os.path.isfile(lname):
-            print 'File not there: ' + lname
+        if not lname or not os.path.isfile(lname):
+            print 'File not there: ' + outdir + '/' + rname
             continue
 
-        print lname
-        
-        fjid = open(lname,"r")
-        flines = fjid.readlines()
-        joblink = flines[1] 
-        print joblink
-        
-        command = 'glite-wms-job-cancel ' + joblink
-        
-        child = pexpect.spawn(command,timeout=30)
-        ii=child.expect(['.* : ','.*:'])
-        if ii == 1:
-            child.sendline('q')
-            print 'No job'
-            continue
-        child.sendline('y')
-        
-        ii=child.expect(['Error',pexpect.TIMEOUT,pexpect.EOF])
-        
-        if ii == 2:
-            counter += 1
-            print child.before
-            time.sleep(0.1)
-        elif ii < 1:
-            print child.after
+        jidfiles.append(lname)
 
 else:
     print 'Cancelling from ls'
 
-    command = 'ls ' + outdir + '/' + basename + '_' + version
+    pattern = outdir + '/' + basename + '_' + version
     if runno:
-        command += '_0000' + runno + '*.jid'
+        pattern += '_0000' + runno + '*.jid'
     else:
-        command += '_*.jid'
+        pattern += '_*.jid'
+    print pattern
+
+    jidfiles = sorted(glob.glob(pattern))
+
+# Look up every job at once and kill those that have not finished, many per call
+resolver = ND280JIDResolver(ttl=0)
+jobids   = []
+for l, j in zip(jidfiles, resolver.Resolve(jidfiles)):
+    if j is None:
+        print 'No job: ' + l
+        continue
+    if j.status in ND280JobStore.TERMINAL:
+        continue
+    print l + ' ' + j.jobid + ' ' + j.status
+    jobids.append(j.jobid)
 
-    p      = Popen([command],shell=True,stdout=PIPE,stderr=PIPE)
-    lines  = p.stdout.readlines()
-    errors = p.stderr.readlines()
-
-    print command    
-        
-    for l in lines:
-        l = l.replace('\n','')
-        print l
-        fjid = open(l,"r")
-        flines = fjid.readlines()
-        joblink = flines[1] 
-        print joblink
-        
-        command = 'glite-wms-job-cancel ' + joblink
-        
-        child = pexpect.spawn(command,timeout=30)
-        ii=child.expect(['.* : ','.*:'])
-        if ii == 1:
-            child.sendline('q')
-            print 'No job'
-            continue
-        child.sendline('y')
-        
-        ii=child.expect(['Error',pexpect.TIMEOUT,pexpect.EOF])
-        
-        if ii == 2:
-            counter += 1
-            print child.before
-            time.sleep(0.1)
-        elif ii < 1:
-            print child.after
+counter = 0
+nBatch  = 500
+for first in range(0, len(jobids), nBatch):
+    batch  = jobids[first:first+nBatch]
+    result = ND280Computing.GetRetryPolicy().Run('dirac-wms-job-kill ' + ' '.join(batch), ND280Computing.StatusWait.kTimeout)
+    if result.returncode == 0:
+        counter += len(batch)
+    else:
+        print 'Error killing jobs: ' + ' '.join(result.errors)
 
 print 'Cancelled ' + str(counter) + ' jobs'
-
-
-
-
-
-
-
@@ -14,11 +14,15 @@ Example
      -f 1
 
 This synchronises the lfc directory with that on the TRIUMF SE and uses FTS to
-transfer the files.
+transfer the files. -n 1 only prints the sync plan, the files that would be
+copied and their size. Without FTS -j sets the replications run at once.
+-m 1 copies each file from whichever SE holding a replica has the least
+queued on its channel to the destination, to use all the source channels.
 
 """
 
 from ND280GRID import ND280Dir
+import ND280Computing
 import ND280GRID
 import optparse
 import os
@@ -35,6 +39,9 @@ parser.add_option("-b","--dirB",   dest="dirB",   type="string",help="Directory
 parser.add_option("-f","--fts",    dest="fts",    type="int",   help="Use FTS flag 1=yes 0=no", default=1)
 parser.add_option("-p","--pattern",dest="pattern",type="string",help="Only sync files matching <pattern>")
 parser.add_option("-i","--ftsInt", dest="ftsInt", type="int",   help="Optional integer to pass to FTS for uniquifying transfer-file names")
+parser.add_option("-n","--dryrun", dest="dryrun", type="int",   help="Only print the sync plan 1=yes 0=no", default=0)
+parser.add_option("-j","--jobs",   dest="jobs",   type="int",   help="Replications run at once without FTS", default=4)
+parser.add_option("-m","--multi",  dest="multi",  type="int",   help="Copy from every SE holding the files 1=yes 0=no", default=0)
 (options,args) = parser.parse_args()
 
 ###############################################################################
@@ -60,14 +67,15 @@ if not ftsInt:
 
 try:
     # Create ND280Dir object
-    dirA=ND280Dir(options.dirA,ls_timeout=600)
+    dirA=ND280Dir(options.dirA,ls_timeout=600,bulk=True)
 
     # Sync this ND280Dir with dir
-    dirA.NewSync(options.dirB,fts,pattern,ftsInt)
+    dirA.NewSync(options.dirB,fts,pattern,ftsInt,options.dryrun,options.jobs,options.multi)
 except:
     traceback.print_exc()
 
 # The time taken
 duration = time.time() - start
 
-print 'It took '+str(duration)+' seconds to synchronise directories.\n'
+print 'It took '+str(duration)+' seconds to synchronise directories.'
+print 'Retries: '+ND280Computing.GetRetryPolicy().Summary()+'\n'
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 from ND280GRID import *
+import ND280Catalogue
 import optparse
 import os
 import sys
@@ -16,6 +17,7 @@ N_PROC_MAX=5
 parser = optparse.OptionParser()
 
 parser.add_option('-f', dest='force', default=0, help='Use to force regeneration of LFC recusive file list')
+parser.add_option('-m', dest='mirror', default='', help='Count the replicas from this catalogue mirror database (see MirrorCatalogue.py), refreshing it first, instead of recursively listing the LFC')
 
 (options,args) = parser.parse_args()
 
@@ -43,6 +45,42 @@ inputPath = args[0]
 tmpPath = 'dumps/'+inputPath.replace(lfcHome,'').replace('/','.')+'.tmp'
 
 
+# count from the catalogue mirror, only re-listing directories that changed
+def countMirrorReplicas():
+
+    mirrorPath = inputPath
+    if not mirrorPath.startswith('/'):
+        mirrorPath = lfcHome.rstrip('/') + '/' + mirrorPath
+
+    mirror = ND280Catalogue.CatalogueMirror(options.mirror)
+    lister = ND280Catalogue.DIRACLister()
+    try:
+        print 'Refreshing catalogue mirror %s of %s' % (options.mirror,mirrorPath)
+        mirror.Refresh(mirrorPath,lister,N_PROC_MAX,force=bool(int(options.force)))
+
+        # directories containing files
+        todo = [mirrorPath]
+        while todo:
+            dirName = todo.pop(0)
+            todo.extend(mirror.SubDirectories(dirName))
+            nFiles,size = mirror.Size(dirName,recursive=False)
+            if not nFiles:
+                continue
+
+            print '%10d total files in %s' % (nFiles,dirName)
+            for se,count in sorted(mirror.ReplicaCounts(dirName,recursive=False).iteritems()):
+                print '%10d replicas on %s' % (count,se)
+            print ''
+    finally:
+        lister.Close()
+        mirror.Close()
+
+    sys.exit(0)
+
+if options.mirror:
+    countMirrorReplicas()
+
+
 # make sure path exists
 lines,errors = runLCG('lfc-ls '+inputPath,is_pexpect=False)
 if errors:
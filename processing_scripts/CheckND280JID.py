@@ -1,9 +1,11 @@
 #!/usr/bin/env python 
 
 import optparse
-from ND280GRID import ND280JID
+import ND280GRID
+from ND280GRID import ND280JIDResolver
 import os
 import smtplib
+import sys
 
 from email.MIMEText import MIMEText
 
@@ -60,9 +62,14 @@ message_text='Dear Sir/Madam,\n\n'
 
 sendmail=0
 
-for l in lines:
-    j=ND280JID(l.replace('\n',''))
-    
+## Look up the status of every job at once
+jidfiles = [l.replace('\n','') for l in lines]
+resolver = ND280JIDResolver()
+for l, j in zip(jidfiles, resolver.Resolve(jidfiles)):
+    if j is None:
+        print 'No job status for ' + l
+        continue
+
     if j.IsDone():
         ## Get the output if done
         outputdir = j.GetOutput()
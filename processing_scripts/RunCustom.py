@@ -13,8 +13,10 @@ import pexpect
 import sys
 from time import sleep
 import ND280Computing
-from ND280GRID import ND280File
+from ND280GRID import ND280File, ND280LazyFile
 from ND280DIRACAPI import ND280DIRACProcess as DIRACProcess
+from ND280DIRACAPI import ND280DIRACParametricProcess as \
+    DIRACParametricProcess
 
 # usage = 'usage: %prog [options]'
 parser = optparse.OptionParser()
@@ -67,6 +69,10 @@ parser.add_option("--test", default=False,
 parser.add_option("-s", "--sandbox", default='',
                   help="Configuration files to add to the InputSandbox, comma delimited")
 
+parser.add_option('--bulk', default=0, type='int',
+                  help='Optional check all the files at once and submit \
+DIRAC parametric jobs of this many files each')
+
 (options, args) = parser.parse_args()
 ##########################################################################
 
@@ -130,6 +136,40 @@ arglist += ' -i '
 # Count the number of jobs submitted
 counter = 0
 
+# Bulk submission: check every file with bulk catalogue queries and
+# submit parametric jobs of options.bulk files
+if options.dirac and options.bulk:
+    infiles = [ND280LazyFile(a_file) for a_file in filelist if a_file]
+    ND280LazyFile.ResolveMany(infiles)
+    for infile in infiles:
+        if not infile.Exists():
+            print infile.LFN()
+            print 'File not on LFN, skipping'
+    infiles = [infile for infile in infiles if infile.Exists()]
+
+    for first in range(0, len(infiles), options.bulk):
+        dirac_proc = DIRACParametricProcess(infiles[first:first+options.bulk],
+                                            nd280ver, 'Custom', execfile,
+                                            arglist)
+        # add more files to input sandbox
+        if len(sandbox) > 0:
+            for in_file in sandbox:
+                dirac_proc.jd.inputSandbox.append(in_file.strip())
+        dirac_script = '%s.py' % dirac_proc.jd.scriptname
+        if os.path.isfile(dirac_script):
+            os.system('rm -f %s' % dirac_script)
+        dirac_proc.jd.CreateDIRACAPIFile()
+        if os.path.isfile(dirac_script):
+            command = '/usr/bin/env python2 %s' % (dirac_script)
+            print command
+            if not options.test:
+                os.system(command)
+            counter += len(dirac_proc.nd280_files)
+
+    print '--------------------------------'
+    print 'Submitted ' + str(counter) + ' jobs'
+    sys.exit()
+
 # Loop over the list of files to process
 for a_file in filelist:
 
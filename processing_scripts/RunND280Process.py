@@ -3,6 +3,9 @@
 import optparse
 import ND280GRID
 from ND280GRID import ND280JDL
+from ND280DIRACAPI import ND280DIRACParametricProcess
+from ND280JobStore import JobStore
+from ND280Throttle import SubmissionThrottle
 import os
 import sys
 import time
@@ -27,7 +30,7 @@ parser.add_option("-n","--nsub",      dest="nsub",      type="string",help="Uniq
 parser.add_option("-o","--outdir",    dest="outdir",    type="string",help="Output directory. Can also specify using $ND280JOBS env variable. Defaults to $PWD/Jobs if neither are present")
 parser.add_option("-p","--prod",      dest="prod",      type="string",help="Production, e.g. 4A")
 parser.add_option("-q","--queuelim",  dest="queuelim",  type="string",help="Queue memory limit")
-parser.add_option("-r","--resource",  dest="resource",  type="string",help="Optional - CE to submit to")
+parser.add_option("-r","--resource",  dest="resource",  type="string",help="Optional - DIRAC site(s) to submit to, comma separated, e.g. LCG.RAL.uk")
 parser.add_option("-s","--prescale",  dest="prescale",  type="string",help="Submit every n:th file")
 parser.add_option("-t","--type",      dest="type",      type="string",help="Production type, rdp, rdpverify, mcp or mcpverify")
 parser.add_option("-u","--delegation",dest="delegation",type="string",help="Proxy delegation id, e.g $USER")
@@ -40,6 +43,9 @@ parser.add_option("-w","--beam",      dest="beam",      type="string",help="Beam
 
 parser.add_option("--regexp",          help="Use JDL RegExp, e.g. !(RegExp(\"in2p3.fr\", other.GlueCEInfoHostName))")
 parser.add_option("--test",            help="Test run, do not submit jobs", action='store_true', default=False)
+parser.add_option("--bulk",            help="Check all the inputs at once and submit DIRAC parametric jobs of this many inputs each", type='int', default=0)
+parser.add_option("--throttle",        help="Keep at most this many waiting plus running jobs of the production at each site (those of -r, or those it used so far)", type='int', default=0)
+parser.add_option("--total",           help="With --throttle, keep at most this many waiting plus running jobs of the production in all", type='int', default=0)
 
 parser.add_option("--neutVersion",     help="Version of NEUT to be used", default='')
 parser.add_option("--POT",             help="No. of POT to generate",     default='')
@@ -128,6 +134,87 @@ submitted = 0
 miss      = 0
 failures  = []
 
+#The default list of config options passed to ND280JDL
+optionsDict = {'regexp':regexp,'trigger':evtype,'prod':prod,'type':dtype,'modules':modules,'config':config,'dirs':dirs,'cfgfile':extrafile,'queuelim':queuelim,'dbtime':dbtime,'generator':generator,'geometry':geometry,'vertex':vertex,'beam':beam}
+
+#Is a version of NEUT to be used?
+if options.neutVersion:
+    optionsDict ['neutVersion'] = options.neutVersion
+
+    #How many POT?
+    optionsDict ['POT'] = options.POT
+
+#Is a version of highland to be used?
+if options.highlandVersion:
+    optionsDict['highlandVersion'] = options.highlandVersion
+
+#Submit to the -r sites, or to the site the throttle picks
+if resource:
+    optionsDict['site'] = resource
+
+throttle = None
+if options.throttle:
+    store    = JobStore(os.path.join(outdir,'jobs.db'))
+    sites    = resource.split(',') if resource else []
+    throttle = SubmissionThrottle(store,options.throttle,sites,options.total,os.path.join(outdir,'*.jid'))
+
+#Bulk submission: check the proxy once and every input with bulk
+#catalogue queries, then submit parametric jobs of options.bulk inputs
+if options.bulk:
+    #The JDL requirements have no DIRAC API equivalent, use -r instead
+    if regexp or queuelim:
+        parser.error('--regexp and --queuelim cannot be used with --bulk, choose the sites with -r')
+    if not ND280GRID.IsValidProxy():
+        sys.exit('Proxy expired')
+
+    inputs = [ND280GRID.ND280LazyFile(f) for n, f in enumerate(filelist) if f.strip() and (n+1)%prescale == 0]
+    ND280GRID.ND280LazyFile.ResolveMany(inputs)
+
+    executables = dict()
+    for f in inputs:
+        if not f.Exists():
+            print 'Not a valid file, skipping ' + f.LFN()
+            failures.append(f.LFN())
+            continue
+        executables.setdefault(ND280GRID.ProcessExecutable(jobtype,f.filetype),[]).append(f)
+
+    arguments = ND280GRID.ProcessArguments(nd280ver,jobtype,optionsDict) + ' -i '
+    for executable, files in sorted(executables.iteritems()):
+        for first in range(0,len(files),options.bulk):
+            chunk = files[first:first+options.bulk]
+            if throttle:
+                optionsDict['site'] = throttle.Next(len(chunk))
+            p = ND280DIRACParametricProcess(chunk,nd280ver,jobtype,executable,arguments,optionsDict)
+            if extrafile:
+                p.jd.inputSandbox.append(extrafile)
+            p.jd.CreateDIRACAPIFile(outdir)
+
+            #First delete any old jid files
+            for jidname in p.jd.JIDFiles():
+                if os.path.isfile(jidname):
+                    os.remove(jidname)
+
+            command = '/usr/bin/env python2 ' + p.jd.scriptname + '.py'
+            print command
+            if options.test:
+                print 'TEST RUN'
+                continue
+            if os.system(command) != 0:
+                print 'Error: ' + command + ' failed'
+                failures += [f.LFN() for f in p.nd280_files]
+                continue
+            submitted += len(p.nd280_files)
+
+    print '--------------------------------'
+    print 'Submitted ' + str(submitted) + ' jobs'
+    if throttle:
+        throttle.Print()
+
+    if failures:
+        print 'Dumping list of failures'
+        print failures
+    sys.exit(0)
+
 for f in filelist:
     counter += 1
     if counter%prescale > 0 and miss == 0:
@@ -151,19 +238,9 @@ for f in filelist:
     except:
         failures.append(f)
 
-    #The default list of config options passed to ND280JDL
-    optionsDict = {'regexp':regexp,'trigger':evtype,'prod':prod,'type':dtype,'modules':modules,'config':config,'dirs':dirs,'cfgfile':extrafile,'queuelim':queuelim,'dbtime':dbtime,'generator':generator,'geometry':geometry,'vertex':vertex,'beam':beam}
-
-    #Is a version of NEUT to be used?
-    if options.neutVersion:
-        optionsDict ['neutVersion'] = options.neutVersion
-
-        #How many POT?
-        optionsDict ['POT'] = options.POT
-
-    #Is a version of highland to be used?
-    if options.highlandVersion:
-        optionsDict['highlandVersion'] = options.highlandVersion
+    #Wait for a site below its target
+    if throttle:
+        optionsDict['site'] = throttle.Next()
 
     #Create the JDL
     j = ND280JDL(nd280ver,f,jobtype,evtype,optionsDict)
@@ -220,13 +297,15 @@ for f in filelist:
 
     # sleep for a couple of hours to ease I/O burden...
     waitAfter = 2000
-    if submitted == waitAfter:
+    if submitted == waitAfter and not throttle:
         print 'Submitted %d jobs, taking a nap' % waitAfter
         time.sleep(7200)
 
 
 print '--------------------------------'
 print 'Submitted ' + str(submitted) + ' jobs'
+if throttle:
+    throttle.Print()
 
 if failures:
     print 'Dumping list of failures'
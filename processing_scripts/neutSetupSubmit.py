@@ -60,13 +60,13 @@ GEOMETRY  = '2015-08-air'
 VERTEX    = 'magnet'
 BEAM      = 'run6'
 
-# optionally submit to a resource...
-RESOURCE  =''                                                                 # RESOURCE  = 'lcgce1.shef.ac.uk:8443/cream-pbs-t2k'
+# optionally submit to DIRAC sites, comma separated...
+RESOURCE  =''                                                                 # RESOURCE  = 'LCG.Sheffield.uk,LCG.RAL.uk'
 
-# -- end of job submission PARAMETERS --
+# optionally keep at most this many waiting plus running jobs of the production at each site (0 = off), RunND280Process.py then waits for sites to drain below it
+THROTTLE  = 0                                                                 # THROTTLE  = 500
 
-# limit on the number of parallel processes (LFC I/O)
-nProcMax=10
+# -- end of job submission PARAMETERS --
 
 # loop over runs
 while RUN < RUNMAX:
@@ -87,6 +87,10 @@ while RUN < RUNMAX:
         if not ISTEST and RESOURCE :
             command += ' -r '+ RESOURCE
 
+        # keep the queue of every site near THROTTLE jobs (not in test mode)
+        if not ISTEST and THROTTLE :
+            command += ' --throttle %d' % THROTTLE
+
         print command
         lines,errors = runLCG(command,is_pexpect=False)  # - multiple sub-processes desireable here using ND280GRID.processWait()
 
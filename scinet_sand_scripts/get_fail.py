@@ -6,6 +6,8 @@ import commands
 
 import subprocess
 
+import ND280NameParser
+
 f = open('redo_newneut.txt')
 lines = f.readlines()
 f.close()
@@ -16,9 +18,9 @@ for line in lines:
     #print line
     file = line.strip("\n").split("/")[17]
     #print file
-    runsub = file.split("_")[3]
-    run = runsub.split("-")[0]
-    subrun = runsub.split("-")[1]
+    record = ND280NameParser.ParseFileName(file)
+    run = ND280NameParser.FormatRun(record.run)
+    subrun = ND280NameParser.FormatSubrun(record.subrun)
 
     #print run + " " + subrun
     #print int(subrun)
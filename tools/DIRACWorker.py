@@ -0,0 +1,373 @@
+#!/usr/bin/env python2
+"""
+A long lived DIRAC data management worker.
+
+Loads the DIRAC client (and proxy) once and then serves requests read from
+stdin, one JSON object per line, answering each with one JSON line on stdout
+
+    request  {"id": 1, "op": "size", "args": {"lfns": [...], "unit": "MB"}}
+    response {"id": 1, "lines": [...], "errors": [...]}
+
+The lines are formatted like the output of the matching dirac-dms-* command
+so that the DIRACBase classes in ND280DIRACAPI can parse them unchanged.
+
+With --fixture the worker answers from a JSON catalogue instead of DIRAC
+
+    {"/t2k.org/nd280/.../file.root": {"size": 1024,
+                                      "replicas": {"RAL-disk": "srm://..."},
+                                      "guid": "...", "checksum": "..."}}
+
+which is what ND280DIRACAPI.DIRACSession uses for local testing.
+"""
+
+from fnmatch import fnmatch
+from hashlib import sha1
+import json
+import optparse
+import os
+import sys
+
+# Size units used by dirac-dms-data-size
+UNITS = {'MB': 1024.**2, 'GB': 1024.**3, 'TB': 1024.**4, 'PB': 1024.**5}
+
+
+def FormatSize(nFiles, size, unit):
+    """the dirac-dms-data-size table"""
+    rule = '-' * 50
+    return [rule,
+            '%16s | %20s' % ('Files', 'Size (%s)' % unit),
+            rule,
+            '%16d | %20.3f' % (nFiles, size / UNITS[unit]),
+            rule]
+
+
+def FormatResult(successful, failed):
+    """the Successful/Failed listing of e.g. dirac-dms-lfn-replicas"""
+    lines = ['Successful :']
+    for lfn in sorted(successful):
+        lines.append('    %s :' % lfn)
+        for key, value in sorted(successful[lfn].iteritems()):
+            lines.append('        %s : %s' % (key, value))
+    lines.append('Failed :')
+    for lfn in sorted(failed):
+        lines.append('    %s : %s' % (lfn, failed[lfn]))
+    return lines
+
+
+def FormatListing(path, mtime, dirs, files):
+    """the tab separated directory listing read by ND280Catalogue
+
+    D  mtime  path                             the directory itself
+    d  mtime  subdirectory                     one per subdirectory
+    f  mtime  size  guid  checksum  lfn        one per file
+    """
+    lines = ['D\t%s\t%s' % (mtime, path)]
+    for subdir in sorted(dirs):
+        lines.append('d\t%s\t%s' % (dirs[subdir], subdir))
+    for lfn in sorted(files):
+        entry = files[lfn]
+        lines.append('f\t%s\t%d\t%s\t%s\t%s' %
+                     (entry.get('mtime', ''), int(entry.get('size', 0)),
+                      entry.get('guid', ''), entry.get('checksum', ''), lfn))
+    return lines
+
+
+class FixtureBackend(object):
+    """answers requests from a JSON catalogue held in memory"""
+
+    def __init__(self, fixture):
+        self.catalogue = dict()
+        if fixture and os.path.exists(fixture):
+            with open(fixture) as catalogue_file:
+                self.catalogue = json.load(catalogue_file)
+
+    def DoFind(self, path, name='*'):
+        """LFNs below path with a file name matching name"""
+        path = path.rstrip('/') + '/'
+        return [lfn for lfn in sorted(self.catalogue)
+                if lfn.startswith(path) and
+                fnmatch(os.path.basename(lfn), name)], []
+
+    def Children(self, path):
+        """the subdirectories and files directly below path"""
+        path = path.rstrip('/') + '/'
+        dirs = set()
+        files = dict()
+        for lfn in self.catalogue:
+            if not lfn.startswith(path):
+                continue
+            rest = lfn[len(path):]
+            if '/' in rest:
+                dirs.add(path + rest.split('/')[0])
+            else:
+                files[lfn] = self.catalogue[lfn]
+        return dirs, files
+
+    def DirectoryTime(self, path):
+        """a stand in for the modification time of path, which like
+        the real one changes when an entry is added or removed"""
+        dirs, files = self.Children(path)
+        if not dirs and not files:
+            return None
+        return sha1('\n'.join(sorted(dirs) + sorted(files))).hexdigest()[:12]
+
+    def DoList(self, path):
+        """subdirectories and files of path"""
+        path = path.rstrip('/') or '/'
+        mtime = self.DirectoryTime(path)
+        if mtime is None:
+            return [], ['No such file or directory %s' % path]
+        dirs, files = self.Children(path)
+        return FormatListing(path, mtime,
+                             dict((d, self.DirectoryTime(d)) for d in dirs),
+                             files), []
+
+    def DoStat(self, paths):
+        """modification times of the directories that exist"""
+        lines = list()
+        for path in paths:
+            mtime = self.DirectoryTime(path)
+            if mtime is not None:
+                lines.append('d\t%s\t%s' % (mtime, path.rstrip('/')))
+        return lines, []
+
+    def DoSize(self, lfns, unit='MB'):
+        """total size of lfns"""
+        missing = [lfn for lfn in lfns if lfn not in self.catalogue]
+        if missing:
+            return [], ['No such file %s' % lfn for lfn in missing]
+        size = sum(self.catalogue[lfn].get('size', 0) for lfn in lfns)
+        return FormatSize(len(lfns), size, unit), []
+
+    def DoReplicas(self, lfns):
+        """replicas of lfns"""
+        successful = dict()
+        failed = dict()
+        for lfn in lfns:
+            if lfn in self.catalogue:
+                successful[lfn] = self.catalogue[lfn].get('replicas', {})
+            else:
+                failed[lfn] = 'No such file or directory'
+        return FormatResult(successful, failed), []
+
+    def DoMetadata(self, lfns):
+        """size, GUID and checksum of lfns"""
+        successful = dict()
+        failed = dict()
+        for lfn in lfns:
+            if lfn in self.catalogue:
+                entry = self.catalogue[lfn]
+                successful[lfn] = {'Size': entry.get('size', 0),
+                                   'GUID': entry.get('guid', ''),
+                                   'Checksum': entry.get('checksum', '')}
+            else:
+                failed[lfn] = 'No such file or directory'
+        return FormatResult(successful, failed), []
+
+    def DoAdd(self, lfn, filename, se):
+        """register a local file"""
+        if lfn in self.catalogue:
+            return ['%s already exists' % lfn], []
+        if not os.path.exists(filename):
+            return [], ['No such file %s' % filename]
+        self.catalogue[lfn] = {'size': os.path.getsize(filename),
+                               'replicas': {se: 'file://' +
+                                            os.path.abspath(filename)}}
+        return ['Successfully uploaded %s to %s' % (lfn, se)], []
+
+    def DoReplicate(self, lfn, se):
+        """add a replica on se, at the path of an existing one"""
+        replicas = self.catalogue.get(lfn, {}).get('replicas')
+        if not replicas:
+            return [], ['No such file %s' % lfn]
+        if se not in replicas:
+            pfn = sorted(replicas.values())[0]
+            protocol, rest = pfn.split('://', 1)
+            replicas[se] = '%s://%s/%s' % (protocol, se,
+                                           rest.split('/', 1)[-1])
+        return ['Successfully replicated %s to %s' % (lfn, se)], []
+
+    def DoRemove(self, lfns):
+        """remove lfns from the catalogue"""
+        removed = [lfn for lfn in lfns if self.catalogue.pop(lfn, None)]
+        return ['Successfully removed %d files' % len(removed)], []
+
+    def DoRegister(self, files):
+        """register files already on storage, as new LFNs or as
+        replicas of existing ones"""
+        successful = dict()
+        for entry in files:
+            lfn = entry['lfn']
+            if lfn not in self.catalogue:
+                self.catalogue[lfn] = {'size': entry.get('size', 0),
+                                       'guid': entry.get('guid', ''),
+                                       'checksum': entry.get('checksum', ''),
+                                       'replicas': {}}
+            self.catalogue[lfn].setdefault('replicas', {})[entry['se']] = \
+                entry['pfn']
+            successful[lfn] = {entry['se']: entry['pfn']}
+        return FormatResult(successful, {}), []
+
+
+class DIRACBackend(object):
+    """answers requests through the DIRAC client API"""
+
+    def __init__(self):
+        from DIRAC.Core.Base import Script
+        Script.parseCommandLine(ignoreErrors=True)
+        from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
+        from DIRAC.DataManagementSystem.Client.DataManager import DataManager
+        self.fc = FileCatalog()
+        self.dm = DataManager()
+
+    def Check(self, result):
+        """unwrap an S_OK/S_ERROR structure"""
+        if not result['OK']:
+            raise Exception(result['Message'])
+        return result['Value']
+
+    def DoFind(self, path, name='*'):
+        """LFNs below path with a file name matching name"""
+        lfns = list()
+        todo = [path.rstrip('/') or '/']
+        while todo:
+            listing = self.Check(self.fc.listDirectory(todo.pop()))
+            for directory in listing['Successful'].itervalues():
+                todo.extend(directory['SubDirs'])
+                lfns.extend(lfn for lfn in directory['Files']
+                            if fnmatch(os.path.basename(lfn), name))
+        return sorted(lfns), []
+
+    def DoList(self, path):
+        """subdirectories and files of path"""
+        listing = self.Check(self.fc.listDirectory(path, True))
+        if path in listing['Failed']:
+            return [], ['%s %s' % (path, listing['Failed'][path])]
+        directory = listing['Successful'][path]
+        mtime = self.Check(self.fc.getDirectoryMetadata(path))
+        mtime = mtime['Successful'].get(path, {}).get('ModificationDate', '')
+        dirs = dict((subdir, str(entry.get('ModificationDate', '')))
+                    for subdir, entry in directory['SubDirs'].iteritems())
+        files = dict()
+        for lfn, entry in directory['Files'].iteritems():
+            metadata = entry.get('MetaData', {})
+            files[lfn] = {'mtime': str(metadata.get('ModificationDate', '')),
+                          'size': metadata.get('Size', 0),
+                          'guid': metadata.get('GUID', ''),
+                          'checksum': metadata.get('Checksum', '')}
+        return FormatListing(path, str(mtime), dirs, files), []
+
+    def DoStat(self, paths):
+        """modification times of the directories that exist"""
+        metadata = self.Check(self.fc.getDirectoryMetadata(paths))
+        return ['d\t%s\t%s' % (entry.get('ModificationDate', ''), path)
+                for path, entry in sorted(metadata['Successful'].iteritems())
+                ], []
+
+    def DoSize(self, lfns, unit='MB'):
+        """total size of lfns"""
+        sizes = self.Check(self.fc.getFileSize(lfns))
+        errors = ['%s %s' % item for item in sizes['Failed'].iteritems()]
+        if errors:
+            return [], errors
+        return FormatSize(len(lfns), sum(sizes['Successful'].values()),
+                          unit), []
+
+    def DoReplicas(self, lfns):
+        """replicas of lfns"""
+        replicas = self.Check(self.dm.getReplicas(lfns))
+        return FormatResult(replicas['Successful'], replicas['Failed']), []
+
+    def DoMetadata(self, lfns):
+        """size, GUID and checksum of lfns"""
+        metadata = self.Check(self.fc.getFileMetadata(lfns))
+        successful = dict()
+        for lfn, entry in metadata['Successful'].iteritems():
+            successful[lfn] = dict((key, entry.get(key, ''))
+                                   for key in ('Size', 'GUID', 'Checksum'))
+        return FormatResult(successful, metadata['Failed']), []
+
+    def DoAdd(self, lfn, filename, se):
+        """upload and register a local file"""
+        result = self.Check(self.dm.putAndRegister(lfn, filename, se))
+        if lfn in result['Failed']:
+            return [], [str(result['Failed'][lfn])]
+        return ['Successfully uploaded %s to %s' % (lfn, se)], []
+
+    def DoReplicate(self, lfn, se):
+        """copy lfn to se and register the replica"""
+        result = self.Check(self.dm.replicateAndRegister(lfn, se))
+        if lfn in result['Failed']:
+            return [], [str(result['Failed'][lfn])]
+        return ['Successfully replicated %s to %s' % (lfn, se)], []
+
+    def DoRemove(self, lfns):
+        """remove lfns from the catalogue and storage"""
+        result = self.Check(self.dm.removeFile(lfns))
+        errors = ['%s %s' % item for item in result['Failed'].iteritems()]
+        return ['Successfully removed %d files' %
+                len(result['Successful'])], errors
+
+    def DoRegister(self, files):
+        """register files already on storage, as new LFNs or as
+        replicas of existing ones"""
+        lfns = [entry['lfn'] for entry in files]
+        exists = self.Check(self.fc.exists(lfns))['Successful']
+        new = [(entry['lfn'], entry['pfn'], entry.get('size', 0),
+                entry['se'], entry.get('guid', ''),
+                entry.get('checksum', ''))
+               for entry in files if not exists.get(entry['lfn'])]
+        replicas = [(entry['lfn'], entry['pfn'], entry['se'])
+                    for entry in files if exists.get(entry['lfn'])]
+        successful = dict()
+        failed = dict()
+        for tuples, Register in ((new, self.dm.registerFile),
+                                 (replicas, self.dm.registerReplica)):
+            if not tuples:
+                continue
+            result = self.Check(Register(tuples))
+            failed.update((lfn, str(reason)) for lfn, reason in
+                          result['Failed'].iteritems())
+            for lfn in result['Successful']:
+                entry = [e for e in files if e['lfn'] == lfn][0]
+                successful[lfn] = {entry['se']: entry['pfn']}
+        return FormatResult(successful, failed), []
+
+
+def Serve(backend, instream, outstream):
+    """answer requests until stdin is closed"""
+    for line in iter(instream.readline, ''):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        try:
+            method = getattr(backend, 'Do' + request['op'].capitalize())
+            lines, errors = method(**request.get('args', {}))
+        except Exception as exception:
+            lines, errors = [], ['Error: %s' % exception]
+        outstream.write(json.dumps({'id': request.get('id'),
+                                    'lines': lines,
+                                    'errors': errors}) + '\n')
+        outstream.flush()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--fixture', type='string',
+                      help='answer from this JSON catalogue, not DIRAC')
+    (options, args) = parser.parse_args()
+
+    # Keep the protocol on the real stdout, anything DIRAC
+    # prints goes to stderr instead
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    if options.fixture:
+        backend = FixtureBackend(options.fixture)
+    else:
+        backend = DIRACBackend()
+    Serve(backend, sys.stdin, protocol)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python2
+"""
+A local SQLite mirror of the file catalogue.
+
+CatalogueMirror keeps the LFNs, sizes, checksums, GUIDs and replicas of a
+catalogue tree together with the modification time of every directory.
+Refresh() crawls the tree concurrently, one level at a time, and only
+re-lists the directories whose modification time changed since the last
+crawl, so refreshing a large and mostly static production tree costs one
+bulk stat per level instead of a full recursive listing.
+
+The catalogue is read through a lister
+
+    DIRACLister   a pool of DIRACWorker.py sessions (DIRAC or a JSON
+                  fixture catalogue)
+    LocalLister   a local directory tree standing in for the catalogue,
+                  for testing
+
+and queried with Find(), Files(), Replicas(), Size() and FilesOnSE() in
+place of lfc-ls or DMSFindLFN. GetMirror() opens the mirror named by
+$ND280CATALOGUE, which ND280Dir lists directories from when it is fresh
+enough (it still looks up the replicas live).
+"""
+
+from collections import namedtuple
+import os
+from os import getenv
+import sqlite3
+import threading
+import time
+
+import ND280Computing
+import ND280DIRACAPI as ND280DIRAC
+
+# One catalogue file
+CatalogueFile = namedtuple('CatalogueFile',
+                           ['lfn', 'size', 'guid', 'checksum', 'mtime'])
+
+# One directory listing, dirs is {subdirectory: mtime}
+Listing = namedtuple('Listing', ['path', 'mtime', 'dirs', 'files'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path   TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime  TEXT,
+    listed REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    lfn      TEXT PRIMARY KEY,
+    dir      TEXT,
+    name     TEXT,
+    size     INTEGER,
+    guid     TEXT,
+    checksum TEXT,
+    mtime    TEXT
+);
+CREATE TABLE IF NOT EXISTS replicas (
+    lfn  TEXT,
+    se   TEXT,
+    surl TEXT,
+    PRIMARY KEY (lfn, se)
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS replicas_se ON replicas (se);
+"""
+
+
+def CleanPath(path):
+    """a catalogue path without lfn: prefix or trailing /"""
+    path = path.strip().replace('LFN:', '').replace('lfn:', '')
+    return path.rstrip('/') or '/'
+
+
+def ParentPath(path):
+    """the directory containing path"""
+    return os.path.dirname(path.rstrip('/')) or '/'
+
+
+def Below(path):
+    """the [low, high) range of the paths strictly below path, '0'
+    being the character after '/'"""
+    path = path.rstrip('/')
+    return [path + '/', path + '0']
+
+
+def ParseListing(lines):
+    """parse the tab separated DIRACWorker.FormatListing lines"""
+    path = mtime = None
+    dirs = dict()
+    files = list()
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'D' and len(fields) == 3:
+            mtime, path = fields[1], fields[2]
+        elif fields[0] == 'd' and len(fields) == 3:
+            dirs[fields[2]] = fields[1]
+        elif fields[0] == 'f' and len(fields) == 6:
+            files.append(CatalogueFile(fields[5], int(fields[2]), fields[3],
+                                       fields[4], fields[1]))
+    return Listing(path, mtime, dirs, files)
+
+
+class DIRACLister(object):
+    """
+    Lists the catalogue through a pool of DIRACWorker.py sessions, one
+    per concurrent request, so that directories are listed in parallel.
+    With a fixture the sessions answer from a JSON catalogue instead of
+    DIRAC.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, fixture='', timeout=ND280Computing.StatusWait.kTimeout):
+        self.fixture = fixture
+        self.timeout = timeout
+        self.idle = list()
+        self.sessions = list()
+        self.lock = threading.Lock()
+
+    def Close(self):
+        """stop every session"""
+        with self.lock:
+            for session in self.sessions:
+                session.Stop()
+            self.sessions = list()
+            self.idle = list()
+
+    def Request(self, op, args):
+        """one request through an idle session, a new one if none is idle"""
+        with self.lock:
+            if self.idle:
+                session = self.idle.pop()
+            else:
+                session = ND280DIRAC.DIRACSession(self.fixture)
+                self.sessions.append(session)
+        try:
+            lines, errors = session.Request(op, args, self.timeout)
+        finally:
+            with self.lock:
+                self.idle.append(session)
+        if errors:
+            raise self.Error(' '.join(errors))
+        return lines
+
+    def ListDirectory(self, path):
+        """Listing of path"""
+        return ParseListing(self.Request('list', {'path': path}))
+
+    def StatDirectories(self, paths):
+        """{path: mtime} of the paths that exist"""
+        lines = self.Request('stat', {'paths': list(paths)})
+        return dict((line.split('\t')[2], line.split('\t')[1])
+                    for line in lines if line.startswith('d\t'))
+
+    def GetReplicas(self, lfns):
+        """{lfn: {SE: SURL}}"""
+        successful, failed = ND280DIRAC.ParseDMSResult(
+            self.Request('replicas', {'lfns': list(lfns)}))
+        return successful
+
+
+class LocalLister(object):
+    """
+    Lists a local directory tree as if it were the catalogue, the LFN of
+    root/a/b.root is base/a/b.root. Every file has one replica on the SE
+    named se.
+    """
+
+    def __init__(self, root, base='/', se='local'):
+        self.root = os.path.abspath(root)
+        self.base = CleanPath(base)
+        self.se = se
+
+    def LocalPath(self, path):
+        """the local path of a catalogue path"""
+        relative = CleanPath(path)[len(self.base):].lstrip('/')
+        return os.path.join(self.root, relative)
+
+    def CataloguePath(self, local):
+        """the catalogue path of a local path"""
+        relative = os.path.relpath(local, self.root)
+        if relative == '.':
+            return self.base
+        return self.base.rstrip('/') + '/' + relative
+
+    def ListDirectory(self, path):
+        """Listing of path"""
+        local = self.LocalPath(path)
+        dirs = dict()
+        files = list()
+        for name in sorted(os.listdir(local)):
+            child = os.path.join(local, name)
+            stat = os.stat(child)
+            if os.path.isdir(child):
+                dirs[self.CataloguePath(child)] = repr(stat.st_mtime)
+            else:
+                files.append(CatalogueFile(self.CataloguePath(child),
+                                           stat.st_size, '', '',
+                                           repr(stat.st_mtime)))
+        return Listing(CleanPath(path), repr(os.stat(local).st_mtime),
+                       dirs, files)
+
+    def StatDirectories(self, paths):
+        """{path: mtime} of the paths that exist"""
+        mtimes = dict()
+        for path in paths:
+            local = self.LocalPath(path)
+            if os.path.isdir(local):
+                mtimes[path] = repr(os.stat(local).st_mtime)
+        return mtimes
+
+    def GetReplicas(self, lfns):
+        """{lfn: {SE: SURL}}"""
+        return dict((lfn, {self.se: 'file://' + self.LocalPath(lfn)})
+                    for lfn in lfns)
+
+    def Close(self):
+        """nothing to close"""
+        pass
+
+
+class CatalogueMirror(object):
+    """
+    The SQLite catalogue mirror. Only the crawler writes, from the
+    calling thread, so one connection is shared by every method.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self.db = sqlite3.connect(dbpath, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+        self.nListed = 0
+        self.nSkipped = 0
+
+    def Close(self):
+        """close the database"""
+        self.db.close()
+
+    # Crawling
+    def Refresh(self, root, lister, max_workers=8, replicas=True,
+                force=False, chunk=500):
+        """
+        Bring the mirror of root up to date. A directory is re-listed when
+        its modification time changed, when it has never been listed or
+        when force is set. Replicas are looked up for new and changed
+        files only; adding a replica does not change a directory's
+        modification time, so use force or RefreshReplicas() to pick up
+        replicas of existing files.
+        Returns the number of directories listed.
+        """
+        root = CleanPath(root)
+        self.nListed = self.nSkipped = 0
+        frontier = [root]
+        while frontier:
+            mtimes = dict()
+            for first in range(0, len(frontier), chunk):
+                mtimes.update(lister.StatDirectories(frontier[first:
+                                                              first+chunk]))
+            stored = self.DirectoryTimes(frontier)
+
+            changed = list()
+            next_frontier = list()
+            for path in frontier:
+                if path not in mtimes:
+                    self.RemoveDirectory(path)
+                elif force or stored.get(path) != mtimes[path]:
+                    changed.append(path)
+                else:
+                    # checked just now, so as fresh as a listing
+                    self.db.execute('UPDATE dirs SET listed = ? WHERE '
+                                    'path = ?', (time.time(), path))
+                    self.nSkipped += 1
+                    next_frontier.extend(self.SubDirectories(path))
+
+            listings = ND280Computing.ParallelMap(lister.ListDirectory,
+                                                  changed, max_workers)
+            for path, listing in zip(changed, listings):
+                if isinstance(listing, Exception):
+                    print 'Could not list %s: %s' % (path, listing)
+                    continue
+                new = self.StoreListing(listing)
+                self.nListed += 1
+                if replicas and new:
+                    self.StoreReplicas(self.LookupReplicas(lister, new,
+                                                           max_workers,
+                                                           chunk))
+                next_frontier.extend(sorted(listing.dirs))
+            self.db.commit()
+            frontier = next_frontier
+        return self.nListed
+
+    def RefreshReplicas(self, root, lister, max_workers=8, chunk=500):
+        """look up the replicas of every file below root again"""
+        lfns = self.Find(root)
+        self.StoreReplicas(self.LookupReplicas(lister, lfns, max_workers,
+                                               chunk), lfns)
+        self.db.commit()
+
+    def LookupReplicas(self, lister, lfns, max_workers, chunk):
+        """{lfn: {SE: SURL}} with the chunks looked up concurrently"""
+        chunks = [lfns[first:first+chunk]
+                  for first in range(0, len(lfns), chunk)]
+        replicas = dict()
+        for result in ND280Computing.ParallelMap(lister.GetReplicas, chunks,
+                                                 max_workers):
+            if isinstance(result, Exception):
+                print 'Could not look up replicas: %s' % result
+                continue
+            replicas.update(result)
+        return replicas
+
+    def StoreListing(self, listing):
+        """replace the stored contents of a directory by listing, returns
+        the LFNs that are new or changed"""
+        path = CleanPath(listing.path)
+        old = dict(self.db.execute('SELECT lfn, mtime || size FROM files '
+                                   'WHERE dir = ?', (path,)))
+        new = [f.lfn for f in listing.files
+               if old.get(f.lfn) != '%s%d' % (f.mtime, f.size)]
+
+        # subdirectories that disappeared, with everything below them
+        listed = set(CleanPath(d) for d in listing.dirs)
+        for subdir in self.SubDirectories(path):
+            if subdir not in listed:
+                self.RemoveDirectory(subdir)
+
+        gone = set(old) - set(f.lfn for f in listing.files)
+        self.db.executemany('DELETE FROM files WHERE lfn = ?',
+                            [(lfn,) for lfn in gone])
+        self.db.executemany('DELETE FROM replicas WHERE lfn = ?',
+                            [(lfn,) for lfn in gone])
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?)',
+                            [(f.lfn, path, f.lfn.split('/')[-1], f.size,
+                              f.guid, f.checksum, f.mtime)
+                             for f in listing.files])
+        # new subdirectories get no mtime, so the next level lists them
+        self.db.executemany('INSERT OR IGNORE INTO dirs VALUES '
+                            '(?, ?, NULL, NULL)',
+                            [(CleanPath(d), path) for d in listing.dirs])
+        self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                        (path, ParentPath(path), listing.mtime, time.time()))
+        return new
+
+    def StoreReplicas(self, replicas, lfns=None):
+        """replace the stored replicas of lfns (default the keys of
+        replicas) by replicas {lfn: {SE: SURL}}"""
+        if lfns is None:
+            lfns = replicas.keys()
+        self.db.executemany('DELETE FROM replicas WHERE lfn = ?',
+                            [(lfn,) for lfn in lfns])
+        self.db.executemany('INSERT OR REPLACE INTO replicas VALUES '
+                            '(?, ?, ?)',
+                            [(lfn, se, surl)
+                             for lfn in lfns
+                             for se, surl in replicas.get(lfn, {}).items()])
+
+    def RemoveDirectory(self, path):
+        """forget a directory and everything below it"""
+        for table, column in (('replicas', 'lfn'), ('files', 'lfn'),
+                              ('dirs', 'path')):
+            self.db.execute('DELETE FROM %s WHERE %s = ? OR '
+                            '(%s >= ? AND %s < ?)' %
+                            (table, column, column, column),
+                            [path] + Below(path))
+
+    # Queries
+    def DirectoryTimes(self, paths):
+        """{path: mtime} of the stored directories among paths"""
+        times = dict()
+        for path in paths:
+            row = self.db.execute('SELECT mtime FROM dirs WHERE path = ?',
+                                  (path,)).fetchone()
+            if row and row[0] is not None:
+                times[path] = row[0]
+        return times
+
+    def SubDirectories(self, path):
+        """the stored subdirectories of path"""
+        return [row[0] for row in
+                self.db.execute('SELECT path FROM dirs WHERE parent = ? '
+                                'AND path != ? ORDER BY path',
+                                (CleanPath(path), CleanPath(path)))]
+
+    def Age(self, path):
+        """seconds since path was last listed, None if it never was"""
+        row = self.db.execute('SELECT listed FROM dirs WHERE path = ?',
+                              (CleanPath(path),)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return time.time() - row[0]
+
+    def Where(self, path, name='*', recursive=True):
+        """SQL condition and parameters selecting files below path"""
+        path = CleanPath(path)
+        if recursive:
+            condition = '(dir = ? OR (dir >= ? AND dir < ?))'
+            parameters = [path] + Below(path)
+        else:
+            condition = 'dir = ?'
+            parameters = [path]
+        if name != '*':
+            condition += ' AND name GLOB ?'
+            parameters.append(name)
+        return condition, parameters
+
+    def Find(self, path, name='*', recursive=True):
+        """sorted LFNs below path whose file name matches name"""
+        condition, parameters = self.Where(path, name, recursive)
+        return [row[0] for row in
+                self.db.execute('SELECT lfn FROM files WHERE ' + condition +
+                                ' ORDER BY lfn', parameters)]
+
+    def Files(self, path, name='*', recursive=True, se=''):
+        """CatalogueFiles below path whose file name matches name (and
+        that have a replica on se)"""
+        condition, parameters = self.Where(path, name, recursive)
+        if se:
+            condition += ' AND lfn IN (SELECT lfn FROM replicas WHERE se = ?)'
+            parameters.append(se)
+        return [CatalogueFile(*row) for row in
+                self.db.execute('SELECT lfn, size, guid, checksum, mtime '
+                                'FROM files WHERE ' + condition +
+                                ' ORDER BY lfn', parameters)]
+
+    def Replicas(self, lfns):
+        """{lfn: {SE: SURL}} of lfns"""
+        replicas = dict((lfn, dict()) for lfn in lfns)
+        for lfn in lfns:
+            for se, surl in self.db.execute('SELECT se, surl FROM replicas '
+                                            'WHERE lfn = ?', (lfn,)):
+                replicas[lfn][se] = surl
+        return replicas
+
+    def Size(self, path, name='*', recursive=True):
+        """number of files and total size in bytes below path"""
+        condition, parameters = self.Where(path, name, recursive)
+        nFiles, size = self.db.execute('SELECT COUNT(*), SUM(size) FROM '
+                                       'files WHERE ' + condition,
+                                       parameters).fetchone()
+        return nFiles, size or 0
+
+    def FilesOnSE(self, se, path='/', present=True):
+        """sorted LFNs below path with (or, present=False, without) a
+        replica on se"""
+        condition, parameters = self.Where(path)
+        test = 'IN' if present else 'NOT IN'
+        return [row[0] for row in
+                self.db.execute('SELECT lfn FROM files WHERE ' + condition +
+                                ' AND lfn %s (SELECT lfn FROM replicas '
+                                'WHERE se = ?) ORDER BY lfn' % test,
+                                parameters + [se])]
+
+    def ReplicaCounts(self, path='/', recursive=True):
+        """{SE: number of replicas} below path"""
+        condition, parameters = self.Where(path, recursive=recursive)
+        return dict(self.db.execute('SELECT se, COUNT(*) FROM replicas '
+                                    'WHERE lfn IN (SELECT lfn FROM files '
+                                    'WHERE ' + condition + ') GROUP BY se',
+                                    parameters))
+
+
+def GetMirror(path=''):
+    """the CatalogueMirror named by $ND280CATALOGUE (or path), None if
+    there is none"""
+    path = path or getenv('ND280CATALOGUE', '')
+    if not path or not os.path.exists(path):
+        return None
+    return CatalogueMirror(path)
+
+
+def GetMaxAge():
+    """oldest mirror listing, in seconds, that ND280Dir will use instead
+    of the live catalogue, from $ND280CATALOGUEMAXAGE (default one day)"""
+    return float(getenv('ND280CATALOGUEMAXAGE', 24 * 3600))
@@ -1,6 +1,13 @@
 #!/usr/bin/env python2
 
-from subprocess import Popen, PIPE
+import os
+from Queue import Queue
+import random
+import re
+import signal
+from subprocess import Popen, PIPE, STDOUT
+import threading
+import time
 
 # t2k.org VO name
 VO = 't2k.org'
@@ -57,23 +64,298 @@ class LCG(object):
         self.bringonline = self.commands['bringonline']
 
 
-def GetListPopenCommand(command):
+class CommandResult(object):
+    """the outcome of one shell command run by a CommandExecutor"""
+
+    def __init__(self, command):
+        self.command = command
+        self.lines = list()
+        self.errors = list()
+        self.returncode = None
+        self.timedout = False
+        self.duration = 0.
+
+    def IsOK(self):
+        """finished inside its timeout, exit code 0 and nothing on stderr"""
+        return (not self.timedout and self.returncode == 0 and
+                not self.errors)
+
+
+class CommandExecutor(object):
+    """Run shell commands, many at once if asked.
+
+    Both stdout and stderr are drained together so a command that fills
+    its stderr pipe can not stall, and each command gets a real wall-clock
+    timeout (ulimit -t only clocks CPU time). At most max_workers commands
+    run at any one time, shared across every thread using this executor.
+    """
+
+    def __init__(self, max_workers=8, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.lock = threading.Lock()
+        self.nCommands = 0
+        self.nTimeouts = 0
+
+    def Run(self, command, timeout=None, merge_stderr=False):
+        """run a single command and return its CommandResult,
+        timeout=None uses the executor default, 0 means no limit"""
+        if timeout is None:
+            timeout = self.timeout
+        self.slots.acquire()
+        try:
+            return self._Execute(command, timeout, merge_stderr)
+        finally:
+            self.slots.release()
+
+    def RunMany(self, commands, timeout=None, merge_stderr=False):
+        """run a list of commands concurrently, returns the
+        CommandResults in the same order as the commands"""
+        return ParallelMap(lambda command: self.Run(command, timeout,
+                                                    merge_stderr),
+                           commands, self.max_workers)
+
+    def _Execute(self, command, timeout, merge_stderr):
+        """spawn the command in its own process group and wait for it"""
+        result = CommandResult(command)
+        start = time.time()
+        stderr = PIPE
+        if merge_stderr:
+            stderr = STDOUT
+        try:
+            popen = Popen([command], shell=True, stdin=PIPE, stdout=PIPE,
+                          stderr=stderr, close_fds=True,
+                          preexec_fn=os.setsid)
+        except OSError as exception:
+            result.errors = [str(exception) + '\n']
+            return result
+        with self.lock:
+            self.nCommands += 1
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._Kill, [popen, result])
+            timer.daemon = True
+            timer.start()
+        try:
+            out, err = popen.communicate()
+        finally:
+            if timer:
+                timer.cancel()
+                timer.join()
+
+        result.returncode = popen.returncode
+        result.lines = (out or '').splitlines(True)
+        result.errors = (err or '').splitlines(True)
+        result.duration = time.time() - start
+        if result.timedout:
+            with self.lock:
+                self.nTimeouts += 1
+            result.errors.append('Timed out after %d seconds\n' % timeout)
+        return result
+
+    def _Kill(self, popen, result):
+        """timer callback, kill the whole process group of a command"""
+        result.timedout = True
+        try:
+            os.killpg(popen.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def ParallelMap(function, items, max_workers=8):
+    """apply function to every item using at most max_workers threads,
+    results are returned in the order of the items. An exception in
+    function is returned in place of that item's result"""
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    todo = Queue()
+    for index, item in enumerate(items):
+        todo.put((index, item))
+
+    def Worker():
+        while True:
+            try:
+                index, item = todo.get_nowait()
+            except Exception:
+                return
+            try:
+                results[index] = function(item)
+            except Exception as exception:
+                results[index] = exception
+
+    threads = [threading.Thread(target=Worker)
+               for ii in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# Shared executor so the cap on concurrent commands holds process wide,
+# ND280MAXCOMMANDS overrides the default cap
+COMMAND_EXECUTOR = CommandExecutor(int(os.getenv('ND280MAXCOMMANDS', 8)))
+
+
+def GetCommandExecutor():
+    """simple get'er for the shared CommandExecutor"""
+    return COMMAND_EXECUTOR
+
+
+def SetCommandExecutor(executor):
+    """replace the shared CommandExecutor, e.g. to change the cap"""
+    global COMMAND_EXECUTOR
+    COMMAND_EXECUTOR = executor
+
+
+class RetryFlags(object):
+    """a namespace for retry decisions"""
+    kRetry = 0
+    kFail = 1
+    kSuccess = 2
+
+
+class RetryPolicy(object):
+    """Decide if, and after how long, a failed grid command is retried.
+
+    The wait before retry n is min(max_delay, base_delay * 2**n) less a
+    random jitter fraction, so bursts of failures do not retry in step.
+    Rules map error text to a decision: retry, fail fast, or treat the
+    command as a success (e.g. 'already exists'). The first matching
+    rule wins, unmatched errors are retried. budget is the total number
+    of seconds that may be spent on retries by this policy, after which
+    failures are returned straight away.
+    """
+
+    def __init__(self, max_tries=3, base_delay=10*StatusWait.kSecond,
+                 max_delay=5*StatusWait.kMinute, jitter=0.5, budget=None):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget = budget
+        self.rules = list()
+        self.lock = threading.Lock()
+
+        # Counters
+        self.nRetries = 0
+        self.nFailFast = 0
+        self.nExhausted = 0
+        self.retryTime = 0.
+
+        # Default rules, new rules go here
+        self.AddRule('already exists', RetryFlags.kSuccess)
+        self.AddRule('(?i)no such file|does not exist|not found',
+                     RetryFlags.kFail)
+        self.AddRule('(?i)permission denied|unauthori[sz]ed|'
+                     'proxy.*expired|usage: |invalid option',
+                     RetryFlags.kFail)
+
+    def AddRule(self, pattern, flag):
+        """add a rule mapping a regex on the command output to a flag,
+        rules added later are checked after the existing ones"""
+        self.rules.append((re.compile(pattern), flag))
+
+    def Classify(self, result):
+        """the RetryFlags decision for a CommandResult"""
+        if result.timedout:
+            return RetryFlags.kRetry
+        if not result.errors:
+            return RetryFlags.kSuccess
+        text = ''.join(result.lines + result.errors)
+        for regex, flag in self.rules:
+            if regex.search(text):
+                return flag
+        return RetryFlags.kRetry
+
+    def Delay(self, attempt):
+        """seconds to wait before retry number attempt (from 0)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * (1. - self.jitter * random.random())
+
+    def BudgetLeft(self):
+        """seconds of retry budget left, None if unlimited"""
+        if self.budget is None:
+            return None
+        return max(0., self.budget - self.retryTime)
+
+    def Run(self, command, timeout=None, executor=None, merge_stderr=False):
+        """run command, retrying according to the policy, and return the
+        last CommandResult. A result classified as a success has its
+        errors cleared"""
+        if not executor:
+            executor = GetCommandExecutor()
+        for attempt in range(self.max_tries):
+            print 'Try %d of %s with %s timeout' % (attempt, command, timeout)
+            result = executor.Run(command, timeout, merge_stderr)
+            flag = self.Classify(result)
+            if flag == RetryFlags.kSuccess:
+                result.errors = list()
+                return result
+            print 'ERROR!'
+            print ''.join(result.errors)
+            if flag == RetryFlags.kFail:
+                with self.lock:
+                    self.nFailFast += 1
+                return result
+            if attempt + 1 == self.max_tries:
+                break
+            delay = self.Delay(attempt)
+            left = self.BudgetLeft()
+            if left is not None and delay + result.duration > left:
+                print 'Retry budget used up, not retrying'
+                break
+            with self.lock:
+                self.nRetries += 1
+                self.retryTime += delay + result.duration
+            print 'Retrying in %.1f seconds' % delay
+            time.sleep(delay)
+        with self.lock:
+            self.nExhausted += 1
+        return result
+
+    def Summary(self):
+        """one line summary of the counters"""
+        return '%d retries costing %.1f seconds, %d failed fast, \
+%d gave up' % (self.nRetries, self.retryTime, self.nFailFast,
+                 self.nExhausted)
+
+
+# Shared retry policy, ND280RETRYBUDGET (seconds) caps the
+# time a single run may spend retrying
+RETRY_BUDGET = os.getenv('ND280RETRYBUDGET')
+if RETRY_BUDGET:
+    RETRY_BUDGET = float(RETRY_BUDGET)
+else:
+    RETRY_BUDGET = None
+RETRY_POLICY = RetryPolicy(budget=RETRY_BUDGET)
+
+
+def GetRetryPolicy():
+    """simple get'er for the shared RetryPolicy"""
+    return RETRY_POLICY
+
+
+def SetRetryPolicy(policy):
+    """replace the shared RetryPolicy"""
+    global RETRY_POLICY
+    RETRY_POLICY = policy
+
+
+def GetListPopenCommand(command, timeout=None):
     """submits a command with the stdin, out, and err available for printing
     return the list of lines"""
 
-    try:
-        popen = Popen([command], shell=True,
-                      stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        lines = popen.stdout.readlines()
-        errors = popen.stderr.readlines()
-        # Something bad happened...
-        if errors:
-            print '\n'.join(errors)
-            raise Exception
-
-        return lines, errors
-
-    # Something else bad happened...
-    except Exception as exception:
-        print str(exception)
-    return [], errors
+    result = GetCommandExecutor().Run(command, timeout)
+    # Something bad happened...
+    if result.errors:
+        print '\n'.join(result.errors)
+        return [], result.errors
+
+    return result.lines, result.errors
@@ -4,14 +4,19 @@ The DIRAC API creates a JDL (not stored locally)
 file at submission. These classes help facilitate
 creating job scripts
 """
+import atexit
 from datetime import date, datetime
+import json
 import time
 import os
 from os import getenv
 from os.path import isfile, join
-import ND280GRID
+import select
+from subprocess import Popen, PIPE
+import threading
 import ND280Computing
 from ND280Computing import NONRUNND280JOBS
+from DIRACWorker import UNITS as SIZE_UNITS
 
 
 class ND280DIRACProcess(object):
@@ -25,32 +30,57 @@ class ND280DIRACProcess(object):
         """an internal class for errors"""
         pass
 
+    defaults = {
+                   'CPUTime': 86400,
+                   # TODO Below not suppported by DIRAC v6r19p10
+                   # TODO Check Supported API functionality for newer versions
+                   'Memory': 20971520,
+                   'VMemory': 4194304
+               }
+
     def __init__(self, nd280_filename, nd280ver, jobtype,
                  executable, argument, options={}):
         self.job_descript = None
         self.executable = executable
         self.argument = argument + nd280_filename
-        self.options = dict()
-
-        defaults = {
-                       'CPUTime': 86400,
-                       # TODO Below not suppported by DIRAC v6r19p10
-                       # TODO Check Supported API functionality for newer versions
-                       'Memory': 20971520,
-                       'VMemory': 4194304
-                   }
+        self.SetOptions(options)
+        self.nd280_filename = nd280_filename
+        # jd stands for job description
+        self.jd = ND280DIRACJobDescription(nd280_filename, nd280ver, jobtype,
+                                           self.executable, self.argument,
+                                           self.options)
 
+    def SetOptions(self, options):
+        """the defaults, overridden by options"""
+        self.options = dict()
         # set defaults first
-        for key, value in defaults.iteritems():
+        for key, value in self.defaults.iteritems():
             self.options[key] = value
         # now set what inputs
         for key, value in options.iteritems():
             self.options[key] = value
-        self.nd280_filename = nd280_filename
+
+
+class ND280DIRACParametricProcess(ND280DIRACProcess):
+    """
+    An ND280DIRACProcess over many input files at once, submitted as
+    one DIRAC parametric job. The input files are ND280LazyFiles that
+    have already been checked in the catalogue
+    """
+
+    def __init__(self, nd280_files, nd280ver, jobtype,
+                 executable, argument, options={}):
+        self.job_descript = None
+        self.executable = executable
+        self.argument = argument
+        self.SetOptions(options)
+        self.nd280_files = list(nd280_files)
         # jd stands for job description
-        self.jd = ND280DIRACJobDescription(nd280_filename, nd280ver, jobtype,
-                                           self.executable, self.argument,
-                                           self.options)
+        self.jd = ND280DIRACParametricJobDescription(self.nd280_files,
+                                                     nd280ver, jobtype,
+                                                     self.executable,
+                                                     self.argument,
+                                                     self.options)
 
 
 class ND280DIRACJobDescription(object):
@@ -65,6 +95,8 @@ class ND280DIRACJobDescription(object):
 
     def __init__(self, nd280_filename, nd280ver, jobtype,
                  executable, argument, options={}):
+        # imported here as ND280GRID imports this module
+        import ND280GRID
         self.scriptname = str()
         self.nd280_file = ND280GRID.ND280File(nd280_filename)
         self.nd280ver = nd280ver
@@ -89,17 +121,24 @@ class ND280DIRACJobDescription(object):
            process: spill OR cosmic trigger
         """
 
-        self.scriptname = 'ND280' + self.jobtype
+        self.scriptname = self.InputName(self.nd280_file)
+        self.SetupSandboxes()
+        return 0
+
+    def InputName(self, nd280_file):
+        """the script and jid file name of a job on nd280_file"""
+        name = 'ND280' + self.jobtype
         # Don't add trigger to JDL for non runND280 jobs
         if self.jobtype not in NONRUNND280JOBS:
             if 'trigger' in self.options.keys():
-                self.scriptname += '_' + str(self.options['trigger'])
-        run_num = self.nd280_file.GetRunNumber()
-        run_subnum = self.nd280_file.GetSubRunNumber()
+                name += '_' + str(self.options['trigger'])
+        run_num = nd280_file.GetRunNumber()
+        run_subnum = nd280_file.GetSubRunNumber()
         file_descriptors = [self.nd280ver, str(run_num), str(run_subnum)]
-        self.scriptname += '_' + '_'.join(file_descriptors)
+        return name + '_' + '_'.join(file_descriptors)
 
-        # create the input and output sandboxes
+    def SetupSandboxes(self):
+        """create the input and output sandboxes"""
         py_files = [self.executable]
         nd280_comp = getenv('ND280COMPUTINGROOT')
         for fn in os.listdir('%s/tools' % nd280_comp):
@@ -112,7 +151,6 @@ class ND280DIRACJobDescription(object):
         if self.cfgfile:
             self.inputSandbox.append(self.cfgfile)
         self.outputSandbox = ['std.out', 'std.err', '%s.log' % self.scriptname]
-        return 0
 
     def CreateDIRACAPIFile(self, dir=''):
         """let DIRAC API handle creating the JDL info"""
@@ -121,72 +159,8 @@ class ND280DIRACJobDescription(object):
             if dir:
                 self.scriptname = os.path.join(dir, self.scriptname)
             scriptfile = open('%s.py' % (self.scriptname), "w")
-
-            # environment
-            scriptfile.write('#!/usr/bin/env python2\n')
-
-            # imports
-            scriptfile.write('from DIRAC.Core.Base import Script\n')
-            scriptfile.write('Script.parseCommandLine()\n')
-            scriptfile.write('from DIRAC.Interfaces.API.Dirac import Dirac\n')
-            scriptfile.write('from DIRAC.Interfaces.API.Job import Job\n')
-            scriptfile.write('import ND280DIRACAPI\n')
-            scriptfile.write('\n')
-            scriptfile.write('diracJob = Job(\"\",\"std.out\",\"std.err\")\n')
-
-            # job name
-            scriptfile.write('diracJob.setName(\"%s\")\n' % self.scriptname)
-            # job exe, args, and logFile
-            scriptfile.write('diracJob.setExecutable(\"%s\", arguments=\"%s\", \
-logFile=\"%s.log\")\n' % (self.executable, self.argument, self.scriptname))
-
-            # job input Sandbox
-            # it seems that * does not work with DIRAC v6r19p10
-            scriptfile.write('inputSandbox = [\"%s\"' % self.inputSandbox[0])
-            for i_file in range(1, len(self.inputSandbox)):
-                scriptfile.write(', \"%s\"' % self.inputSandbox[i_file])
-            scriptfile.write(']\n')
-            scriptfile.write('diracJob.setInputSandbox(inputSandbox)\n')
-
-            # job output Sandbox
-            scriptfile.write('outputSandbox = [\"%s\"' % self.outputSandbox[0])
-            for i_file in range(1, len(self.outputSandbox)):
-                scriptfile.write(', \"%s\"' % self.outputSandbox[i_file])
-            scriptfile.write(']\n')
-            scriptfile.write('diracJob.setOutputSandbox(outputSandbox)\n')
-            # job environmental variables
-            scriptfile.write('diracJob.setExecutionEnv({\
-\"VO_T2K_ORG_SW_DIR\": \"%s\"})\n' % (getenv('VO_T2K_ORG_SW_DIR')))
-            if 'CPUTime' in self.options.keys():
-                tlim = self.options['CPUTime']
-                scriptfile.write('diracJob.setCPUTime(%d)\n' % tlim)
-            scriptfile.write('\n')
-
-            # # banned sites
-            # scriptfile.write('diracJob.setBannedSites([\"%s\"' % self.bannedSites[0])
-            # for i_banned_site in range(1, len(self.bannedSites)):
-            #     scriptfile.write(',\"%s\"' % self.bannedSites[i_banned_site])
-            # scriptfile.write('])\n')
-
-            # submit the job
-            scriptfile.write('print \"submitting job %s\"\n' % (self.scriptname))
-            scriptfile.write('dirac = Dirac()\n')
-            scriptfile.write('result = dirac.submitJob(diracJob)\n')
-            scriptfile.write('print \"Submission Result: \", result\n')
-            scriptfile.write('\n')
-
-            # write a job ID (JID) file for DIRAC to read, user to know JID
-            scriptfile.write('try:\n')
-            scriptfile.write('    jid = ND280DIRACAPI.GetJobIDFromSubmit(result)\n')
-            scriptfile.write('    if jid is not \"-1\":\n')
-            scriptfile.write('        jid_file = open(\"%s.jid\", \"w\")\n' % (self.scriptname))
-            scriptfile.write('        jid_file.write(\'%s\\n\' % jid)\n')
-            scriptfile.write('        jid_file.close()\n')
-            scriptfile.write('    else:\n')
-            scriptfile.write('        print \"Unable to creaate jid file for this job:\", jobName\n')
-            scriptfile.write('except Exception as exception:\n')
-            scriptfile.write('    print str(exception)\n')
-            scriptfile.write('    print \"Unable to creaate jid file for this job:\", jobName')
+            self.WriteJob(scriptfile)
+            self.WriteSubmit(scriptfile)
             scriptfile.close()
         except self.Error as error:
                 print str(error)
@@ -198,9 +172,164 @@ logFile=\"%s.log\")\n' % (self.executable, self.argument, self.scriptname))
             print str(error)
             print 'Unable to close job file'
 
+    def WriteJob(self, scriptfile):
+        """write the imports and the diracJob definition"""
+        # environment
+        scriptfile.write('#!/usr/bin/env python2\n')
+
+        # imports
+        scriptfile.write('from DIRAC.Core.Base import Script\n')
+        scriptfile.write('Script.parseCommandLine()\n')
+        scriptfile.write('from DIRAC.Interfaces.API.Dirac import Dirac\n')
+        scriptfile.write('from DIRAC.Interfaces.API.Job import Job\n')
+        scriptfile.write('import ND280DIRACAPI\n')
+        scriptfile.write('\n')
+        scriptfile.write('diracJob = Job(\"\",\"std.out\",\"std.err\")\n')
+
+        # job name
+        scriptfile.write('diracJob.setName(\"%s\")\n' % self.scriptname)
+        # job exe, args, and logFile
+        scriptfile.write('diracJob.setExecutable(\"%s\", arguments=\"%s\", \
+logFile=\"%s.log\")\n' % (self.executable, self.argument, self.scriptname))
+
+        # job input Sandbox
+        # it seems that * does not work with DIRAC v6r19p10
+        scriptfile.write('inputSandbox = [\"%s\"' % self.inputSandbox[0])
+        for i_file in range(1, len(self.inputSandbox)):
+            scriptfile.write(', \"%s\"' % self.inputSandbox[i_file])
+        scriptfile.write(']\n')
+        scriptfile.write('diracJob.setInputSandbox(inputSandbox)\n')
+
+        # job output Sandbox
+        scriptfile.write('outputSandbox = [\"%s\"' % self.outputSandbox[0])
+        for i_file in range(1, len(self.outputSandbox)):
+            scriptfile.write(', \"%s\"' % self.outputSandbox[i_file])
+        scriptfile.write(']\n')
+        scriptfile.write('diracJob.setOutputSandbox(outputSandbox)\n')
+        # job environmental variables
+        scriptfile.write('diracJob.setExecutionEnv({\
+\"VO_T2K_ORG_SW_DIR\": \"%s\"})\n' % (getenv('VO_T2K_ORG_SW_DIR')))
+        if 'CPUTime' in self.options.keys():
+            tlim = self.options['CPUTime']
+            scriptfile.write('diracJob.setCPUTime(%d)\n' % tlim)
+        # DIRAC site(s) to run at, comma separated
+        if self.options.get('site'):
+            scriptfile.write('diracJob.setDestination(%r)\n' %
+                             self.options['site'].split(','))
+        # banned sites, ND280Resubmit rewrites this line on resubmission
+        if self.bannedSites:
+            scriptfile.write('diracJob.setBannedSites(%r)\n' %
+                             self.bannedSites)
+        scriptfile.write('\n')
+
+    def WriteSubmit(self, scriptfile):
+        """write the submission and the jid file writing"""
+        # submit the job
+        scriptfile.write('print \"submitting job %s\"\n' % (self.scriptname))
+        scriptfile.write('dirac = Dirac()\n')
+        scriptfile.write('result = dirac.submitJob(diracJob)\n')
+        scriptfile.write('print \"Submission Result: \", result\n')
+        scriptfile.write('\n')
+
+        # write a job ID (JID) file for DIRAC to read, user to know JID
+        scriptfile.write('try:\n')
+        scriptfile.write('    jid = ND280DIRACAPI.GetJobIDFromSubmit(result)\n')
+        scriptfile.write('    if jid is not \"-1\":\n')
+        scriptfile.write('        jid_file = open(\"%s.jid\", \"a\")\n' % (self.scriptname))
+        scriptfile.write('        jid_file.write(\'%s\\n\' % jid)\n')
+        scriptfile.write('        jid_file.close()\n')
+        scriptfile.write('    else:\n')
+        scriptfile.write('        print \"Unable to creaate jid file for this job:\", jobName\n')
+        scriptfile.write('except Exception as exception:\n')
+        scriptfile.write('    print str(exception)\n')
+        scriptfile.write('    print \"Unable to creaate jid file for this job:\", jobName')
+
+
+class ND280DIRACParametricJobDescription(ND280DIRACJobDescription):
+    """
+    A DIRAC parametric job: the same executable and arguments over many
+    input files, each file (appended to the arguments and used as the
+    input data) a job of its own, all submitted by one submitJob call.
+    The job IDs are written to the jid file of each input, named by
+    InputName as a single ND280DIRACJobDescription job on it (not as the
+    ND280JDL jobs). The JDL only options regexp and queuelim have no
+    DIRAC API equivalent and are refused
+    """
+
+    def __init__(self, nd280_files, nd280ver, jobtype,
+                 executable, argument, options={}):
+        self.scriptname = str()
+        self.nd280_files = list(nd280_files)
+        if not self.nd280_files:
+            raise self.Error('No input files for the parametric job')
+        for option in ('regexp', 'queuelim'):
+            if options.get(option):
+                raise self.Error('The %s option only applies to JDL jobs, '
+                                 'choose sites with the site option' % option)
+        self.nd280ver = nd280ver
+        self.jobtype = jobtype
+        self.executable = executable
+        self.argument = argument + '%(InputFile)s'
+        self.options = options
+        self.cfgfile = None
+        self.bannedSites = list()
+        self.inputSandbox = list()
+        self.outputSandbox = list()
+        self.SetupDIRACAPIInfo()
+
+    def SetupDIRACAPIInfo(self):
+        """name the job after its first input and the number of inputs"""
+        self.scriptname = '%s_bulk%d' % (self.InputName(self.nd280_files[0]),
+                                         len(self.nd280_files))
+        self.SetupSandboxes()
+        return 0
+
+    def JIDFiles(self):
+        """the jid file of every input, next to the script"""
+        directory = os.path.abspath(os.path.dirname(self.scriptname))
+        return [join(directory, self.InputName(nd280_file) + '.jid')
+                for nd280_file in self.nd280_files]
+
+    def WriteJob(self, scriptfile):
+        """the diracJob definition with the input files as parameters"""
+        ND280DIRACJobDescription.WriteJob(self, scriptfile)
+        lfns = [nd280_file.GetLFNPath() for nd280_file in self.nd280_files]
+        scriptfile.write('inputFiles = %r\n' % [nd280_file.LFN() for
+                                               nd280_file in self.nd280_files])
+        scriptfile.write('inputData = %r\n' % ['LFN:' + lfn for lfn in lfns])
+        scriptfile.write('diracJob.setParameterSequence(\"InputFile\", \
+inputFiles)\n')
+        scriptfile.write('diracJob.setParameterSequence(\"InputData\", \
+inputData, addToWorkflow=\"ParametricInputData\")\n')
+        scriptfile.write('\n')
+
+    def WriteSubmit(self, scriptfile):
+        """write the submission and the jid file of every input, the
+        script exits 1 if the submission failed"""
+        scriptfile.write('print \"submitting %d jobs %s\"\n' %
+                         (len(self.nd280_files), self.scriptname))
+        scriptfile.write('dirac = Dirac()\n')
+        scriptfile.write('result = dirac.submitJob(diracJob)\n')
+        scriptfile.write('print \"Submission Result: \", result\n')
+        scriptfile.write('\n')
+
+        # one jid file per input, in the order of the parameters
+        scriptfile.write('jidFiles = %r\n' % self.JIDFiles())
+        scriptfile.write('written = ND280DIRACAPI.WriteParametricJIDs(result, \
+jidFiles)\n')
+        scriptfile.write('print \"Wrote %d jid files\" % written\n')
+
+        # fail the script when nothing was submitted, for the caller
+        scriptfile.write('if not result.get(\"OK\") or not written:\n')
+        scriptfile.write('    print \"Unable to submit %s\"\n' %
+                         self.scriptname)
+        scriptfile.write('    import sys\n')
+        scriptfile.write('    sys.exit(1)\n')
+
 
 class DIRACBase(object):
-    """dirac commands with a 10minute timeout"""
+    """dirac commands with a 10minute timeout, retried
+    according to the shared ND280Computing.RetryPolicy"""
 
 
     class Error(Exception):
@@ -213,6 +342,7 @@ class DIRACBase(object):
         self.command = str()
         self.args = dict()
         self.inputs = list()
+        self.retry = ND280Computing.GetRetryPolicy()
         # self.EnableDebug()
 
     def EnableDebug(self, enable=True):
@@ -223,36 +353,46 @@ class DIRACBase(object):
             del self.args['-ddd']
 
     def RemoveLFNString(self, inString):
-        """Remove any instance of "LFN:" and "lfn:" from the input string """
+        """Remove any instance of "LFN:" and "lfn:" from the input string,
+        or from each string in a list"""
         if type(inString) is str:
             return inString.replace('LFN:', '').replace('lfn:', '')
+        if type(inString) is list:
+            return [self.RemoveLFNString(a_string) for a_string in inString]
 
     def Run(self, PrintCommand=False, PrintLines=True, PrintErrors=False):
         """almost equivalent to __str__, but with errors and multiple calls"""
         if PrintCommand:
             print self.command
 
-        # Limit the execution time
-        # - note this only clocks CPU time so zombie
-        # processes will last forever..
-        SelfCommand = self.__str__()
-        # command = 'ulimit -t ' + str(self.timeout) + '\n'
-        command = SelfCommand
+        # The executor enforces a wall clock limit on the command,
+        # an open DIRACSession answers instead of a new process
+        command = self.__str__()
+        executor = None
+        session = GetSession()
+        if session and self.SessionRequest():
+            command = self.SessionRequest()
+            executor = session
 
         # try the command a few times because failures happen on the GRID
         print datetime.now()
-        for ii in range(3):
-            print 'Try %d of \"%s\" with %d timeout' % (ii, SelfCommand, self.timeout)
-            lines, errors = ND280Computing.GetListPopenCommand(command)
-            if 'already exists' in lines:
-                break
-            elif errors:
-                print 'ERROR!'
-                print '\n'.join(errors)
-                time.sleep(self.timeout)
-                continue
-            else:
-                break
+        result = self.retry.Run(command, self.timeout, executor)
+        lines, errors = result.lines, result.errors
+        lines, errors = self.ParseOutput(lines, errors)
+        if PrintLines:
+            print lines
+        if PrintErrors:
+            print errors
+        return lines, errors
+
+    def SessionRequest(self):
+        """the (op, args) request a DIRACSession can answer in place of
+        this command, None if the command has to be run"""
+        return None
+
+    def ParseOutput(self, lines, errors):
+        """strip the raw output and pick out any errors DIRAC
+        reports on stdout"""
         # Removal of newlines, carriage returns
         lines = [line.strip() for line in lines]
         errors = [error.strip() for error in errors]
@@ -269,10 +409,6 @@ class DIRACBase(object):
             msg = output[1].strip()
             if ('Error' in subject or 'error' in subject) and len(msg) > 0:
                 errors.append(msg)
-        if PrintLines:
-            print lines
-        if PrintErrors:
-            print errors
         return lines, errors
 
     def __str__(self):
@@ -309,9 +445,16 @@ class DMSFindLFN(DIRACBase):
             path = LFN
             LFN.split('/')[len(LFN.split('/'))-1]
             path = path.replace(LFN, '').rstrip('/')
+        self.path = path
+        self.name = LFN
         self.inputs.append('Name={}'.format(LFN))
         self.args['--Path='] = path
 
+    def SessionRequest(self):
+        if type(self.path) is str and type(self.name) is str:
+            return 'find', {'path': self.path, 'name': self.name}
+        return None
+
 
 class DMSRemoveLFN(DIRACBase):
     """
@@ -328,6 +471,9 @@ class DMSRemoveLFN(DIRACBase):
             for FileName in LFN:
                 self.inputs.append(FileName)
 
+    def SessionRequest(self):
+        return 'remove', {'lfns': list(self.inputs)}
+
 
 class DMSAddFile(DIRACBase):
     """
@@ -343,6 +489,26 @@ class DMSAddFile(DIRACBase):
         self.inputs.append(FileName)
         self.inputs.append(SE)
 
+    def SessionRequest(self):
+        LFN, FileName, SE = self.inputs[:3]
+        return 'add', {'lfn': LFN, 'filename': FileName, 'se': SE}
+
+
+class DMSReplicateLFN(DIRACBase):
+    """
+    Replicate a LFN to another SE and register the new replica
+    """
+
+    def __init__(self, LFN, SE):
+        super(DMSReplicateLFN, self).__init__()
+        self.command = 'dirac-dms-replicate-lfn'
+        self.inputs.append(self.RemoveLFNString(LFN))
+        self.inputs.append(SE)
+
+    def SessionRequest(self):
+        LFN, SE = self.inputs[:2]
+        return 'replicate', {'lfn': LFN, 'se': SE}
+
 
 class DMSListReplicas(DIRACBase):
     """
@@ -353,7 +519,31 @@ class DMSListReplicas(DIRACBase):
         super(DMSListReplicas, self).__init__()
         self.command = 'dirac-dms-lfn-replicas'
         LFN = self.RemoveLFNString(LFN)
-        self.inputs.append(LFN)
+        if type(LFN) is list:
+            self.inputs.extend(LFN)
+        else:
+            self.inputs.append(LFN)
+
+    def SessionRequest(self):
+        return 'replicas', {'lfns': list(self.inputs)}
+
+
+class DMSLFNMetadata(DIRACBase):
+    """
+    Catalogue metadata (size, GUID, checksum...) of a LFN or list of LFNs
+    """
+
+    def __init__(self, LFN):
+        super(DMSLFNMetadata, self).__init__()
+        self.command = 'dirac-dms-lfn-metadata'
+        LFN = self.RemoveLFNString(LFN)
+        if type(LFN) is list:
+            self.inputs.extend(LFN)
+        else:
+            self.inputs.append(LFN)
+
+    def SessionRequest(self):
+        return 'metadata', {'lfns': list(self.inputs)}
 
 
 class DMSFileSize(DIRACBase):
@@ -378,6 +568,10 @@ Please use the following %s' % (size, str(self.AcceptableUnits)))
                     FileName.replace('lfn:', '').replace('LFN:', '')
                 self.inputs.append(FileName)
 
+    def SessionRequest(self):
+        return 'size', {'lfns': list(self.inputs),
+                        'unit': self.args['--Unit=']}
+
 
 class ProxyInfo(DIRACBase):
     """
@@ -399,6 +593,277 @@ class SEStatus(DIRACBase):
         self.command = 'dirac-dms-show-se-status'
 
 
+class DIRACSession(object):
+    """
+    A persistent DIRACWorker.py process that loads the DIRAC client
+    once and answers data management requests over a pipe, instead of
+    paying DIRAC's start up for every dirac-dms-* command. With a
+    fixture the worker answers from a JSON catalogue instead of DIRAC.
+
+    Run() has the same signature as CommandExecutor.Run so a session
+    can stand in for the executor in ND280Computing.RetryPolicy.Run
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, fixture='', python=''):
+        worker = join(os.path.dirname(os.path.abspath(__file__)),
+                      'DIRACWorker.py')
+        if not python:
+            python = getenv('ND280DIRACPYTHON', 'python')
+        self.command = [python, worker]
+        if fixture:
+            self.command += ['--fixture', fixture]
+        self.popen = None
+        self.buffer = str()
+        self.lock = threading.Lock()
+        self.nRequests = 0
+        self.nStarts = 0
+
+    def Start(self):
+        """start the worker if it is not already running"""
+        if self.IsAlive():
+            return
+        self.popen = Popen(self.command, stdin=PIPE, stdout=PIPE,
+                           close_fds=True)
+        self.buffer = str()
+        self.nStarts += 1
+
+    def Stop(self):
+        """close the worker's stdin and wait for it to exit"""
+        if self.popen:
+            try:
+                self.popen.stdin.close()
+                self.popen.wait()
+            except Exception as exception:
+                print str(exception)
+        self.popen = None
+
+    def Kill(self):
+        """kill a worker that has stopped answering"""
+        if self.popen:
+            try:
+                self.popen.kill()
+                self.popen.wait()
+            except OSError:
+                pass
+        self.popen = None
+
+    def IsAlive(self):
+        """is the worker process running"""
+        return self.popen is not None and self.popen.poll() is None
+
+    def Request(self, op, args, timeout=ND280Computing.StatusWait.kTimeout):
+        """send one request, returns the response lines and errors.
+        A worker that does not answer within timeout is killed and
+        restarted on the next request"""
+        with self.lock:
+            self.Start()
+            self.nRequests += 1
+            request = {'id': self.nRequests, 'op': op, 'args': args}
+            try:
+                self.popen.stdin.write(json.dumps(request) + '\n')
+                self.popen.stdin.flush()
+                response = json.loads(self._ReadLine(timeout))
+            except (IOError, ValueError, self.Error) as exception:
+                self.Kill()
+                return [], ['Error: DIRAC session failed, %s' % exception]
+            if response.get('id') != request['id']:
+                self.Kill()
+                return [], ['Error: DIRAC session out of step']
+            # keep to plain str, the parsers check for type str
+            return ([line.encode('utf-8') for line in response['lines']],
+                    [error.encode('utf-8') for error in response['errors']])
+
+    def Run(self, request, timeout=None, merge_stderr=False):
+        """answer an (op, args) request as an ND280Computing.CommandResult"""
+        op, args = request
+        result = ND280Computing.CommandResult('%s %s' % (op, args))
+        start = time.time()
+        lines, errors = self.Request(op, args,
+                                     timeout or
+                                     ND280Computing.StatusWait.kTimeout)
+        result.lines = [line + '\n' for line in lines]
+        result.errors = [error + '\n' for error in errors]
+        result.returncode = int(bool(errors))
+        result.duration = time.time() - start
+        return result
+
+    def _ReadLine(self, timeout):
+        """read one response line from the worker"""
+        deadline = time.time() + timeout
+        while '\n' not in self.buffer:
+            left = deadline - time.time()
+            if left <= 0:
+                raise self.Error('no answer in %d seconds' % timeout)
+            ready, dummy, dummy = select.select([self.popen.stdout], [], [],
+                                                left)
+            if not ready:
+                continue
+            chunk = os.read(self.popen.stdout.fileno(), 65536)
+            if not chunk:
+                raise self.Error('worker exited')
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split('\n', 1)
+        return line
+
+
+# The open session, if any
+SESSION = None
+
+
+def StartSession(fixture=''):
+    """start the shared DIRACSession used by DIRACBase.Run"""
+    global SESSION
+    if not SESSION:
+        SESSION = DIRACSession(fixture)
+        atexit.register(StopSession)
+    SESSION.Start()
+    return SESSION
+
+
+def StopSession():
+    """stop the shared DIRACSession, commands go back to the CLI"""
+    global SESSION
+    if SESSION:
+        SESSION.Stop()
+    SESSION = None
+
+
+def GetSession():
+    """the shared DIRACSession, started on first use when ND280DIRACSESSION
+    is set (to 1 for DIRAC, or to the path of a fixture catalogue)"""
+    if not SESSION and getenv('ND280DIRACSESSION'):
+        fixture = getenv('ND280DIRACSESSION')
+        if fixture == '1':
+            fixture = ''
+        StartSession(fixture)
+    return SESSION
+
+
+def RunMany(commands, timeout=ND280Computing.StatusWait.kTimeout):
+    """Run a list of DIRACBase commands concurrently through the shared
+    executor, or one after another through an open DIRACSession.
+    Returns a list of (lines, errors) in the order of commands.
+    Each command is retried by the shared RetryPolicy"""
+    policy = ND280Computing.GetRetryPolicy()
+    session = GetSession()
+    if session and all(command.SessionRequest() for command in commands):
+        results = [policy.Run(command.SessionRequest(), timeout, session)
+                   for command in commands]
+    else:
+        executor = ND280Computing.GetCommandExecutor()
+        results = ND280Computing.ParallelMap(
+            lambda command: policy.Run(str(command), timeout, executor),
+            commands, executor.max_workers)
+    outputs = list()
+    for command, result in zip(commands, results):
+        if isinstance(result, Exception):
+            outputs.append(([], [str(result)]))
+        else:
+            outputs.append(command.ParseOutput(result.lines, result.errors))
+    return outputs
+
+
+def ParseDMSResult(lines):
+    """Parse the Successful/Failed listing printed by commands such as
+    dirac-dms-lfn-replicas and dirac-dms-lfn-metadata
+
+    Successful :
+        /t2k.org/nd280/.../file.root :
+            RAL-disk : srm://...
+    Failed :
+        /t2k.org/nd280/.../missing.root : No such file or directory
+
+    returns a dictionary {lfn: {key: value}} of the successful LFNs
+    and a dictionary {lfn: reason} of the failed ones
+    """
+    successful = dict()
+    failed = dict()
+    section = None
+    lfn = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('Successful'):
+            section = successful
+            continue
+        if line.startswith('Failed'):
+            section = failed
+            continue
+        if section is None or ':' not in line:
+            continue
+        if line.startswith('/') and line.endswith(':'):
+            lfn = line.rstrip(':').strip()
+            if section is successful:
+                successful[lfn] = dict()
+            continue
+        key, value = [word.strip() for word in line.split(' : ', 1)] \
+            if ' : ' in line else [word.strip()
+                                   for word in line.split(':', 1)]
+        if section is failed:
+            failed[key] = value
+        elif lfn in successful:
+            successful[lfn][key] = value
+    return successful, failed
+
+
+def RunBulk(Command, lfns, chunk=500):
+    """Run a DIRACBase command class that takes a list of LFNs over
+    lfns in chunks, the chunks run concurrently and are retried before
+    their LFNs are given up as failed. Returns the combined
+    ParseDMSResult dictionaries"""
+    successful = dict()
+    failed = dict()
+    lfns = [lfn.replace('LFN:', '').replace('lfn:', '') for lfn in lfns]
+    commands = [Command(lfns[first:first+chunk])
+                for first in range(0, len(lfns), chunk)]
+    for command, (lines, errors) in zip(commands, RunMany(commands)):
+        if errors:
+            for lfn in command.inputs:
+                failed[lfn] = ' '.join(errors)
+            continue
+        chunk_successful, chunk_failed = ParseDMSResult(lines)
+        successful.update(chunk_successful)
+        failed.update(chunk_failed)
+    return successful, failed
+
+
+def GetBulkReplicas(lfns, chunk=500):
+    """{lfn: {SE: PFN}} for many LFNs, plus {lfn: reason} failures"""
+    return RunBulk(DMSListReplicas, lfns, chunk)
+
+
+def GetBulkMetadata(lfns, chunk=500):
+    """{lfn: {'Size':.., 'GUID':.., 'Checksum':..}} for many LFNs,
+    plus {lfn: reason} failures"""
+    return RunBulk(DMSLFNMetadata, lfns, chunk)
+
+
+def RegisterBulk(files, chunk=500):
+    """Register files that are already on storage, each a dictionary
+    with 'lfn', 'pfn', 'se', 'size', 'checksum' and 'guid', as new LFNs
+    or as replicas of existing ones. There is no dirac-dms command for
+    this, so it goes through the DIRACSession, started if need be.
+    Returns {lfn: {SE: PFN}} of the registered files and {lfn: reason}
+    of the others"""
+    session = GetSession() or StartSession()
+    successful = dict()
+    failed = dict()
+    for first in range(0, len(files), chunk):
+        entries = files[first:first+chunk]
+        lines, errors = session.Request('register', {'files': entries})
+        if errors:
+            for entry in entries:
+                failed[entry['lfn']] = ' '.join(errors)
+            continue
+        chunk_successful, chunk_failed = ParseDMSResult(lines)
+        successful.update(chunk_successful)
+        failed.update(chunk_failed)
+    return successful, failed
+
+
 def GetJobIDFromSubmit(submitResult):
     """When the DIRAC.submitJob() method is called, use this
        method to extract the JodID STRING from the dictionary
@@ -410,3 +875,35 @@ def GetJobIDFromSubmit(submitResult):
             if identifier in submitResult.keys():
                 return str(submitResult[identifier]).strip()
     return '-1'
+
+
+def GetJobIDsFromSubmit(submitResult):
+    """The JobID STRINGs of a parametric DIRAC.submitJob(), in the
+       order of the parameters, example
+       {...stuff..., 'Value': [8765031, 8765032], 'JobID': [8765031, 8765032]}
+    """
+    jid_identifiers = ['JobID', 'Value']
+    if type(submitResult) is dict:
+        for identifier in jid_identifiers:
+            if identifier in submitResult.keys():
+                jobids = submitResult[identifier]
+                if type(jobids) is not list:
+                    jobids = [jobids]
+                return [str(jobid).strip() for jobid in jobids]
+    return list()
+
+
+def WriteParametricJIDs(submitResult, jidfiles):
+    """Append each job ID of a parametric submission to the jid file of
+    its input, jidfiles in the order of the parameters. Returns the
+    number of jid files written"""
+    jobids = GetJobIDsFromSubmit(submitResult)
+    if len(jobids) != len(jidfiles):
+        print 'Got %d job IDs for %d inputs, not writing jid files' % \
+            (len(jobids), len(jidfiles))
+        return 0
+    for jobid, jidfile in zip(jobids, jidfiles):
+        jid_file = open(jidfile, 'a')
+        jid_file.write('%s\n' % jobid)
+        jid_file.close()
+    return len(jobids)
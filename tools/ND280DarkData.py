@@ -0,0 +1,227 @@
+#!/usr/bin/env python2
+"""
+Find dark data and orphans by comparing an SRM directory tree with the
+catalogue.
+
+Both sides are streamed as (relative path, size) records: the SRM tree
+with paged lcg-ls -l -c 999 -o offset calls, one directory at a time,
+and the catalogue tree from the catalogue mirror when it is fresh enough,
+otherwise level by level through DIRACLister. Each side goes through an
+ND280DirDiff.ExternalSort, so at most chunk records are held in memory
+however large the directories are, and the two sorted streams are merged
+into
+
+    dark       on the SE but not in the catalogue
+    missing    in the catalogue (with a replica on the SE) but not on it
+    mismatch   on both, with different sizes
+
+Detect() yields a DarkRow for each of these, DarkSummary counts them and
+their sizes and ListWriter writes each kind to its own file; Compare()
+does both listings and the merge for an SRM directory.
+"""
+
+from collections import namedtuple
+import os
+
+import ND280Catalogue
+import ND280Computing
+from ND280Computing import StatusWait
+from ND280DirDiff import ExternalSort
+import StorageElement as SE
+
+# Row status
+kDark = 'dark'
+kMissing = 'missing'
+kMismatch = 'mismatch'
+
+# One file found on only one side, or with different sizes; sizes are
+# None for the side that does not have it
+DarkRow = namedtuple('DarkRow', ['status', 'path', 'se_size',
+                                 'catalogue_size'])
+
+
+class DarkDataError(Exception):
+    """an internal class for errors"""
+    pass
+
+
+def CatalogueDirectory(srmdir):
+    """the LFN directory whose files srmdir holds, from the SE roots"""
+    srmdir = srmdir.rstrip('/')
+    srmroot = SE.SE_ROOTS.get(SE.GetSEFromSRM(srmdir), '')
+    if not srmroot:
+        raise DarkDataError('No SE root for ' + srmdir)
+    # dark data outside the nd280 folder is relative to the SE root itself
+    if 'nd280/' not in srmdir and srmroot.endswith('nd280/'):
+        srmroot = srmroot[:-len('nd280/')]
+    return '/t2k.org/nd280/' + srmdir.replace(srmroot.rstrip('/'),
+                                              '').strip('/')
+
+
+def ListSRM(srmdir, page=999, executor=None):
+    """
+    Iterate over the (relative path, size) of every file below srmdir,
+    listing page entries per lcg-ls so that long directories are not
+    truncated.
+    """
+    executor = executor or ND280Computing.GetRetryPolicy()
+    srmdir = srmdir.rstrip('/')
+    directories = ['']
+    while directories:
+        relative = directories.pop()
+        surl = srmdir + ('/' + relative if relative else '')
+        offset = 0
+        while 1:
+            result = executor.Run('lcg-ls -l -c %d -o %d %s' %
+                                  (page, offset, surl), StatusWait.kTimeout)
+            if result.returncode != 0:
+                raise DarkDataError('Could not list %s: %s' %
+                                    (surl, ''.join(result.errors).strip()))
+            lines = [line.split() for line in result.lines if line.strip()]
+            lines = [fields for fields in lines if len(fields) >= 7]
+
+            # some SRMs list the directory itself past the end
+            if not lines or os.path.basename(lines[0][-1].rstrip('/')) == \
+                    os.path.basename(surl):
+                break
+            for fields in lines:
+                name = os.path.basename(fields[-1].rstrip('/'))
+                path = relative + '/' + name if relative else name
+                if fields[0].startswith('d'):
+                    directories.append(path)
+                else:
+                    yield path, int(fields[4])
+            if len(lines) < page:
+                break
+            offset += page
+
+
+def ListCatalogue(lfndir, se='', max_workers=8, chunk=500, lister=None):
+    """
+    Iterate over the (relative path, size) of every file below lfndir
+    (with a replica on the DIRAC SE se, if given), from the catalogue
+    mirror when it is fresh enough, otherwise from lister (a DIRACLister
+    by default), a level of directories at a time.
+    """
+    root = ND280Catalogue.CleanPath(lfndir)
+    mirror = ND280Catalogue.GetMirror()
+    if mirror and not lister:
+        try:
+            age = mirror.Age(root)
+            if age is not None and age < ND280Catalogue.GetMaxAge():
+                for entry in mirror.Files(root, se=se):
+                    yield entry.lfn[len(root):].lstrip('/'), entry.size
+                return
+        finally:
+            mirror.Close()
+
+    if not lister:
+        fixture = os.getenv('ND280DIRACSESSION', '')
+        lister = ND280Catalogue.DIRACLister('' if fixture == '1'
+                                            else fixture)
+    try:
+        frontier = [root]
+        while frontier:
+            listings = ND280Computing.ParallelMap(lister.ListDirectory,
+                                                  frontier, max_workers)
+            next_frontier = list()
+            for path, listing in zip(frontier, listings):
+                if isinstance(listing, Exception):
+                    raise DarkDataError('Could not list %s: %s' %
+                                        (path, listing))
+                next_frontier.extend(sorted(listing.dirs))
+                files = listing.files
+                if se and files:
+                    lfns = [entry.lfn for entry in files]
+                    replicas = dict()
+                    for first in range(0, len(lfns), chunk):
+                        replicas.update(lister.GetReplicas(
+                            lfns[first:first + chunk]))
+                    files = [entry for entry in files
+                             if se in replicas.get(entry.lfn, dict())]
+                for entry in files:
+                    yield entry.lfn[len(root):].lstrip('/'), entry.size
+            frontier = next_frontier
+    finally:
+        lister.Close()
+
+
+def Detect(srm_files, catalogue_files, chunk=100000):
+    """
+    Merge two iterables of (relative path, size), the SE and the
+    catalogue side, and yield a DarkRow for every file that is on one
+    side only or has different sizes.
+    """
+    def Sorted(files):
+        return iter(ExternalSort(((path, str(size)) for path, size in files),
+                                 chunk))
+
+    srm = Sorted(srm_files)
+    catalogue = Sorted(catalogue_files)
+    left = next(srm, None)
+    right = next(catalogue, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            yield DarkRow(kDark, left[0], int(left[1]), None)
+            left = next(srm, None)
+        elif left is None or right[0] < left[0]:
+            yield DarkRow(kMissing, right[0], None, int(right[1]))
+            right = next(catalogue, None)
+        else:
+            if int(left[1]) != int(right[1]):
+                yield DarkRow(kMismatch, left[0], int(left[1]),
+                              int(right[1]))
+            left = next(srm, None)
+            right = next(catalogue, None)
+
+
+class DarkSummary(object):
+    """number and total size of the dark, missing and mismatched files"""
+
+    def __init__(self):
+        self.nFiles = {kDark: 0, kMissing: 0, kMismatch: 0}
+        self.nBytes = {kDark: 0, kMissing: 0, kMismatch: 0}
+
+    def Add(self, row):
+        """count one DarkRow"""
+        self.nFiles[row.status] += 1
+        if row.se_size is not None:
+            self.nBytes[row.status] += row.se_size
+        else:
+            self.nBytes[row.status] += row.catalogue_size
+
+    def Print(self):
+        """print the summary table"""
+        print '%-10s %10s %12s' % ('status', 'files', 'size [GB]')
+        for status in (kDark, kMissing, kMismatch):
+            print '%-10s %10d %12.2f' % (status, self.nFiles[status],
+                                         self.nBytes[status] / 1024.**3)
+
+
+class ListWriter(object):
+    """write the rows of each status to prefix.<status>, one file per
+    line with its SE and catalogue sizes"""
+
+    def __init__(self, prefix):
+        self.streams = dict((status, open('%s.%s' % (prefix, status), 'w'))
+                            for status in (kDark, kMissing, kMismatch))
+
+    def Write(self, row):
+        self.streams[row.status].write('%s %s %s\n' % (
+            row.path, '-' if row.se_size is None else row.se_size,
+            '-' if row.catalogue_size is None else row.catalogue_size))
+
+    def Close(self):
+        for stream in self.streams.itervalues():
+            stream.close()
+
+
+def Compare(srmdir, lfndir='', se='', chunk=100000, max_workers=8):
+    """
+    The DarkRows of srmdir against lfndir (by default the LFN directory
+    srmdir holds), counting only catalogue files with a replica on the
+    DIRAC SE se if it is given.
+    """
+    lfndir = lfndir or CatalogueDirectory(srmdir)
+    return Detect(ListSRM(srmdir), ListCatalogue(lfndir, se, max_workers),
+                  chunk)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python2
+"""
+Compare any number of file listings in one pass.
+
+Each listing (an LFC directory, an SRM directory, a local directory, a
+catalogue mirror or just a list of names) is parsed with ND280NameParser
+and sorted by key with an external merge sort, so memory stays bounded by
+the chunk size however long the listings are. The sorted streams are then
+merged and, for every key, Diff yields how many files each listing holds
+
+    key            raw  unpk  cali  reco  anal  status
+    00004001-0019    1     1     1     0     1  missing
+    00004001-0020    1     1     2     1     1  duplicate
+
+Keys are the run-subrun tag ('run'), the file hash ('hash') or the
+run-subrun tag and processing stage ('stage'). CSVWriter and JSONWriter
+write the rows as they come out of the merge.
+"""
+
+from collections import namedtuple
+import heapq
+from itertools import groupby
+import json
+import os
+import tempfile
+
+import ND280Catalogue
+import ND280Computing
+import ND280DIRACAPI as ND280DIRAC
+import ND280NameParser
+
+# Row status
+kComplete = 'complete'
+kMissing = 'missing'
+kDuplicate = 'duplicate'
+
+# One key of the diff, counts and names have one entry per listing
+DiffRow = namedtuple('DiffRow', ['key', 'counts', 'names', 'status'])
+
+
+def RunKey(record):
+    """the run-subrun tag"""
+    return ND280NameParser.RunSubrunTag(record)
+
+
+def HashKey(record):
+    """the file hash of processed and MC files"""
+    return record.hash
+
+
+def StageKey(record):
+    """the run-subrun tag and processing stage"""
+    tag = ND280NameParser.RunSubrunTag(record)
+    if not tag or not record.stage:
+        return ''
+    return tag + '_' + record.stage
+
+
+KEYS = {'run': RunKey, 'hash': HashKey, 'stage': StageKey}
+
+
+class DiffError(Exception):
+    """an internal class for errors"""
+    pass
+
+
+def ListDirectory(path):
+    """
+    Iterate over the file names in an LFC, SRM or local directory. LFC
+    directories come from the catalogue mirror when it is fresh enough,
+    otherwise from DMSFindLFN.
+    """
+    if path.startswith('srm://'):
+        policy = ND280Computing.GetRetryPolicy()
+        result = policy.Run('lcg-ls ' + path,
+                            ND280Computing.StatusWait.kTimeout)
+        if result.errors:
+            raise DiffError('Could not list %s: %s' %
+                            (path, ''.join(result.errors)))
+        return (line.strip() for line in result.lines if line.strip())
+
+    if path.startswith('lfn:') or path.startswith('LFN:'):
+        mirror = ND280Catalogue.GetMirror()
+        if mirror:
+            try:
+                age = mirror.Age(path)
+                if age is not None and age < ND280Catalogue.GetMaxAge():
+                    return iter(mirror.Find(path, recursive=False))
+            finally:
+                mirror.Close()
+        lines, errors = ND280DIRAC.DMSFindLFN(path).Run(PrintLines=False)
+        if errors:
+            raise DiffError('Could not list %s: %s' % (path, errors))
+        return (line.split()[-1] for line in lines if line.strip())
+
+    if not os.path.isdir(path):
+        raise DiffError('No such directory %s' % path)
+    return (os.path.join(path, name) for name in sorted(os.listdir(path))
+            if not os.path.isdir(os.path.join(path, name)))
+
+
+class ExternalSort(object):
+    """
+    Tuples of strings sorted with an external merge sort: records are
+    sorted chunk by chunk, each sorted chunk is spilled to a temporary
+    file and the chunks are merged on iteration, so at most chunk records
+    are held in memory. Fields must not contain tabs or newlines.
+    """
+
+    def __init__(self, records, chunk=100000):
+        self.chunk = chunk
+        self.runs = list()
+        self.Spill(records)
+
+    def Spill(self, records):
+        """sort and spill records chunk by chunk"""
+        pairs = list()
+        for record in records:
+            pairs.append(tuple(record))
+            if len(pairs) >= self.chunk:
+                self.runs.append(self.WriteRun(pairs))
+                pairs = list()
+        pairs.sort()
+        self.runs.append(pairs)
+
+    def WriteRun(self, pairs):
+        """a sorted run of pairs in a temporary file"""
+        pairs.sort()
+        run = tempfile.TemporaryFile()
+        for pair in pairs:
+            run.write('\t'.join(pair) + '\n')
+        run.seek(0)
+        return run
+
+    def ReadRun(self, run):
+        """the pairs of a run, in memory or in a temporary file"""
+        if isinstance(run, list):
+            return iter(run)
+        return (tuple(line.rstrip('\n').split('\t')) for line in run)
+
+    def __iter__(self):
+        return heapq.merge(*[self.ReadRun(run) for run in self.runs])
+
+
+class SortedListing(ExternalSort):
+    """
+    The (key, name) pairs of one listing sorted by key with an
+    ExternalSort. Names that give an empty key are counted in nUnparsed
+    and left out.
+    """
+
+    def __init__(self, names, key='run', chunk=100000):
+        self.key = KEYS[key]
+        self.nNames = 0
+        self.nUnparsed = 0
+        ExternalSort.__init__(self, self.Pairs(names), chunk)
+
+    def Pairs(self, names):
+        """the (key, name) pairs of names"""
+        for name in names:
+            name = name.strip()
+            if not name:
+                continue
+            self.nNames += 1
+            key = self.key(ND280NameParser.ParseFileName(name))
+            if not key:
+                self.nUnparsed += 1
+                continue
+            yield key, name
+
+
+def Diff(listings, key='run', chunk=100000):
+    """
+    Merge the sorted listings and yield a DiffRow for every key found
+    in any of them. listings are iterables of names or SortedListings.
+    """
+    sorted_listings = [names if isinstance(names, SortedListing) else
+                       SortedListing(names, key, chunk)
+                       for names in listings]
+
+    def Tagged(index, listing):
+        for pair_key, name in listing:
+            yield pair_key, index, name
+
+    merged = heapq.merge(*[Tagged(index, listing) for index, listing
+                           in enumerate(sorted_listings)])
+    for row_key, group in groupby(merged, lambda entry: entry[0]):
+        names = [list() for listing in sorted_listings]
+        for dummy, index, name in group:
+            names[index].append(name)
+        counts = tuple(len(row_names) for row_names in names)
+        if 0 in counts:
+            status = kMissing
+        elif max(counts) > 1:
+            status = kDuplicate
+        else:
+            status = kComplete
+        yield DiffRow(row_key, counts, names, status)
+
+
+class DiffSummary(object):
+    """counts of complete, missing and duplicate keys, and per listing
+    how many keys it is missing or holds more than once"""
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.nKeys = 0
+        self.nStatus = {kComplete: 0, kMissing: 0, kDuplicate: 0}
+        self.nMissing = [0] * len(self.labels)
+        self.nDuplicate = [0] * len(self.labels)
+        self.nUnparsed = [0] * len(self.labels)
+
+    def Add(self, row):
+        """count one DiffRow"""
+        self.nKeys += 1
+        self.nStatus[row.status] += 1
+        for index, count in enumerate(row.counts):
+            if count == 0:
+                self.nMissing[index] += 1
+            elif count > 1:
+                self.nDuplicate[index] += 1
+
+    def Print(self):
+        """print the summary table"""
+        print '%d keys: %d complete, %d missing, %d duplicate' % \
+            (self.nKeys, self.nStatus[kComplete], self.nStatus[kMissing],
+             self.nStatus[kDuplicate])
+        print '%-40s %10s %10s %10s' % ('listing', 'missing', 'duplicate',
+                                        'unparsed')
+        for row in zip(self.labels, self.nMissing, self.nDuplicate,
+                       self.nUnparsed):
+            print '%-40s %10d %10d %10d' % row
+
+
+class CSVWriter(object):
+    """write DiffRows as CSV, one column of counts per listing"""
+
+    def __init__(self, stream, labels, names=False):
+        self.stream = stream
+        self.names = names
+        header = ['key'] + list(labels) + ['status']
+        if names:
+            header += ['%s_names' % label for label in labels]
+        self.stream.write(','.join(header) + '\n')
+
+    def Write(self, row):
+        fields = [row.key] + [str(count) for count in row.counts] + \
+            [row.status]
+        if self.names:
+            fields += [' '.join(row_names) for row_names in row.names]
+        self.stream.write(','.join(fields) + '\n')
+
+
+class JSONWriter(object):
+    """write DiffRows as JSON lines, one object per key"""
+
+    def __init__(self, stream, labels, names=False):
+        self.stream = stream
+        self.labels = list(labels)
+        self.names = names
+
+    def Write(self, row):
+        entry = {'key': row.key, 'status': row.status,
+                 'counts': dict(zip(self.labels, row.counts))}
+        if self.names:
+            entry['names'] = dict(zip(self.labels, row.names))
+        self.stream.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+WRITERS = {'csv': CSVWriter, 'json': JSONWriter}
+
+
+def DiffListings(listings, labels, key='run', writer=None, problems=True,
+                 chunk=100000):
+    """
+    Diff listings and write the rows with writer (only the missing and
+    duplicate ones if problems is set). Returns the DiffSummary, which
+    also counts the names of each listing that could not be keyed.
+    """
+    summary = DiffSummary(labels)
+    listings = [SortedListing(names, key, chunk) for names in listings]
+    summary.nUnparsed = [listing.nUnparsed for listing in listings]
+    for row in Diff(listings, key, chunk):
+        summary.Add(row)
+        if writer and not (problems and row.status == kComplete):
+            writer.Write(row)
+    return summary
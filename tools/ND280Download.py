@@ -0,0 +1,323 @@
+#!/usr/bin/env python2
+"""
+Parallel, resumable bulk downloads of grid files.
+
+BulkDownloader copies a list of LFNs to local paths with a pool of worker
+threads. Each file is copied from its best replica (ND280Replicas), with at
+most a given number of concurrent copies from any one SE, and falls back to
+the next replica when a copy fails. Files are written to <path>.part and
+only renamed once their size (and adler32 checksum, when the catalogue has
+one) match, so an interrupted download never leaves a truncated file
+behind. http(s) and local replicas resume a .part file where it stopped,
+other protocols start again.
+
+Every outcome is appended to a manifest, one JSON object per line, so that
+a re-run skips the files that are already complete without copying or
+re-checksumming them, and the run ends with a throughput summary.
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280DIRACAPI as ND280DIRAC
+import ND280Replicas
+
+# Download states in the manifest
+kDone = 'done'
+kFailed = 'failed'
+
+
+def Adler32(path, blocksize=1024*1024):
+    """the adler32 checksum of a file as 8 hex digits, as in the catalogue"""
+    checksum = 1
+    with open(path, 'rb') as local_file:
+        while True:
+            block = local_file.read(blocksize)
+            if not block:
+                break
+            checksum = zlib.adler32(block, checksum)
+    return '%08x' % (checksum & 0xffffffff)
+
+
+def SameChecksum(first, second):
+    """compare adler32 checksums, which may have lost leading zeros"""
+    try:
+        return int(first, 16) == int(second, 16)
+    except ValueError:
+        return first.lower() == second.lower()
+
+
+class DownloadTask(object):
+    """One file to download"""
+
+    def __init__(self, lfn, path, size=0, checksum='', reps=None):
+        self.lfn = lfn.replace('lfn:', '').replace('LFN:', '')
+        self.path = path
+        self.size = int(size)
+        self.checksum = (checksum or '').lower()
+        self.reps = list(reps or [])
+        self.status = ''
+        self.surl = ''
+        self.duration = 0.
+        self.errors = list()
+
+    def Part(self):
+        """the path the file is written to until it is complete"""
+        return self.path + '.part'
+
+
+class BulkDownloader(object):
+    """
+    Downloads DownloadTasks with max_workers threads and at most per_se
+    concurrent copies from any SE. The manifest defaults to
+    .nd280download.manifest in the current directory. With verify,
+    files that are already present are checksummed as well as sized.
+    preferred is the SE to copy from when replicas are otherwise equal.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, max_workers=8, per_se=3, manifest='', verify=False,
+                 max_tries=3, preferred='', selector=None, executor=None):
+        self.max_workers = max_workers
+        self.preferred = preferred
+        self.per_se = per_se
+        self.manifest = manifest or '.nd280download.manifest'
+        self.verify = verify
+        self.max_tries = max_tries
+        self.selector = selector or ND280Replicas.GetReplicaSelector()
+        self.executor = executor or ND280Computing.GetCommandExecutor()
+        self.lock = threading.Lock()
+        self.slots = dict()
+        self.done = self.LoadManifest()
+
+        # for the summary
+        self.nDone = 0
+        self.nSkipped = 0
+        self.nFailed = 0
+        self.nBytes = 0
+        self.seBytes = dict()
+        self.seTime = dict()
+
+    # The manifest
+    def LoadManifest(self):
+        """{lfn: entry} of the files the manifest records as done"""
+        done = dict()
+        if not os.path.exists(self.manifest):
+            return done
+        with open(self.manifest) as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('status') == kDone:
+                    done[entry['lfn']] = entry
+                else:
+                    done.pop(entry.get('lfn'), None)
+        return done
+
+    def Record(self, task):
+        """append the outcome of task to the manifest"""
+        entry = {'lfn': task.lfn, 'path': task.path, 'size': task.size,
+                 'checksum': task.checksum, 'status': task.status,
+                 'surl': task.surl, 'duration': round(task.duration, 3),
+                 'time': time.time()}
+        with self.lock:
+            with open(self.manifest, 'a') as manifest:
+                manifest.write(json.dumps(entry, sort_keys=True) + '\n')
+            if task.status == kDone:
+                self.done[task.lfn] = entry
+
+    # Checks
+    def IsComplete(self, task):
+        """is task's file already there. Files in the manifest only need
+        the right size, others are checksummed too if the checksum is
+        known (or verify is set)"""
+        if not os.path.isfile(task.path):
+            return False
+        size = os.path.getsize(task.path)
+        if task.size and size != task.size:
+            return False
+        entry = self.done.get(task.lfn)
+        if entry and entry.get('path') == task.path and not self.verify:
+            return entry.get('size', size) == size
+        if task.checksum:
+            return SameChecksum(Adler32(task.path), task.checksum)
+        # nothing to check against but the size, or only that it exists
+        return bool(task.size) or not self.verify
+
+    def Check(self, task):
+        """does the downloaded .part file match the catalogue"""
+        size = os.path.getsize(task.Part())
+        if task.size and size != task.size:
+            return 'size %d, expected %d' % (size, task.size)
+        if task.checksum and not SameChecksum(Adler32(task.Part()),
+                                              task.checksum):
+            return 'checksum mismatch'
+        return ''
+
+    # Per SE concurrency
+    def Slot(self, se):
+        """the semaphore capping the copies from se"""
+        with self.lock:
+            if se not in self.slots:
+                self.slots[se] = threading.BoundedSemaphore(self.per_se)
+            return self.slots[se]
+
+    def Acquire(self, ranked):
+        """a replica from ranked whose SE has a free slot, the best one
+        that does, or wait for the best one if none has"""
+        for surl in ranked:
+            if self.Slot(ND280Replicas.SEName(surl)).acquire(False):
+                return surl
+        self.Slot(ND280Replicas.SEName(ranked[0])).acquire()
+        return ranked[0]
+
+    # Copying
+    def CopyCommand(self, surl, part):
+        """the shell command copying surl to part and the offset it
+        resumes from, http(s) and local copies carry on from the end of an
+        existing part file, other protocols start again"""
+        offset = 0
+        if os.path.exists(part):
+            offset = os.path.getsize(part)
+        if surl.startswith('http://') or surl.startswith('https://'):
+            return 'curl -f -s -S -L -C - -o %s %s' % (part, surl), offset
+        if surl.startswith('file://') or surl.startswith('/'):
+            source = surl.replace('file://', '')
+            return 'tail -c +%d %s >> %s' % (offset + 1, source, part), offset
+        if offset:
+            os.remove(part)
+        return 'lcg-cp -v %s file:%s' % (surl, os.path.abspath(part)), 0
+
+    def Download(self, task):
+        """download one task, returns it with its status set"""
+        if self.IsComplete(task):
+            task.status = kDone
+            with self.lock:
+                self.nSkipped += 1
+            if task.lfn not in self.done:
+                self.Record(task)
+            return task
+
+        directory = os.path.dirname(task.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by another worker
+                pass
+
+        ranked = self.selector.Rank(task.reps, task.size, self.preferred)
+        if not ranked:
+            task.errors.append('no replicas')
+        timeout = max(StatusWait.kTimeout, task.size / 1024**2)
+        for attempt in range(min(self.max_tries, len(ranked))):
+            surl = self.Acquire(ranked)
+            se = ND280Replicas.SEName(surl)
+            start = time.time()
+            try:
+                command, offset = self.CopyCommand(surl, task.Part())
+                result = self.executor.Run(command, timeout)
+            finally:
+                self.Slot(se).release()
+            duration = time.time() - start
+
+            problem = ''
+            copied = 0
+            if result.returncode != 0 or result.timedout:
+                problem = ''.join(result.errors).strip() or 'copy failed'
+            elif not os.path.exists(task.Part()):
+                problem = 'nothing was written'
+            else:
+                copied = os.path.getsize(task.Part()) - offset
+                problem = self.Check(task)
+                if problem and os.path.exists(task.Part()):
+                    # a bad copy or resume, start from scratch next time
+                    os.remove(task.Part())
+            self.selector.Record(surl, max(copied, 0), duration,
+                                 not problem, save=False)
+
+            if not problem:
+                os.rename(task.Part(), task.path)
+                task.status = kDone
+                task.surl = surl
+                task.duration = duration
+                with self.lock:
+                    self.nDone += 1
+                    self.nBytes += task.size
+                    self.seBytes[se] = self.seBytes.get(se, 0) + task.size
+                    self.seTime[se] = self.seTime.get(se, 0.) + duration
+                self.Record(task)
+                return task
+
+            print 'Copy of %s from %s failed: %s' % (task.lfn, surl, problem)
+            task.errors.append(problem)
+            ranked = [r for r in ranked if r != surl] or ranked
+
+        task.status = kFailed
+        with self.lock:
+            self.nFailed += 1
+        self.Record(task)
+        return task
+
+    def Run(self, tasks):
+        """download every task, returns the tasks that failed"""
+        start = time.time()
+        results = ND280Computing.ParallelMap(self.Download, tasks,
+                                             self.max_workers)
+        self.selector.Save()
+        failed = list()
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                task.status = kFailed
+                task.errors.append(str(result))
+            if task.status != kDone:
+                failed.append(task)
+        self.wallTime = time.time() - start
+        return failed
+
+    def Summary(self):
+        """throughput summary of the last Run"""
+        wall = max(getattr(self, 'wallTime', 0.), 1e-6)
+        lines = ['Downloaded %d files (%.1f MB) in %.0f s, %.2f MB/s, '
+                 '%d already complete, %d failed' %
+                 (self.nDone, self.nBytes / 1024.**2, wall,
+                  self.nBytes / 1024.**2 / wall, self.nSkipped,
+                  self.nFailed)]
+        for se in sorted(self.seBytes):
+            lines.append('%-40s %10.1f MB %8.2f MB/s per copy' %
+                         (se, self.seBytes[se] / 1024.**2,
+                          self.seBytes[se] / 1024.**2 /
+                          max(self.seTime[se], 1e-6)))
+        return '\n'.join(lines)
+
+
+def TasksFromCatalogue(lfns, Destination, chunk=500):
+    """DownloadTasks for lfns with their sizes, checksums and replicas
+    looked up in bulk. Destination(lfn) gives the local path of an LFN.
+    LFNs that are not in the catalogue are returned separately"""
+    lfns = [str(lfn).strip().replace('lfn:', '').replace('LFN:', '')
+            for lfn in lfns]
+    metadata, failed = ND280DIRAC.GetBulkMetadata(lfns, chunk)
+    replicas, rep_failed = ND280DIRAC.GetBulkReplicas(lfns, chunk)
+    tasks = list()
+    missing = list()
+    for lfn in lfns:
+        if lfn not in metadata:
+            missing.append(lfn)
+            continue
+        tasks.append(DownloadTask(lfn, Destination(lfn),
+                                  int(float(metadata[lfn].get('Size', 0)
+                                            or 0)),
+                                  metadata[lfn].get('Checksum', ''),
+                                  replicas.get(lfn, dict()).values()))
+    return tasks, missing
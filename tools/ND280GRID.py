@@ -7,14 +7,15 @@ Handy functions to make using the GRID a little more bearable.
 from datetime import datetime
 from datetime import date
 from hashlib import sha1
+import json
 import os
-from os import system, getenv, getpid, getcwd
+from os import system, getenv, getcwd
 from os.path import join
-import pexpect
 import re
 import subprocess
 from subprocess import check_output as chko
 import sys
+import tempfile
 import time
 import traceback
 
@@ -22,6 +23,14 @@ import ND280Computing as ND280Comp
 from ND280Computing import StatusWait, StatusFlags, VO
 from ND280Computing import NONRUNND280JOBS
 import ND280DIRACAPI as ND280DIRAC
+import ND280Catalogue
+import ND280DirDiff
+import ND280Download
+import ND280JobStore
+import ND280NameParser
+import ND280Replicas
+import ND280Staging
+import ND280Transfers
 import StorageElement as SE
 
 # FTS2 transfer statuses:
@@ -35,13 +44,6 @@ fts3_active_list = ['Active', 'Pending', 'Ready', 'Submitted']
 fts3_finished_list = ['Finished', 'FinishedDirty']
 fts3_failed_list = ['Canceled', 'Failed']
 
-# Number of files put in an FTS transfer limit to 200
-# since monitoring pages only display 200 files
-# http://lcgwww.gridpp.rl.ac.uk/cgi-bin/fts-mon/fts-mon.pl?q=jobs&p=day&v=t2k.org
-NTRANSFERS = 200
-TRANSFER_FILE_LIST = list()
-MAX_TRANSFERS_PER_CHANNEL = 600
-
 
 """
 Number of constants and methods here are unweildy
@@ -95,6 +97,16 @@ def GetListOfSEs():
     return SE.GetListOfSEs()
 
 
+def PrintSEDiskUsage():
+    """ Print Storage Element Disk Usage """
+    SE.PrintSEDiskUsage()
+
+
+def PrintSESpaceUsage():
+    """ Print Storage Element Space Usage """
+    SE.PrintSESpaceUsage()
+
+
 """ ############################################################# """
 
 
@@ -330,10 +342,19 @@ def GetTransferStatus(transfer='', SOURCE='', DEST=''):
         return Fail
 
 
+# Catalogue answers for LFNs that are not registered
+MISSING_LFN = re.compile('(?i)no such file|does not exist')
+
+# Commands that talk to the grid and are worth retrying
+GRID_COMMAND = re.compile(r'\s*(lcg-|lfc-|dirac-|glite-|fts-)')
+
+
 def runLCG(in_command, in_timeout=StatusWait.kTimeout, is_pexpect=True):
     """
     DEPRECATED: USE run or runDIRAC for dirac specific commands
-     The GRID is flaky, timeout commands or wrap them in pexpect
+     The GRID is flaky, timeout commands and retry them.
+     is_pexpect keeps the old pexpect behaviour of returning stderr
+     merged into the output lines rather than as errors
     """
 
     print "################################"
@@ -344,104 +365,18 @@ def runLCG(in_command, in_timeout=StatusWait.kTimeout, is_pexpect=True):
 
     lines = list()
     errors = list()
+    policy = ND280Comp.GetRetryPolicy()
 
-    # Use pexpect (default)
+    # Merge stderr into the output (default)
     if is_pexpect:
-        # Use pexpect
-        tries = 0
-
-        # Temporary log file to contain stdout/stderr redirection
-        temp_filename = '.pexpect.'+str(getpid())
-        # Write temp file to scratch if possible
-        if getenv("ND280SCRATCH"):
-            temp_filename = getenv("ND280SCRATCH")+'/'+temp_filename
-
-        # Regex for identifiying errors
-        # (can't easily pick up the stderr pipe separately)
-        error_regex = '(?i)usage: |(?i)no such|(?i)invalid|(?i)illegal|(?i)error|(?i)failure|(?i)no accessible|'
-        error_regex += '(?i)unauthori[sz]ed|(?i)expire|(?i)exceed|(?i)fatal|(?i)abort|(?i)denied|(?i)no available|(?i)timed out'
-
-        # Try 3 times then give up
         print datetime.now()
-        while tries < 3:
-            try_state = 'Try pexpect ' + str(tries) + ' of '
-            try_state += in_command + ' with ' + str(in_timeout)
-            try_state += 's timeout'
-            print try_state
-
-            # Spawn process
-            child = pexpect.spawn(in_command, timeout=in_timeout)
-
-            # Open temp file
-            fout = file(temp_filename, 'w+')
-            child.logfile_read = fout
-
-            # Attempt the command
-            pi = child.expect([pexpect.TIMEOUT, pexpect.EOF, error_regex])
-            # print 'child.before:', child.before
-            # print 'child.after:', child.after
-
-            # Read output from temp file stripping carriage returns
-            output = list()
-            fout.seek(0)
-            readlines = fout.readlines()
-            if type(readlines) is str:
-                readlines = readlines.split('\n')
-            for line in readlines:
-                line = line.strip()
-                output.append(line)
-
-            print str(output)
-            # Close and delete temp file
-            fout.close()
-            os.remove(temp_filename)
-
-            # Close the connection to the spawned process
-            try:
-                child.close()
-            except Exception as exception:
-                print str(exception)
-                traceback.print_exc()
-
-            lines = output
+        result = policy.Run(in_command, in_timeout, merge_stderr=True)
+        lines = [line.strip() for line in result.lines]
+        print 'lines =', lines
+        if result.timedout:
+            print 'Timeout! ('+str(in_timeout)+'s)'
 
-            print 'pi =', pi
-            print 'lines =', lines
-            # Possible outcomes
-            if pi == 0:
-                print 'Timeout! ('+str(in_timeout)+'s)'
-                tries += 1
-                time.sleep(StatusWait.kMinute)
-                continue
-            # if pi == 1:
-            #     lines = output
-            #     errors = list()
-            #     break
-            # if pi == 2:
-            #     false_negative = False
-            #     print 'Possible false negative?'
-            #     if type(output) is str:
-            #         output = output.split('\n')
-            #     for a_line in output:
-            #         print 'line: ', a_line
-            #         if 'Success' in a_line:
-            #             false_negative = True
-            #             lines = output
-            #             errors = list()
-            #             break
-            #     if false_negative:
-            #       print 'It is a false negative, breaking...'
-            #       break
-            #     print 'ERROR!'
-            #     print '\n'.join(output)
-            #     errors.append('ERROR!'+repr(output))
-            #     tries += 1
-            #     time.sleep(StatusWait.kMinute)
-            #     continue
-            else:
-                break
-
-    # Don't use pexpect
+    # Keep stderr separate
     else:
         # Add lcg-* timeouts
         if 'lcg-' in in_command:
@@ -457,59 +392,38 @@ def runLCG(in_command, in_timeout=StatusWait.kTimeout, is_pexpect=True):
         command = 'ulimit -t ' + str(max(StatusWait.kTimeout,
                                      in_timeout)) + '\n' + in_command
 
-        # try the command a few times because failures happen on the GRID
+        # try grid commands a few times, with a wall-clock limit, because
+        # failures happen on the GRID. Local commands (e.g.
+        # RunND280Process.py) may run for hours and must not be rerun
         print datetime.now()
-        for ii in range(3):
-            print 'Try %d of %s with %d timeout' % (ii, in_command, in_timeout)
-
-            line, errors = ND280Comp.GetListPopenCommand(command)
+        if GRID_COMMAND.match(in_command):
+            result = policy.Run(command, max(StatusWait.kTimeout,
+                                             in_timeout))
+        else:
+            result = ND280Comp.GetCommandExecutor().Run(command, 0)
 
-            if errors:
-                print 'ERROR!'
-                print '\n'.join(errors)
-                time.sleep(min(in_timeout, 3*60))
-                continue
-            else:
-                break
         # Removal of newlines, carriage returns
-        lines = [l.strip() for l in lines]
-        errors = [e.strip() for e in errors]
+        lines = [l.strip() for l in result.lines]
+        errors = [e.strip() for e in result.errors]
 
     print 'returned'
     return lines, errors
 
 
-
 def runDIRAC(in_command, in_timeout=ND280Comp.StatusWait().kTimeout):
     """ DIRAC commands without pexpect"""
     print 'runDIRAC', in_command
 
-    # Limit the execution time
-    # - note this only clocks CPU time so zombie
-    # processes will last forever..
-    command = 'ulimit -t ' + str(in_timeout) + '\n' + in_command
-
     # try the command a few times because failures happen on the GRID
     print datetime.now()
-    for ii in range(3):
-        print 'Try %d of %s with %d timeout' % (ii, in_command, in_timeout)
-
-        line, errors = ND280Comp.GetListPopenCommand(command)
+    result = ND280Comp.GetRetryPolicy().Run(in_command, in_timeout)
 
-        if errors:
-            print 'ERROR!'
-            print '\n'.join(errors)
-            time.sleep(min(in_timeout, 3*60))
-            continue
-        else:
-            break
     # Removal of newlines, carriage returns
-    lines = [l.strip() for l in lines]
-    errors = [e.strip() for e in errors]
+    lines = [l.strip() for l in result.lines]
+    errors = [e.strip() for e in result.errors]
     return lines, errors
 
 
-
 def getAlias(filename):
     """ Command returns the LFN alias of any lfn or surl """
     print 'GetAlias for ' + str(filename)
@@ -596,195 +510,47 @@ def runFTS(original_filename, copy_filename):
     return copy_filename
 
 
-def FileLineCount(filename):
-    """ Determine number of lines in a file """
-    nLines = 0
-    if os.path.exists(filename):
-        a_file = open(filename)
-        nLines = len(a_file.read()) - 1
-        a_file.close()
-    return nLines
+def CountActiveTransfers(source, dest):
+    """ The number of files in active FTS transfers between two SEs """
+    return ND280Transfers.GetChannelMonitor().Active(source, dest)
 
 
-def runFTSMulti(srm, original_filename, copy_filename,
-                isLastFile=False, ftsInt=0):
-    """ Send multiple files to the RAL File Transfer Service """
-    # print 'runFTSMulti: srm=' + srm + ' orig=' + original_filename + \
-    # ' copy=' + copy_filename + ' isLastFile=' + str(isLastFile) + \
-    # ' ftsInt=' + str(ftsInt)
+def GetTransferScheduler(ftsInt=0):
+    """ The shared ND280Transfers.TransferScheduler, the journal of the
+    first one made is tagged with ftsInt """
+    return ND280Transfers.GetTransferScheduler(ftsInt)
 
-    # is this a forced copy?
-    isForcedCopy = 0
 
-    # Environment
-    transfer_dir = getenv("ND280TRANSFERS")
-    if not transfer_dir:
-        transfer_dir = getcwd()
-    print 'Transfer directory: '+transfer_dir
-    datestring = date.today().isoformat().replace('-', '')
-    print 'Datestamp:'+datestring
+def runFTSMulti(srm, original_filename, copy_filename,
+                isLastFile=False, ftsInt=0, size=0):
+    """ Send multiple files to the RAL File Transfer Service.
+    The transfer is queued on the shared TransferScheduler, which submits
+    it with others on the same channel once enough (NTRANSFERS files or
+    enough bytes) are queued or they have waited long enough. isLastFile
+    submits everything queued, copying a file onto itself only does that.
+    """
+    scheduler = GetTransferScheduler(ftsInt)
 
-    # Write SRM pairs to filelist
     if original_filename != copy_filename:
         srm_a = GetSEFromSRM(original_filename)
         srm_b = GetSEFromSRM(copy_filename)
 
         # Make sure source and destination exist
-        if not len(srm_a):
-            print "Source missing!"
-            raise Exception
-        if not len(srm_b):
-            print "Destination missing!"
-            raise Exception
-        if 'srm' not in original_filename:
-            print original_filename + ' not a valid SURL!'
+        if srm_a not in se_roots or srm_b not in se_roots:
+            print 'Could not identify SEs: ' + srm_a + ' ' + srm_b
             raise Exception
-        if 'srm' not in copy_filename:
-            print copy_filename + ' not a valid SURL!'
-            raise Exception
-
-        listname = transfer_dir + '/transfer.' + srm_a + '-' + srm_b
-        if ftsInt:
-            listname += '.' + str(ftsInt)
-        listname += '.txt'
-
-        print 'Accessing channel:' + listname
-
-        # Add this transfer file to the list if not present
-        if listname not in TRANSFER_FILE_LIST:
-            TRANSFER_FILE_LIST.append(listname)
-            print 'Added '+listname+' to transfer file list.'
-        try:
-            filelist = open(listname, "a")
-            filelist.write(original_filename + ' ' + copy_filename + '\n')
-            filelist.close()
-        except Exception as exception:
-            print str(exception)
-            print "Couldn't write to " + listname
+        scheduler.Add(original_filename, copy_filename, size)
 
-    else:
+    elif not isLastFile:
         print 'Trying to overwrite ' + original_filename + \
               ' with itself!:' + copy_filename
-        if not isLastFile:
-            raise Exception
-        else:
-            print 'Forcing copy to invoke FTS, resetting SRMs...'
-            isForcedCopy = 1
-            srm_a = ''
-            srm_b = ''
-
-    # Submit file for each sourcea dn destination,
-    # keep track of submissions and remove from
-    # TRANSFER_FILE_LIST accordingly
-    submittedList = list()
-
-    print 'Transfer File List:'
-    print repr(TRANSFER_FILE_LIST)
-
-    for transfer in TRANSFER_FILE_LIST:
-
-        # Submit after NTRANSFERS files in list or file is last in directory
-        # and not the only to be transferred
-        nlines = FileLineCount(transfer)
-        if nlines >= NTRANSFERS or (isLastFile and nlines > 1) or isForcedCopy:
-            print 'Using the FTS service'
-            print str(nlines) + ' files to transfer in this job'
-
-            if isLastFile:
-                print original_filename + ' is the last file in this directory'
-
-                if isForcedCopy:
-                    # Derive SRMs from transfer in case of forced copy
-                    if not srm_a and not srm_b:
-                        print 'Deriving SRMs from ' + transfer
-                        # Get srm_a:
-                        for srm in se_roots.keys():
-                            if 'transfer.'+srm in transfer:
-                                srm_a = srm
-                                break
-                        # Get srm_b:
-                        for srm in se_roots.keys():
-                            if 'transfer.' + srm_a + '-' + srm in transfer:
-                                srm_b = srm
-                                break
-                print 'SRMs: ', srm_a, srm_b
-
-            # Check SRM info exists
-            if srm_a not in se_roots.keys() or srm_b not in se_roots.keys():
-                print 'Could not identify SEs: ' + srm_a + ' ' + srm_b
-                raise Exception
-
-            # Don't submit any more transfers if already
-            # MAX_TRANSFERS_PER_CHANNEL on the queue,
-            # unless these are coming out of kek
-            if 'kek.jp' not in srm_a:
-                print 'Checking FTS transfers between %s and %s' % (srm_a,
-                                                                    srm_b)
-
-                while 1:
-                    n_active = 0
-                    transfers, statuses = GetActiveTransferList(srm_a, srm_b)
-
-                    for trans in transfers:
-                        n_active += GetTransferStatus(trans, srm_a, srm_b)[0]
-
-                    # Okay to submit?
-                    if n_active <= MAX_TRANSFERS_PER_CHANNEL:
-                        print 'Okay to submit transfers!'
-                        break
-
-                    # If not, sleep
-                    time.sleep(StatusWait.kProcessWait)
-
-            # Now, submit the transfer
-            command = 'fts-transfer-submit --verbose -K -o'
-            command += ' -s ' + getenv("FTS_SERVICE")
-            # comment out for legacy mode
-            command += ' -m ' + getenv("MYPROXY_SERVER")
-            # Implement space token
-            if se_spacetokens[srm_b]:
-                command += ' -t T2KORGDISK'
-            command += ' -f ' + transfer
-            # print 'runFTSMulti: '+command
-            lines, errors = runLCG(command)
-
-            # if this is a transfer out of kek, increase priority
-            # if lines and not errors:
-            #     transfer_id = lines[0]
-            #     priority = str(5)
-            #     if 'kek.jp' in srm_a:
-            #         command = 'glite-transfer-setpriority'
-            #         command += ' -s ' + getenv("FTS_SERVICE")
-            #         command += transfer_id + ' ' + priority
-            #         lines, errors = runLCG(command)
-
-            # Write the transfer log - just FTS ID
-            transfer_log = open(transfer_dir + '/transfers.' +
-                                datestring + '.log', "a")
-            transfer_log.write(lines[0]+'\n')
-            transfer_log.close()
-
-            # Now remove this transfer
-            print 'Removing %s' % (transfer)
-            # if os.path.exists(transfer):
-            os.remove(transfer)
-            submittedList.append(transfer)
-
-        elif isLastFile and nlines == 1:
-            print 'No new files to transfer!'
-            print 'Removing %s' % (transfer)
-            # if os.path.exists(transfer):
-            os.remove(transfer)
-            submittedList.append(transfer)
-        else:
-            pass
-
-    # end of loop over TRANSFER_FILE_LIST
+        raise Exception
 
-    for submitted in submittedList:
-        TRANSFER_FILE_LIST.remove(submitted)
+    if isLastFile:
+        print original_filename + ' is the last file, submitting transfers'
+        scheduler.Flush()
+        print scheduler.Summary()
 
-    print 'runFTSMulti exited cleanly'
     return copy_filename
 
 
@@ -1143,53 +909,42 @@ t2kgscND280.DAQ_FILE_ARCHIVE where Archive_Date >= curdate() \
 
 
 def LocalCopyLFNList(fileList=[], localRoot='',
-                     defaultSE='srm-t2k.gridpp.rl.ac.uk'):
-    """ Wrapper function for ND280File.CopyLocal()"""
-
-    # maintain list of failed copies
-    listOfFailures = list()
-
-    # copy files locally
-    for fileName in fileList:
-
-        # extract lfc directory from file name
-        # (may be different if a directory boundary is crossed)
-        lfcDir = os.path.dirname(fileName)
-
+                     defaultSE='srm-t2k.gridpp.rl.ac.uk', max_workers=8,
+                     per_se=3, manifest='', verify=False):
+    """ Copy a list of LFNs below localRoot, preserving the LFC structure,
+    with an ND280Download.BulkDownloader: max_workers copies at once, at
+    most per_se from any SE, each from its best replica (defaultSE when
+    replicas are equal). Files already downloaded, according to the
+    manifest (default localRoot/.nd280download.manifest) or their size and
+    checksum, are skipped. Returns the list of failures """
+
+    def Destination(lfn):
         # define path to local destination which preserves LFC structure
-        localDir = lfcDir.replace('lfn:' + getenv('LFC_HOME'), localRoot)
-
-        # create destination directory if necessary
-        if not os.path.exists(localDir):
-            print 'Making local directory '+localDir
-            os.makedirs(localDir)
-
-            # balk if directory couldn't be created
-            if not os.path.exists(localDir):
-                sys.exit('Unable to create '+localDir)
-
-        # the local path to this file
-        localPath = localDir+'/'+os.path.basename(fileName)
-
-        # check it doesn't already exist
-        if not os.path.exists(localPath):
-
-            # not all files on archiver, will be uploaded to grid yet
-            try:
-                f = ND280File(fileName)
-                f.CopyLocal(localDir, defaultSE)
-            except Exception as exception:
-                print str(exception)
-                traceback.print_exc()
-                listOfFailures.append(fileName)
-        else:
-            print localPath+' exists!'
+        return ('lfn:' + lfn).replace('lfn:' + getenv('LFC_HOME'), localRoot)
+
+    # look up the sizes, checksums and replicas of the files in bulk
+    tasks, listOfFailures = ND280Download.TasksFromCatalogue(fileList,
+                                                             Destination)
+    for missing in listOfFailures:
+        print 'Could not find %s in the catalogue' % missing
+
+    if not manifest:
+        manifest = os.path.join(localRoot, '.nd280download.manifest')
+    if not os.path.isdir(localRoot):
+        os.makedirs(localRoot)
+    downloader = ND280Download.BulkDownloader(max_workers, per_se, manifest,
+                                              verify, preferred=defaultSE)
+    for task in downloader.Run(tasks):
+        print task.lfn, ' '.join(task.errors)
+        listOfFailures.append(task.lfn)
 
     if len(listOfFailures):
         print '%d failures:' % (len(listOfFailures))
         for fail in listOfFailures:
             print fail
-    return
+    print downloader.Summary()
+    print ND280Replicas.GetReplicaSelector().Summary()
+    return listOfFailures
 
 
 def LogFileConsistencyCheck(logFileLFN=''):
@@ -1227,20 +982,17 @@ def LogFileConsistencyCheck(logFileLFN=''):
     # keep a list of missing files
     missingFiles = []
 
-    # check that all files exist
-    for r in rootFiles[:]:
-
-        # determine processing stage
-        stage = r.split('_')[5]
-
-        # try and make a file object
-        try:
-            # logical path to root file
-            rootFileLFN = logFileLFN.replace('logf/' + logFileName,
-                                             '') + stage + '/' + r
-            f = ND280File(rootFileLFN)
-        except Exception as exception:
-            print str(exception)
+    # logical paths to the root files, named by processing stage
+    lazyFiles = list()
+    for r in rootFiles:
+        rootFileLFN = logFileLFN.replace('logf/' + logFileName, '')
+        stage = ND280NameParser.ParseFileName(r).stage
+        lazyFiles.append(ND280LazyFile(rootFileLFN + stage + '/' + r))
+
+    # check that all files exist, with a single bulk query
+    ND280LazyFile.ResolveMany(lazyFiles)
+    for r, f in zip(rootFiles[:], lazyFiles):
+        if not f.Exists():
             # if file doesn't exist, remove from list of root files
             # and add to list of missing
             rootFiles.remove(r)
@@ -1304,7 +1056,95 @@ def GetSubRunFromFlukaFileName(flukaFileName=''):
     return int(iseq)
 
 
-class ND280File(object):
+class ND280FileName(object):
+    """ Functions that only need the name of an ND280 file, shared by
+    ND280File and ND280LazyFile. Expects filename and filetype """
+
+    __slots__ = ()
+
+    class Error(Exception):
+        """internal error class"""
+        pass
+
+    def GetNameRecord(self):
+        """ The parsed ND280NameParser.FileNameRecord of this file name,
+        cached until the file name changes """
+        record = getattr(self, '_record', None)
+        if record is None or record.name != self.filename:
+            record = ND280NameParser.ParseFileName(self.filename)
+            self._record = record
+        return record
+
+    def SetFileType(self):
+        """File type, p=processed, r=raw, m=MC, c=testbeam, o=other"""
+        kind = self.GetNameRecord().kind
+        if kind not in ('p', 'm', 'r', 'c'):
+            kind = 'o'
+        self.filetype = kind
+
+    # Functions to parse certain information from the filename
+    def GetFileHash(self):
+        """ Get the unique file hash of processed file,
+        throws error if not a processed file
+
+        Returns the first 4 characters of the file hash.
+        Works on any processed filename as it just uses
+        the final '/' split as a file name.
+        E.g. GetFileHash('/grid/t2k.org/nd280/mcp1/genie/2010-02-water/Magnet/\
+beam/numc/oa_gn_beam_91000098-0093_dxf44iaxt3e7_numc_000_mcp1geniemagnet.root')
+        returns dxf4
+        """
+        if not (self.filetype is 'p' or self.filetype is 'm'):
+            raise self.Error('This is not a processed or MC file, cannot get\
+file hash. File type is ', self.filetype)
+        return self.GetNameRecord().hash[0:4]
+
+    # return the stage of the processing
+    def GetStage(self):
+        """ Get the stage of processed file, throws error if not a processed
+        file"""
+        if not (self.filetype is 'p' or self.filetype is 'm'):
+            raise self.Error('This is not a processed or MC file, cannot get\
+stage of processing.')
+        return self.GetNameRecord().stage
+
+    def GetVersion(self):
+        """ Get the version of processed file, throws error if not a processed
+        file  """
+        if not (self.filetype is 'p' or self.filetype is 'm'):
+            raise self.Error('This is not a processed or MC file, cannot get\
+version.')
+        return self.GetNameRecord().version
+
+    def GetComment(self):
+        """ Get the comment of processed file, throws error if not a processed
+        file  """
+        if not (self.filetype is 'p' or self.filetype is 'm'):
+            raise self.Error('This is not a processed or MC file, cannot get\
+comment.')
+        return self.GetNameRecord().comment
+
+    def GetRunRange(self):
+        """ Gets the range in which this run lies:
+            00001000-00001999, 00002000-00002999 ... etc """
+        runno = int(self.GetRunNumber())
+        return RunRange(runno)
+
+    # nd280_00003998_0000.daq.mid.gz
+    def GetRunNumber(self):
+        """ Get the run number by parsing the file name """
+        if self.filetype not in ('r', 'p', 'm', 'c'):
+            return ''
+        return ND280NameParser.FormatRun(self.GetNameRecord().run)
+
+    def GetSubRunNumber(self):
+        """ Get the sub run number by parsing the file name """
+        if self.filetype not in ('r', 'p', 'm', 'c'):
+            return ''
+        return ND280NameParser.FormatSubrun(self.GetNameRecord().subrun)
+
+
+class ND280File(ND280FileName):
     """ A class that contains useful file functions """
 
     class Error(Exception):
@@ -1343,14 +1183,15 @@ class ND280File(object):
         self.gridfile = str()
         self.is_a_dir = False
 
-        command = 'ls ' + lfn
-        lines, errors = ND280Comp.GetListPopenCommand(command)
-        print 'ls ', lfn
-        print str(lines)
         try:
             # This file is not registered on the GRID, is it local?
-            command = 'ls ' + lfn
-            lines, errors = ND280Comp.GetListPopenCommand(command)
+            # (no need to look for LFNs in the local FS)
+            errors = list()
+            if 'lfn:' not in fn and 'LFN:' not in fn:
+                command = 'ls ' + lfn
+                lines, errors = ND280Comp.GetListPopenCommand(command)
+                print 'ls ', lfn
+                print str(lines)
             if errors or ('lfn:' in fn or 'LFN:' in fn):
                 print 'This file is not in the local FS, trying DFC'
                 self.gridfile = ''
@@ -1403,19 +1244,31 @@ class ND280File(object):
             print str(exception)
             raise self.Error('Unable to establish file in DFC or locally ' + fn)
 
-        # File type, p=processed, r=raw, m=MC, o=other, n=none
-        if 'oa_nd_' in self.filename:
-            self.filetype = 'p'
-        elif self.filename in ('oa_nt_', 'oa_gn_'):
-            self.filetype = 'm'
-        elif 'nd280_' in self.filename:
-            self.filetype = 'r'
-        elif 'dsecal_' in self.filename:
-            # CERN testbeam data
-            self.filetype = 'c'
-        else:
-            self.filetype = 'o'
+        self.SetFileType()
 
+    @classmethod
+    def FromCatalogue(cls, fn, size=0., reps=None, guid=''):
+        """Create an ND280File for a DFC file from catalogue information
+        that is already known, e.g. from ND280DIRAC.GetBulkMetadata, without
+        running any commands. size is in MB as from DMSFileSize
+        """
+        self = cls.__new__(cls)
+        fn = fn.strip().rstrip('/')
+        if len(fn) < 1:
+            raise self.Error('No input file')
+        self.turl = str()
+        self.filename = fn.split('/')[-1]
+        self.alias = fn
+        self.reps = list(reps or [])
+        self.guid = guid
+        self.size = float(size)
+        self.gridfile = 'l'
+        self.is_a_dir = False
+        # Set up relative paths as the constructor does
+        self.path = self.alias.replace('lfn:/', '')
+        self.path = self.path.replace(self.filename, '')
+        self.SetFileType()
+        return self
 
     def __del__(self):
         """ Clean up after the object. If you have requested a turl
@@ -1431,95 +1284,6 @@ class ND280File(object):
                                  + self.turl[0] + ' located at '
                                  + self.turl[1])
 
-    class Error(Exception):
-        """Internal Error class for raising errors"""
-        pass
-
-    # Functions to parse certain information from the filename
-    def GetFileHash(self):
-        """ Get the unique file hash of processed file,
-        throws error if not a processed file
-
-        Returns the 5 character file hash.
-        Works on any processed filename as it just uses
-        the final '/' split as a file name.
-        E.g. GetFileHash('/grid/t2k.org/nd280/mcp1/genie/2010-02-water/Magnet/\
-beam/numc/oa_gn_beam_91000098-0093_dxf44iaxt3e7_numc_000_mcp1geniemagnet.root')
-        returns dxf44
-        """
-        if not (self.filetype is 'p' or self.filetype is 'm'):
-            raise self.Error('This is not a processed or MC file, cannot get\
-file hash. File type is ', self.filetype)
-        fn_spl = self.filename.split('_')
-        file_hash = fn_spl[4][0:4]
-        return file_hash
-
-    # return the stage of the processing
-    def GetStage(self):
-        """ Get the stage of processed file, throws error if not a processed
-        file"""
-        if not (self.filetype is 'p' or self.filetype is 'm'):
-            raise self.Error('This is not a processed or MC file, cannot get\
-stage of processing.')
-        fn_spl = self.filename.split('_')
-        print('soph  ND280File.GetStage   returns   fn_spl[5] = ' + fn_spl[5] )
-        return fn_spl[5]
-
-    def GetVersion(self):
-        """ Get the version of processed file, throws error if not a processed
-        file  """
-        if not (self.filetype is 'p' or self.filetype is 'm'):
-            raise self.Error('This is not a processed or MC file, cannot get\
-version.')
-        fn_spl = self.filename.split('_')
-        return fn_spl[6]
-
-    def GetComment(self):
-        """ Get the comment of processed file, throws error if not a processed
-        file  """
-        if not (self.filetype is 'p' or self.filetype is 'm'):
-            raise self.Error('This is not a processed or MC file, cannot get\
-comment.')
-        fn_spl = self.filename.split('_')
-        return fn_spl[7].split('.')[0]
-
-    def GetRunRange(self):
-        """ Gets the range in which this run lies:
-            00001000-00001999, 00002000-00002999 ... etc """
-        runno = int(self.GetRunNumber())
-        return RunRange(runno)
-
-    # nd280_00003998_0000.daq.mid.gz
-    def GetRunNumber(self):
-        """ Get the run number by parsing the file name """
-        fn_spl = self.filename.split(".")[0]
-        fn_spl = fn_spl.split("_")
-        if self.filetype is 'r':
-            return fn_spl[1]
-        elif self.filetype is 'p' or self.filetype is 'm':
-            rn = fn_spl[3]
-            rn = rn.split("-")
-            return rn[0]
-        elif self.filetypei is 'c':
-            return fn_spl[1]
-        else:
-            return ''
-
-    def GetSubRunNumber(self):
-        """ Get the sub run number by parsing the file name """
-        fn_spl = self.filename.split(".")[0]
-        fn_spl = fn_spl.split("_")
-        if self.filetype is 'r':
-            return fn_spl[2]
-        elif self.filetype is 'p' or self.filetype is 'm':
-            rn = fn_spl[3]
-            rn = rn.split("-")
-            return rn[1]
-        elif self.filetype is 'c':
-            return fn_spl[2]
-        else:
-            return ''
-
     # Methods for grid resident files
     def LFN(self):
         """
@@ -1640,50 +1404,41 @@ On a GRID node? No=Don\'t Worry, yes=WTF')
         else:
             raise self.Error('Only use the GetTurl method with an LFN')
 
+    def GetReplicas(self):
+        """ The replica SURLs of this file, looked up in the catalogue if
+        they are not known yet """
+        if not self.reps and self.alias and self.gridfile:
+            replicas, failed = ND280DIRAC.GetBulkReplicas([self.alias])
+            for lfn, reps in replicas.iteritems():
+                self.reps = reps.values()
+        return self.reps
+
+    def GetSizeBytes(self):
+        """ The size of this file in bytes, self.size is in MB """
+        return self.size * ND280DIRAC.SIZE_UNITS['MB']
+
     def GetRepSURL(self, srm=''):
-        print 'GetRepSURL(srm='+srm+')'
         """ Get the surl for this file from replica list.
-        Priority is as follows:
+        The replica with the best expected completion time, from the
+        measured performance of each SE (see ND280Replicas), is chosen.
+        SEs that keep failing are skipped for a while. Ties go to
         1. srm passed as argument
         2. RAL
-        3. IN2P3 or TRIUMF
-        4. The first listed replica.
+        3. TRIUMF, IN2P3 or QMUL
+        Returns a blank if there are no replicas.
         """
-        original_filename = ''
-        if self.path:
-            original_filename = self.path + '/'
-        original_filename += self.filename
-        # Get surl from replica list
-
-        # Prioritise the users choice of srm
-        if srm:
-            for r in self.reps:
-                if srm in r:
-                    return r
-
-        # Prioritise RAL
-        for r in self.reps:
-            if 'srm-t2k.gridpp.rl.ac.uk' in r:
-                return r
-        # Then TRIUMF and IN2P3 equally
-        for r in self.reps:
-            if 't2ksrm.nd280.org' in r:
-                return r
-            elif 'in2p3.fr' in r:
-                return r
-            elif 'qmul' in r:
-                return r
-        # If none of the above then just choose the first
-        if self.reps:
-            return self.reps[0]
-        # Or return a blank
-        else:
-            return ''
-
-    def CopySRM(self, srm, use_fts=0, isLastFile=False, ftsInt=0):
+        print 'GetRepSURL(srm='+srm+')'
+        selector = ND280Replicas.GetReplicaSelector()
+        return selector.Choose(self.GetReplicas(), self.GetSizeBytes(), srm)
+
+    def CopySRM(self, srm, use_fts=0, isLastFile=False, ftsInt=0,
+                staged=''):
+        """ Replicate this file to srm, with lcg-rep or FTS. staged is a
+        replica to copy from rather than choosing one, with FTS the caller
+        must already have brought it online """
         print 'CopySRM()'
 
-        original_filename = self.GetRepSURL()
+        original_filename = staged or self.GetRepSURL()
 
         # remove errant '//' ignoring the first 10 characters
         original_filename = original_filename[:10] + \
@@ -1712,47 +1467,73 @@ On a GRID node? No=Don\'t Worry, yes=WTF')
         if use_fts:
             # first if original file is at RAL, make sure it is staged on disk,
             # otherwise FTS will timeout
-            if 'srm-t2k.gridpp.rl.ac.uk' in original_filename:
-                lines, errors = DMSFindLFN('', LFN=original_filename).Run()
-                while '' in lines:
-                    lines.remove('')
-                if errors or len(lines) < 1:
-                    raise self.Error('Could not determine staging of ' +
-                                     original_filename)
-                else:
-                    if 'ONLINE' not in lines[0].split()[5]:
-                        runLCG(ND280Comp.LCG(2*StatusWait.kHour).bringonline + original_filename,
-                               in_timeout=2*StatusWait.kHour, is_pexpect=False)
+            if not staged and ND280Staging.IsTape(original_filename):
+                stager = ND280Staging.Stager()
+                if not stager.StageAll([(original_filename, self)]):
+                    raise self.Error('Could not stage ' + original_filename)
 
             # Use the FTS service 23-11-10
             return runFTSMulti(srm, original_filename, copy_filename,
-                               isLastFile, ftsInt)
+                               isLastFile, ftsInt, self.GetSizeBytes())
         else:
+            # replicate from the chosen replica, so the transfer
+            # time can be put down to its SE
             command = 'lcg-rep -v -n 3 '
             if se_spacetokens[srm]:
                 command += ' -S T2KORGDISK'
-            command += ' -d ' + copy_filename + ' ' + self.alias
-            lines, errors = runLCG(command, in_timeout=600)
-            if errors:
-                print '\n'.join(errors)
+            command += ' -d ' + copy_filename + ' '
+            command += original_filename or self.alias
+            result = ND280Comp.GetRetryPolicy().Run(command, 600)
+            succeeded = result.returncode == 0 and not result.timedout
+            if original_filename:
+                ND280Replicas.GetReplicaSelector().Record(
+                    original_filename, self.GetSizeBytes(),
+                    result.duration, succeeded)
+            if not succeeded:
+                print ''.join(result.errors)
                 raise self.Error('Could not replicate the file '
                                  + self.alias + ' on the SRM '
-                                 + srm + '\n', errors)
+                                 + srm + '\n', result.errors)
             else:
-                print '\n'.join(lines)
+                print ''.join(result.lines)
                 return copy_filename
 
-    def CopyLocal(self, dir, srm=''):
-        """"""
-        original_filename = self.GetRepSURL(srm)
-        copy_filename = dir + '/' + self.filename
-
+    def CopyLocal(self, dir, srm='', max_tries=3):
+        """ Copy this file into the local directory dir. The replicas are
+        tried best first (see GetRepSURL), up to max_tries of them, and
+        every attempt is recorded by the replica selector. Without any
+        known replica DIRAC chooses the source """
+        copy_filename = os.path.abspath(dir + '/' + self.filename)
         print 'CopyLocal(%s)' % (copy_filename)
 
-        dirac_command = 'dirac-dms-get-file /' + copy_filename
-        os.system(dirac_command)
-
-        return self.filename
+        selector = ND280Replicas.GetReplicaSelector()
+        ranked = selector.Rank(self.GetReplicas(), self.GetSizeBytes(), srm)
+        if not ranked:
+            lfn = self.alias.replace('lfn:', '').replace('LFN:', '')
+            command = 'cd %s && dirac-dms-get-file %s' % (dir, lfn)
+            result = ND280Comp.GetRetryPolicy().Run(command,
+                                                    StatusWait.kTimeout)
+            if not result.IsOK():
+                raise self.Error('Could not copy ' + self.alias + ' to ' +
+                                 dir, result.errors)
+            return self.filename
+
+        timeout = max(StatusWait.kTimeout,
+                      int(self.GetSizeBytes() / (1024.**2)))
+        errors = list()
+        for surl in ranked[:max_tries]:
+            command = 'lcg-cp -v ' + surl + ' file:' + copy_filename
+            result = ND280Comp.GetCommandExecutor().Run(command, timeout)
+            selector.Record(surl, self.GetSizeBytes(), result.duration,
+                            result.returncode == 0 and not result.timedout)
+            if result.returncode == 0 and not result.timedout:
+                return self.filename
+            print 'Copy from %s failed, trying the next replica' % surl
+            errors += result.errors
+            if os.path.exists(copy_filename):
+                os.remove(copy_filename)
+        raise self.Error('Could not copy ' + self.alias + ' to ' + dir,
+                         errors)
 
 
     ########################################################################################################################
@@ -1803,6 +1584,141 @@ On a GRID node? No=Don\'t Worry, yes=WTF')
             return dlfn
 
 
+class ND280LazyFile(ND280FileName):
+    """ A lightweight, read only ND280File for DFC files.
+
+    Name derived information (run, subrun, stage, hash...) is available
+    straight away without running any commands. The size, replicas and
+    GUID are only looked up in the catalogue when first used, and then
+    cached. ResolveMany looks up a whole list of files in bulk.
+    """
+
+    __slots__ = ('alias', 'filename', 'path', 'filetype', '_record',
+                 '_size', '_reps', '_guid', '_resolved', '_exists')
+
+    class Error(Exception):
+        """internal error class"""
+        pass
+
+    def __init__(self, fn):
+        fn = fn.strip().rstrip('/')
+        if len(fn) < 1:
+            raise self.Error('No input file')
+        if 'lfn:' not in fn and 'LFN:' not in fn:
+            fn = 'lfn:' + fn
+        self.alias = fn
+        self.filename = fn.split('/')[-1]
+        self.path = fn.replace('lfn:/', '').replace('LFN:/', '')
+        self.path = self.path.replace(self.filename, '')
+        self._size = 0.
+        self._reps = list()
+        self._guid = str()
+        self._resolved = False
+        self._exists = False
+        self.SetFileType()
+
+    def GetLFNPath(self):
+        """ The catalogue path, without any lfn: prefix """
+        return self.alias.replace('lfn:', '').replace('LFN:', '')
+
+    @staticmethod
+    def ResolveMany(files):
+        """ Look up the catalogue information of many ND280LazyFiles
+        with one bulk metadata and one bulk replica query """
+        files = [f for f in files if not f._resolved]
+        if not files:
+            return
+        lfns = [f.GetLFNPath() for f in files]
+        metadata, failed = ND280DIRAC.GetBulkMetadata(lfns)
+        replicas, rep_failed = ND280DIRAC.GetBulkReplicas(lfns)
+        for f, lfn in zip(files, lfns):
+            # a failed query is asked again next time, only a missing
+            # file is remembered as such
+            if lfn not in metadata and \
+                    not MISSING_LFN.search(failed.get(lfn, '')):
+                print 'Could not look up ' + lfn + ': ' + failed.get(lfn, '')
+                continue
+            f._resolved = True
+            f._exists = lfn in metadata and lfn not in failed
+            if not f._exists:
+                continue
+            size = float(metadata[lfn].get('Size', 0) or 0)
+            f._size = size / ND280DIRAC.SIZE_UNITS['MB']
+            f._guid = metadata[lfn].get('GUID', '')
+            if lfn not in rep_failed:
+                f._reps = replicas.get(lfn, dict()).values()
+
+    def Resolve(self):
+        """ Look up this file in the catalogue, once """
+        ND280LazyFile.ResolveMany([self])
+
+    def Exists(self):
+        """ Is this file registered in the catalogue """
+        self.Resolve()
+        return self._exists
+
+    @property
+    def size(self):
+        """ size in MB, as ND280File.size """
+        self.Resolve()
+        return self._size
+
+    @property
+    def reps(self):
+        """ list of replica SURLs """
+        self.Resolve()
+        return self._reps
+
+    @property
+    def guid(self):
+        """ catalogue GUID """
+        self.Resolve()
+        return self._guid
+
+    def LFN(self):
+        """ The Logical File Name """
+        return self.alias
+
+    def OnSRM(self, srm):
+        """ The replica on srm, or an empty string """
+        for r in self.reps:
+            if srm in r:
+                return r
+        return ''
+
+    def ToND280File(self):
+        """ A full ND280File from the resolved information """
+        if not self.Exists():
+            raise self.Error('Unable to find file ' + self.alias)
+        return ND280File.FromCatalogue(self.alias, self.size, self.reps,
+                                       self.guid)
+
+
+class SyncPlan(object):
+    """
+    What synchronising a directory with an SRM involves: the ND280Files
+    to copy, those already there and those left out by the sync pattern
+    """
+
+    def __init__(self, srm):
+        self.srm = srm
+        self.copy = list()
+        self.skip = list()
+        self.filtered = list()
+
+    def Bytes(self):
+        """ The bytes to copy """
+        return sum(f.GetSizeBytes() for f in self.copy)
+
+    def Print(self):
+        print 'Sync plan for %s: %d files (%.3f GB) to copy, %d already ' \
+            'there, %d not matching' % (self.srm, len(self.copy),
+                                        self.Bytes() / 1024.**3,
+                                        len(self.skip), len(self.filtered))
+        for f in self.copy:
+            print 'Copy %s (%.1f MB)' % (f.alias, f.size)
+
+
 class ND280Dir(object):
     """
     A class that allows one to do useful things with local and lfc directories.
@@ -1813,7 +1729,7 @@ class ND280Dir(object):
     with caution.
     """
     def __init__(self, dir, skipFailures=False,
-                 ls_timeout=StatusWait.kTimeout):
+                 ls_timeout=StatusWait.kTimeout, bulk=False):
         """ Initialisation of ND280Dir object
 
         self.dir: str The path of this directory
@@ -1823,6 +1739,10 @@ class ND280Dir(object):
                       s=surl
         self.last_file_name: name of last file in this directory
 
+        bulk=True fills the ND280Files of an LFC directory from one listing
+        plus bulk replica and metadata queries, rather than running several
+        commands for every file
+
         """
         if not IsValidProxy():
             raise self.Error('No valid proxy')
@@ -1835,8 +1755,13 @@ class ND280Dir(object):
         self.last_file_name = str()
 
         # Classify the directory type and check it's existance
+        # LFC Directories, in bulk
+        if bulk and ('lfn:' in self.dir or 'LFN:' in self.dir):
+            self.BulkFillLFC(skipFailures)
+            self.griddir = 'l'
+
         # LFC Directories
-        if 'lfn:' in self.dir or 'LFN:' in self.dir:
+        elif 'lfn:' in self.dir or 'LFN:' in self.dir:
             lines, errors = ND280DIRAC.DMSFindLFN(self.dir).Run()
             while '' in lines:
                 lines.remove('')
@@ -1923,6 +1848,71 @@ class ND280Dir(object):
     class Error(Exception):
         pass
 
+    def BulkFillLFC(self, skipFailures=False):
+        """ List this LFC directory once and fill every ND280File from
+        one bulk metadata and one bulk replica query. The listing comes
+        from the catalogue mirror when it is fresh, the replicas are
+        always looked up live """
+        metadata = self.ListFromMirror()
+        if metadata is not None:
+            lfns = sorted(metadata)
+            failed = dict()
+        else:
+            lines, errors = ND280DIRAC.DMSFindLFN(self.dir).Run(
+                PrintLines=False)
+            lfns = [line.split()[-1] for line in lines if line.strip()]
+            if errors or not lfns:
+                raise self.Error('Could not list files in lfc directory' +
+                                 self.dir)
+            metadata, failed = ND280DIRAC.GetBulkMetadata(lfns)
+
+        replicas, rep_failed = ND280DIRAC.GetBulkReplicas(lfns)
+        failed.update(rep_failed)
+
+        for lfn in lfns:
+            justFN = lfn.split('/')[-1]
+            if lfn in failed or lfn not in metadata:
+                message = 'Could NOT create ND280File with name ' + \
+                    self.dir + '/' + justFN
+                if not skipFailures:
+                    sys.exit(message)
+                print message
+                print 'WARNING: '+justFN+' will be ignored!'
+                continue
+            size = int(float(metadata[lfn].get('Size', 0) or 0))
+            self.dir_dic[justFN] = str(size)
+            reps = replicas.get(lfn, dict()).values()
+            self.ND280Files.append(
+                ND280File.FromCatalogue(self.dir.rstrip('/') + '/' + justFN,
+                                        size / ND280DIRAC.SIZE_UNITS['MB'],
+                                        reps,
+                                        metadata[lfn].get('GUID', '')))
+
+    def ListFromMirror(self):
+        """ {lfn: {'Size':.., 'GUID':..}} of the files below this directory
+        in the local catalogue mirror ($ND280CATALOGUE), None unless it
+        holds this directory and was listed no longer than
+        $ND280CATALOGUEMAXAGE ago. The mirror only refreshes replicas of
+        changed files, so they are not taken from it """
+        mirror = ND280Catalogue.GetMirror()
+        if not mirror:
+            return None
+        try:
+            age = mirror.Age(self.dir)
+            if age is None or age > ND280Catalogue.GetMaxAge():
+                return None
+            # recursive, as the DMSFindLFN listing it stands in for
+            files = mirror.Files(self.dir)
+        finally:
+            mirror.Close()
+        if not files:
+            return None
+
+        print 'Listing %s from the catalogue mirror, listed %d s ago' % \
+            (self.dir, age)
+        return dict((f.lfn, {'Size': f.size, 'GUID': f.guid})
+                    for f in files)
+
     def Delete(self):
         """ Deletes all files in the ND280Dir """
         if self.griddir:
@@ -1937,137 +1927,160 @@ class ND280Dir(object):
         return 0
 
     def HashDiff(self, other_dir):
-        """ diff two differnet ND280 directories using file hashes
+        """ diff two differnet ND280 directories using file hashes,
+        returns the files whose hash is not in the other directory
         """
-
-        # compile lists of the self directory
-        self.filehashes = dict()
-        for f in self.ND280Files:
-            self.filehashes[f.GetFileHash()] = (f)
-
-        # compile list of other directories
-        other_dir.filehashes = dict()
-        for f in other_dir.ND280Files:
-            other_dir.filehashes[f.GetFileHash()] = (file)
-
-        # Do the comparisons
-        diff_ls = []
-
-        for hash, file in self.filehashes.iteritems():
-            if hash not in other_dir.filehashes:
-                diff_ls.append(self.dir + file)
-        for hash, file in other_dir.filehashes.iteritems():
-            if hash not in self.filehashes:
-                diff_ls.append(other_dir.dir + file)
-        return diff_ls
+        return self.Diff(other_dir, 'hash')
 
     def RunDiff(self, other_dir):
-        """ diff two different ND280 directories using run-subrun number
+        """ diff two different ND280 directories using run-subrun number,
+        returns the files whose run-subrun is not in the other directory
         """
+        return self.Diff(other_dir, 'run')
 
-        # compile lists of the self directory
-        self.runs = dict()
-        for f in self.ND280Files:
-            self.runs[f.GetRunNumber() + '-' + f.GetSubRunNumber()] = (f)
-
-        # compile list of other directory
-        other_dir.runs = dict()
-        for f in other_dir.ND280Files:
-            other_dir.runs[f.GetRunNumber() + '-' + f.GetSubRunNumber()] = (f)
-
-        # Do the comparisons
+    def Diff(self, other_dir, key='run'):
+        """ files of this or other_dir whose key (see ND280DirDiff.KEYS)
+        is missing from the other directory """
+        listings = [[f.path + f.filename for f in d.ND280Files]
+                    for d in (self, other_dir)]
         diff_ls = list()
-
-        for run, f in self.runs.iteritems():
-            if run not in other_dir.runs:
-                diff_ls.append(f.path + f.filename)
-        for run, f in other_dir.runs.iteritems():
-            if run not in self.runs:
-                diff_ls.append(f.path + f.filename)
+        for row in ND280DirDiff.Diff(listings, key):
+            if row.status == ND280DirDiff.kMissing:
+                diff_ls.extend(row.names[0] + row.names[1])
         return diff_ls
 
-    def SyncSRM(self, srm, use_fts=0, sync_pattern='', ftsInt=0):
-        """ Synchronise this directory with a particular SRM """
-        print 'SyncSRM()'
-        failures = 0
-        isLastFile = False
-        good_files = list()
-
-        # If sync_pattern==GOODFILES, only sync files in GoodFiles.list,
-        # don't bother looking for files not in current directory!
-        if sync_pattern is 'GOODFILES':
-            good_list_name = getenv("ND280COMPUTINGROOT") + \
-                '/data_scripts/GoodRuns.list'
-            print 'Opening ' + good_list_name
+    def GoodFiles(self):
+        """ The LFNs in GoodRuns.list of this directory's run range """
+        good_list_name = getenv("ND280COMPUTINGROOT") + \
+            '/data_scripts/GoodRuns.list'
+        print 'Opening ' + good_list_name
+        try:
             good_list = open(good_list_name, 'r')
+        except IOError:
+            raise self.Error('SyncSRM: Could not open '+good_list_name)
+
+        # Get run range from first file in this directory
+        run_range = self.ND280Files[0].GetRunRange()
+        print 'RunRange:' + run_range
+        good_files = [rmNL(file).replace('//', '/')
+                      for file in good_list.readlines()
+                      if file.__contains__(run_range)]
+        good_list.close()
+        return good_files
+
+    def PlanSyncSRM(self, srm, sync_pattern=''):
+        """ Work out what SyncSRM would copy to srm, from one bulk replica
+        query for the whole directory.
+        sync_pattern=only files whose name contains it, or GOODFILES for
+        only the files in GoodRuns.list
+        """
+        plan = SyncPlan(srm)
+        if not self.ND280Files:
+            return plan
 
-            if good_list:
-                print good_list_name+' open'
-
-                # Read files
-                good_files = good_list.readlines()
-
-                # Get run range from first file in this directory
-                run_range = self.ND280Files[0].GetRunRange()
-                # run_range = 'File0'
-                print 'RunRange:' + run_range
-                good_files = [rmNL(file).replace('//', '/')
-                              for file in good_files
-                              if file.__contains__(run_range)]
-
-                print 'good_files:'
-                for gf in good_files:
-                    print gf
-
-                good_list.close()
-            else:
-                raise self.Error('SyncSRM: Could not open '+good_list_name)
+        good_files = list()
+        if sync_pattern == 'GOODFILES':
+            good_files = self.GoodFiles()
 
+        candidates = list()
         for f in self.ND280Files:
-            # Check whether this is the last file (important for FTS)
-            if f.filename == self.last_file_name:
-                if use_fts:
-                    print f.filename + ' is last file and using FTS'
-                    isLastFile = True
-
-            # Skip files not containing sync_pattern (unless last file)
-            # if sync_pattern==GOODFILES, only sync files in GoodFiles.list
-            if sync_pattern is 'GOODFILES' and good_files:
-                if f.alias in good_files or isLastFile:
-                    print 'Syncing GOODFILE: '+f.alias
-                else:
-                    print 'Skipping GOODFILE sync of '+f.alias
+            if sync_pattern == 'GOODFILES' and good_files:
+                if f.alias not in good_files:
+                    plan.filtered.append(f)
                     continue
-            elif sync_pattern is not 'GOODFILES'\
-                    and sync_pattern not in f.filename and not isLastFile:
+            elif sync_pattern != 'GOODFILES' and \
+                    sync_pattern not in f.filename:
+                plan.filtered.append(f)
                 continue
+            candidates.append(f)
 
-            # Try the copy
-            try:
-                print 'Try copying ' + f.filename + ' to ' + srm
-                # Always run FTS if on last file
-                if (not f.OnSRM(srm)) or (isLastFile and use_fts):
-                    f.CopySRM(srm, use_fts, isLastFile, ftsInt)
-                else:
-                    print 'Replica already exists!'
-            except Exception as exception:
-                print str(exception)
-                failures += 1
-                print 'SyncSRM Copy ' + f.filename + \
-                      ' to srm: ' + srm + '  failed'
+        # Refresh the replicas in one go
+        if self.griddir:
+            replicas, failed = ND280DIRAC.GetBulkReplicas(
+                [f.alias for f in candidates if f.gridfile])
+            # the replicas are keyed by the path without lfn:
+            for f in candidates:
+                lfn = f.alias.replace('lfn:', '').replace('LFN:', '')
+                if lfn in replicas:
+                    f.reps = replicas[lfn].values()
+
+        for f in candidates:
+            if f.OnSRM(srm):
+                plan.skip.append(f)
+            else:
+                plan.copy.append(f)
+        return plan
+
+    def SyncSRM(self, srm, use_fts=0, sync_pattern='', ftsInt=0,
+                dry_run=False, max_workers=4, stripe=False):
+        """ Synchronise this directory with a particular SRM.
+        The SyncPlan is worked out first and printed, with dry_run that is
+        all. Otherwise the missing files are replicated by max_workers
+        lcg-rep workers, or with use_fts queued for FTS in batches of
+        similar size. stripe spreads the files over every SE holding a
+        replica (see ND280Transfers.SourceStriper) rather than copying
+        each from its best replica. Returns the SyncPlan """
+        print 'SyncSRM()'
+        plan = self.PlanSyncSRM(srm, sync_pattern)
+        plan.Print()
+        if dry_run or not plan.copy:
+            return plan
 
+        failures = list()
+        scheduler = None
+        if use_fts:
+            scheduler = GetTransferScheduler(ftsInt)
+        if stripe:
+            striper = ND280Transfers.SourceStriper(
+                srm, ND280Transfers.GetChannelMonitor() if use_fts else None,
+                scheduler)
+            sources = striper.Assign(plan.copy, lambda f: f.GetReplicas(),
+                                     lambda f: f.GetSizeBytes())
+            print striper.Summary()
+            failures += striper.unassigned
+        elif use_fts:
+            sources = [(f.GetRepSURL(), f) for f in plan.copy]
+        else:
+            # CopySRM chooses the replica
+            sources = [('', f) for f in plan.copy]
+
+        if use_fts:
+            # recall the files on tape together, and transfer files
+            # as soon as they are online
+            stager = ND280Staging.Stager()
+            sources = [(surl, (f, surl)) for surl, f in sources]
+            for ready in stager.Stage(sources):
+                for batch in ND280Transfers.BalancedBatches(
+                        ready, lambda (f, surl): f.GetSizeBytes(),
+                        scheduler.max_files, scheduler.max_bytes):
+                    for f, surl in batch:
+                        try:
+                            f.CopySRM(srm, use_fts, False, ftsInt, surl)
+                        except Exception as exception:
+                            print str(exception)
+                            failures.append(f)
+                    scheduler.Flush()
+            failures += [f for f, surl in stager.failed]
+            print stager.Summary()
+            print scheduler.Summary()
+        else:
+            def Copy((surl, f)):
+                print 'Try copying ' + f.filename + ' to ' + srm
+                return f.CopySRM(srm, use_fts, False, ftsInt, surl)
+            results = ND280Comp.ParallelMap(Copy, sources, max_workers)
+            for (surl, f), result in zip(sources, results):
+                if isinstance(result, Exception):
+                    print str(result)
+                    failures.append(f)
+
+        for f in failures:
+            print 'SyncSRM Copy ' + f.filename + ' to srm: ' + srm + \
+                '  failed'
         if failures:
-            # Clean up FTS files
-            if use_fts and TRANSFER_FILE_LIST:
-                print 'Cleaning up FTS transfer files:'
-                for channel in TRANSFER_FILE_LIST:
-                    print 'Removing '+channel
-                    if os.path.exists(channel):
-                        os.remove(channel)
-                    TRANSFER_FILE_LIST.remove(channel)
-            raise self.Error('SyncSRM: Could not synchronise ' + str(failures)
-                             + ' files between ' + self.dir +
-                             ' and ' + str(srm))
+            raise self.Error('SyncSRM: Could not synchronise ' +
+                             str(len(failures)) + ' files between ' +
+                             self.dir + ' and ' + str(srm))
+        return plan
 
     def SyncND280Dir(self, new_dir, srm='', sync_pattern=''):
         """ Method to synchronise two ND280Dirs """
@@ -2110,7 +2123,8 @@ class ND280Dir(object):
                              str(failures) + ' files between ' +
                              self.dir + ' and ' + str(srm))
 
-    def NewSync(self, new_dir_name, fts_srm='', sync_pattern='', ftsInt=0):
+    def NewSync(self, new_dir_name, fts_srm='', sync_pattern='', ftsInt=0,
+                dry_run=False, max_workers=4, stripe=False):
         """ A generic sync
         new_dir_name=name of the directory to be copied to
         fts_srm= if new_dir_name is an srm
@@ -2119,13 +2133,17 @@ class ND280Dir(object):
                       it is used to specify an srm to copy to.
         sync_pattern=only copy files matching <sync_pattern>
         ftsInt=optional integer to include in FTS transfer-file name
+        dry_run=only print what would be copied to an srm
+        max_workers=replications to an srm run at once without FTS
+        stripe=copy to an srm from every SE holding the files
         """
 
         # If we are trying to synchronise with a surl
         # then over ride and use standard copying
         if 'srm://' in new_dir_name:
             srm = new_dir_name.split('/')[2]
-            self.SyncSRM(srm, fts_srm, sync_pattern, ftsInt)
+            self.SyncSRM(srm, fts_srm, sync_pattern, ftsInt, dry_run,
+                         max_workers, stripe)
         else:
             new_dir = ''
             try:
@@ -2137,6 +2155,51 @@ class ND280Dir(object):
             self.SyncND280Dir(new_dir, fts_srm, sync_pattern)
 
 
+def ProcessExecutable(jobtype, filetype):
+    """ The processing script of jobtype jobs on a file of filetype """
+    if filetype is 'c':
+        return 'ND280' + jobtype + '_testbeam.py'
+    return 'ND280' + jobtype + '_process.py'
+
+
+def ProcessArguments(nd280ver, jobtype, options):
+    """ The arguments of a processing script, up to the input file, for
+    the ND280JDL options dictionary """
+    arguments = '-v ' + nd280ver
+
+    if options['trigger'] and jobtype not in NONRUNND280JOBS:
+        arguments += ' -e ' + str(options['trigger'])
+
+    # Add optional arguments to line
+    if options['prod']:
+        arguments += ' -p ' + str(options['prod'])
+        arguments += ' -t ' + str(options['type'])
+    if options['modules']:
+        arguments += ' -m ' + str(options['modules'])
+    if options['dirs']:
+        arguments += ' -d ' + str(options['dirs'])
+    if options['config']:
+        arguments += " -c '" + str(options['config']) + "'"
+    if options['dbtime']:
+        arguments += ' -b ' + str(options['dbtime'])
+    if options['generator']:
+        arguments += ' -g ' + str(options['generator'])
+    if options['geometry']:
+        arguments += ' -a ' + str(options['geometry'])
+    if options['vertex']:
+        arguments += ' -y ' + str(options['vertex'])
+    if options['beam']:
+        arguments += ' -w ' + str(options['beam'])
+    if 'neutVersion' in options:
+        arguments += ' --neutVersion ' + options['neutVersion']
+    if 'POT' in options:
+        arguments += ' --POT ' + options['POT']
+    if 'highlandVersion' in options:
+        arguments += ' --highlandVersion '
+        arguments += options['highlandVersion']
+    return arguments
+
+
 class ND280JDL(object):
     """ A class that defines a JDL file for a t2k.org job.
     Each of the following must be defined,
@@ -2270,6 +2333,11 @@ the ND280COMPUTINGROOT environment variable, have you executed the setup.sh?')
                 jdlfile.write(' && '+self.regexp)
             jdlfile.write(';\n')
 
+            # DIRAC site(s) to run at, comma separated
+            if self.options.get('site'):
+                jdlfile.write('Site = {\"' + '\", \"'.join(
+                    self.options['site'].split(',')) + '\"};\n')
+
             # MyProxy server requirements
             if getenv('MYPROXY_SERVER'):
                 jdlfile.write('MyProxyServer = \"' +
@@ -2333,47 +2401,14 @@ the ND280COMPUTINGROOT environment variable, have you executed the setup.sh?')
                 append = self.input.filename.rstrip('.root').replace('.', '_')
                 self.jdlname += '_' + append
 
-        if self.input.filetype is 'c':
-            self.executable = 'ND280' + self.jobtype + '_testbeam.py'
-        elif self.input.filetype is 'p':
+        if self.input.filetype is 'p':
             self.jdlname += '_'.join(self.input.GetFileHash(),
                                      self.input.GetStage())
-            self.executable = 'ND280'+self.jobtype+'_process.py'
-        else:
-            self.executable = 'ND280'+self.jobtype+'_process.py'
+        self.executable = ProcessExecutable(self.jobtype,
+                                            self.input.filetype)
         self.jdlname += '.jdl'
-        self.arguments = '-v ' + self.nd280ver
-
-        if self.options['trigger'] and self.jobtype not in NONRUNND280JOBS:
-            self.arguments += ' -e ' + str(self.options['trigger'])
-
-        # Add optional arguments to line
-        if self.options['prod']:
-            self.arguments += ' -p ' + str(self.options['prod'])
-            self.arguments += ' -t ' + str(self.options['type'])
-        if self.options['modules']:
-            self.arguments += ' -m ' + str(self.options['modules'])
-        if self.options['dirs']:
-            self.arguments += ' -d ' + str(self.options['dirs'])
-        if self.options['config']:
-            self.arguments += " -c '" + str(self.options['config']) + "'"
-        if self.options['dbtime']:
-            self.arguments += ' -b ' + str(self.options['dbtime'])
-        if self.options['generator']:
-            self.arguments += ' -g ' + str(self.options['generator'])
-        if self.options['geometry']:
-            self.arguments += ' -a ' + str(self.options['geometry'])
-        if self.options['vertex']:
-            self.arguments += ' -y ' + str(self.options['vertex'])
-        if self.options['beam']:
-            self.arguments += ' -w ' + str(self.options['beam'])
-        if 'neutVersion' in self.options:
-            self.arguments += ' --neutVersion ' + self.options['neutVersion']
-        if 'POT' in self.options:
-            self.arguments += ' --POT ' + self.options['POT']
-        if 'highlandVersion' in self.options:
-            self.arguments += ' --highlandVersion '
-            self.arguments += self.options['highlandVersion']
+        self.arguments = ProcessArguments(self.nd280ver, self.jobtype,
+                                          self.options)
 
         # Tools directory and the chosen executable are automatically
         # included in InputSandbox
@@ -2411,7 +2446,7 @@ class ND280JID(object):
     ~/GRIDTest/ND280Install/middle_processing/standard/CheckRunND280RunsStatus.py
     """
 
-    def __init__(self, jidfile, jobno=''):
+    def __init__(self, jidfile, jobno='', status=None):
         self.jidfilename = jidfile
         self.jobno = jobno  # this is the nth job in the file
 
@@ -2423,6 +2458,13 @@ class ND280JID(object):
         self.dest = str()
         self.jobid = str()
 
+        # (jobid, status, minor status, site) already looked up, e.g. by
+        # ND280JIDResolver, so no need to ask DIRAC again
+        if status is not None:
+            self.jobid, self.status, self.statusreason, self.dest = status
+            self.exitcode = '0'
+            return
+
         """ Sophie KING
         dirac has different status output format
         so need to modify all this dirac doest not
@@ -2538,18 +2580,21 @@ MinorStatus=(.*?); Site=(.*?);', jobStatus, re.M | re.I)
 
     def GetRunNo(self):
         """ Get run number from standard format files """
-        # return self.jidfilename.split('_')[2]
-        return self.jidfilename.split('_')[3]
+        record = ND280NameParser.ParseFileName(self.jidfilename)
+        return ND280NameParser.FormatRun(record.run)
 
     def GetSubRunNo(self):
         """ Get run number from standard format files """
-        # return self.jidfilename.split('_')[3].split('.')[0]
-        return self.jidfilename.split('_')[4].split('.')[0]
+        record = ND280NameParser.ParseFileName(self.jidfilename)
+        return ND280NameParser.FormatSubrun(record.subrun)
 
     def GetOutput(self):
         """ Get the output sandbox """
-        outdir = self.jidfilename.replace('.jid', '_' + self.jobno)
-        command = 'dirac-wms-job-get-output -f ' + self.jidfilename
+        outdir = self.jidfilename.replace('.jid', '_' + str(self.jobno))
+        if self.jobid:
+            command = 'dirac-wms-job-get-output ' + self.jobid
+        else:
+            command = 'dirac-wms-job-get-output -f ' + self.jidfilename
         command += ' --Dir ' + outdir
         lines, errors = ND280Comp.GetListPopenCommand(command)
 
@@ -2583,3 +2628,124 @@ MinorStatus=(.*?); Site=(.*?);', jobStatus, re.M | re.I)
             return True
         else:
             return False
+
+
+class ND280JIDResolver(object):
+    """
+    Resolves the status of many jid files or DIRAC job IDs at once, with
+    a dirac-wms-job-status call per chunk of job IDs (max_workers calls
+    at once) instead of one per jid file, and returns ND280JID objects
+    built from the combined output. Statuses are cached for ttl seconds
+    ($ND280JIDCACHETTL, default 5 minutes) in $ND280JIDCACHE
+    (~/.nd280/jid_cache.json), so scripts run in the same cron cycle do
+    not ask again; ttl=0 turns the cache off.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, chunk=500, max_workers=8, ttl=None, cache=''):
+        self.chunk = chunk
+        self.max_workers = max_workers
+        if ttl is None:
+            ttl = float(getenv('ND280JIDCACHETTL', 5*StatusWait.kMinute))
+        self.ttl = ttl
+        self.cache = cache or getenv('ND280JIDCACHE',
+                                     join(os.path.expanduser('~'), '.nd280',
+                                          'jid_cache.json'))
+        self.nQueries = 0
+        self.nCached = 0
+
+    def JobIDs(self, jidfile):
+        """the DIRAC job IDs in a jid file, oldest first"""
+        try:
+            with open(jidfile) as jids:
+                return [line.strip() for line in jids
+                        if line.strip().isdigit()]
+        except IOError:
+            return list()
+
+    def Load(self):
+        """{jobid: [status, minor status, site, time]} of the fresh cache
+        entries"""
+        if not self.ttl:
+            return dict()
+        try:
+            with open(self.cache) as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, ValueError):
+            return dict()
+        now = time.time()
+        return dict((str(jobid), entry) for jobid, entry in
+                    cached.iteritems() if now - entry[3] < self.ttl)
+
+    def Save(self, cached):
+        """write the cache, through a temporary file so that a reader
+        never sees half a file"""
+        if not self.ttl:
+            return
+        directory = os.path.dirname(self.cache) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temporary = tempfile.mkstemp(dir=directory)
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump(cached, cache_file)
+            os.rename(temporary, self.cache)
+        except (IOError, OSError) as exception:
+            print 'Could not save the job status cache to %s: %s' % \
+                (self.cache, exception)
+
+    def Statuses(self, jobids):
+        """{jobid: (status, minor status, site)} of jobids, those DIRAC
+        does not know are left out"""
+        cached = self.Load()
+        todo = sorted(set(jobid for jobid in jobids if jobid not in cached))
+        self.nCached += len(set(jobids)) - len(todo)
+        chunks = [todo[first:first + self.chunk]
+                  for first in range(0, len(todo), self.chunk)]
+        results = ND280Comp.ParallelMap(ND280JobStore.QueryJobStatus, chunks,
+                                        self.max_workers)
+        self.nQueries += len(chunks)
+        now = time.time()
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                print 'Could not get the status of %d jobs: %s' % \
+                    (len(chunk), result)
+                continue
+            for jobid, (status, minor, site) in result.iteritems():
+                cached[jobid] = [status, minor, site, now]
+        if todo:
+            self.Save(cached)
+        return dict((jobid, tuple(cached[jobid][:3])) for jobid in jobids
+                    if jobid in cached)
+
+    def Resolve(self, items, jobno=''):
+        """an ND280JID for each jid file or job ID of items (the jobno-th
+        job of a jid file, the latest by default), None for those with no
+        known job"""
+        chosen = list()
+        for item in items:
+            item = item.strip()
+            if item.isdigit():
+                chosen.append((item, '', 1))
+                continue
+            jobids = self.JobIDs(item)
+            if not jobids:
+                chosen.append((None, item, 0))
+                continue
+            index = len(jobids)
+            if jobno and int(jobno) <= len(jobids):
+                index = int(jobno)
+            chosen.append((jobids[index - 1], item, index))
+
+        statuses = self.Statuses([each[0] for each in chosen if each[0]])
+        jids = list()
+        for jobid, jidfile, index in chosen:
+            if jobid not in statuses:
+                jids.append(None)
+                continue
+            jids.append(ND280JID(jidfile, index,
+                                 (jobid,) + statuses[jobid]))
+        return jids
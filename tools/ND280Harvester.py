@@ -0,0 +1,379 @@
+#!/usr/bin/env python2
+"""
+Harvesting and resubmission of failed FTS transfers.
+
+FailureHarvester reads the FTS job IDs in $ND280TRANSFERS/transfers.*.log
+and fetches the state of every file of every job from the FTS REST
+interface, ChannelMonitor.kJobsPerQuery jobs per query with at most
+max_workers queries at a time. Failed files are sorted by their reason:
+
+    source missing      the source does not exist (the GetListOfDuds duds)
+    timeout             the transfer, or the staging of the source, timed out
+    destination full    no space left at the destination
+    other               anything else
+    canceled            cancelled by hand, never retried
+
+Retryable failures are added to the shared TransferScheduler again once a
+backoff, doubling with every attempt, has passed, so they go out batched
+like any other transfer, until a file has failed max_attempts times.
+Missing sources go to the dud list $ND280TRANSFERS/duds.log instead.
+The retries waiting are kept in $ND280TRANSFERS/harvest.json so that a
+harvester that is restarted carries on where the last one stopped.
+
+Jobs that are over are written to the completed and failures logs as
+RemoveFailedFTS.py did, and taken out of the transfer logs. The size and
+duration of every finished file are passed to the replica selector, so
+the throughput seen by FTS from each SE is used in choosing sources.
+"""
+
+from datetime import date
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280Replicas
+import ND280Transfers
+from ND280Transfers import fts3_active_list, fts3_failed_list, \
+    fts3_finished_list
+
+# Failure classes
+kSourceMissing = 'source missing'
+kTimeout = 'timeout'
+kDestinationFull = 'destination full'
+kOther = 'other'
+kCanceled = 'canceled'
+
+# Pieces of FTS reasons, in lower case, for each class checked in order
+REASONS = [
+    (kSourceMissing, ("source file doesn't exist", 'no such file',
+                      'does not exist', 'file not found', 'enoent')),
+    (kDestinationFull, ('no space left', 'enospc', 'not enough space',
+                        'quota exceeded', 'space token is full')),
+    (kTimeout, ('timeout', 'timed out', 'etimedout')),
+]
+
+# Backoff of the first retry of each class, in seconds
+BACKOFF = {kTimeout: 10*StatusWait.kMinute,
+           kDestinationFull: 2*StatusWait.kHour,
+           kOther: 30*StatusWait.kMinute}
+MAX_BACKOFF = StatusWait.kDay
+
+
+def Classify(reason):
+    """the failure class of an FTS reason"""
+    lower = reason.lower()
+    for kind, pieces in REASONS:
+        for piece in pieces:
+            if piece not in lower:
+                continue
+            # a missing directory at the destination is not a dud
+            if kind == kSourceMissing and \
+                    lower.lstrip().startswith('destination'):
+                continue
+            return kind
+    return kOther
+
+
+def Backoff(kind, attempts):
+    """seconds before retry number attempts of a failure of class kind"""
+    return min(BACKOFF.get(kind, BACKOFF[kOther]) * 2**max(attempts - 1, 0),
+               MAX_BACKOFF)
+
+
+class FailureHarvester(object):
+    """
+    Finds failed transfers in the FTS jobs of the transfer logs and
+    resubmits or gives up on them. With resubmit off failures are only
+    classified and logged. monitor is the ChannelMonitor whose REST
+    endpoint is queried, scheduler the TransferScheduler retries go to.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, transfer_dir='', max_workers=8, max_attempts=5,
+                 resubmit=True, monitor=None, scheduler=None):
+        self.transfer_dir = transfer_dir or ND280Transfers.GetTransferDir()
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.resubmit = resubmit
+        self.monitor = monitor or ND280Transfers.GetChannelMonitor()
+        self.scheduler = scheduler
+        self.state_path = os.path.join(self.transfer_dir, 'harvest.json')
+        self.dud_path = os.path.join(self.transfer_dir, 'duds.log')
+        self.retries = dict()
+        self.Load()
+
+        # for the summary
+        self.nJobs = 0
+        self.nFailed = dict()
+        self.nRetried = 0
+        self.nGivenUp = 0
+        self.nDuds = 0
+
+    # Saved retries
+    def Load(self):
+        """read the retries waiting, keyed by destination"""
+        try:
+            with open(self.state_path) as state_file:
+                self.retries = dict((str(dest), retry) for dest, retry in
+                                    json.load(state_file).iteritems())
+        except (IOError, ValueError):
+            self.retries = dict()
+
+    def Save(self):
+        """write the retries, through a temporary file"""
+        handle, temporary = tempfile.mkstemp(dir=self.transfer_dir)
+        with os.fdopen(handle, 'w') as state_file:
+            json.dump(self.retries, state_file, indent=1, sort_keys=True)
+        os.rename(temporary, self.state_path)
+
+    # Querying FTS
+    def TransferLogs(self):
+        """{transfer log: [job IDs]}"""
+        logs = dict()
+        pattern = os.path.join(self.transfer_dir, 'transfers.*.log')
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as log:
+                logs[path] = [line.strip() for line in log if line.strip()]
+        return logs
+
+    def Fetch(self, job_ids):
+        """{job ID: job} for a chunk of job IDs, None for jobs FTS no
+        longer knows. Jobs FTS could not answer for are left out, so
+        they stay in the transfer logs for the next pass"""
+        try:
+            replies = self.monitor.Curl('/jobs/%s?files=file_state,'
+                                        'source_surl,dest_surl,reason,'
+                                        'filesize,tx_duration' %
+                                        ','.join(job_ids))
+        except ND280Transfers.ChannelMonitor.NotFound:
+            # FTS answers a single job ID with a plain 404 once it is
+            # purged, several with a list giving each job's http_status
+            if len(job_ids) != 1:
+                raise
+            return {job_ids[0]: None}
+        if isinstance(replies, dict):
+            replies = [replies]
+        jobs = dict()
+        for job in replies:
+            job_id = str(job.get('job_id', ''))
+            if job_id not in job_ids:
+                continue
+            status = str(job.get('http_status') or '200')
+            if status.startswith('200'):
+                jobs[job_id] = job
+            elif status.startswith('404'):
+                jobs[job_id] = None
+            else:
+                print 'Could not query FTS job %s: %s' % (job_id, status)
+        return jobs
+
+    def Query(self, job_ids):
+        """{job ID: job or None} for every job ID that could be queried"""
+        chunk = ND280Transfers.ChannelMonitor.kJobsPerQuery
+        chunks = [job_ids[i:i + chunk] for i in xrange(0, len(job_ids), chunk)]
+        jobs = dict()
+        for result in ND280Computing.ParallelMap(self.Fetch, chunks,
+                                                 self.max_workers):
+            if isinstance(result, Exception):
+                print str(result)
+                continue
+            jobs.update(result)
+        return jobs
+
+    # Sorting out the failures
+    def Finished(self, entry):
+        """learn the throughput from the source of a finished file"""
+        size = float(entry.get('filesize') or 0)
+        duration = float(entry.get('tx_duration') or 0)
+        if size > 0 and duration > 0:
+            ND280Replicas.GetReplicaSelector().Record(
+                str(entry['source_surl']), size, duration, True, save=False)
+
+    def Failed(self, job_id, entry, kind, failures):
+        """decide what to do with a failed file, returns True if it is
+        a dud"""
+        source = str(entry['source_surl'])
+        dest = str(entry['dest_surl'])
+        reason = str(entry.get('reason') or '').strip()
+        self.nFailed[kind] = self.nFailed.get(kind, 0) + 1
+        failures.write('%s: %s\n' % (job_id, reason))
+        failures.write('class:      %s\n' % kind)
+        failures.write('source:     %s\n' % source)
+        failures.write('destination:%s\n\n' % dest)
+        if kind == kSourceMissing:
+            self.retries.pop(dest, None)
+            return True
+        if not self.resubmit or kind == kCanceled:
+            return False
+
+        retry = self.retries.get(dest, {'attempts': 0})
+        retry.update({'source': source, 'dest': dest, 'kind': kind,
+                      'reason': reason, 'submitted': False,
+                      'size': int(entry.get('filesize') or 0)})
+        retry['attempts'] += 1
+        if retry['attempts'] > self.max_attempts:
+            print 'Giving up on %s after %d attempts' % (dest,
+                                                         self.max_attempts)
+            self.retries.pop(dest, None)
+            self.nGivenUp += 1
+            return False
+        retry['due'] = time.time() + Backoff(kind, retry['attempts'])
+        self.retries[dest] = retry
+        return False
+
+    def Harvest(self):
+        """one pass over the transfer logs, returns the number of
+        failed files found"""
+        logs = self.TransferLogs()
+        job_ids = sorted(set(job_id for ids in logs.itervalues()
+                             for job_id in ids))
+        print 'Querying %d FTS jobs' % len(job_ids)
+        jobs = self.Query(job_ids)
+
+        datestring = date.today().isoformat().replace('-', '')
+        over = set()
+        duds = list()
+        nfailed = 0
+        failures = open(self.LogPath('failures', datestring), 'a')
+        completed = open(self.LogPath('completed', datestring), 'a')
+        try:
+            for job_id in job_ids:
+                if job_id not in jobs:
+                    continue
+                job = jobs[job_id]
+                if job is None:
+                    print job_id + ' no longer on FTS queue'
+                    completed.write(job_id + ': Completed\n')
+                    over.add(job_id)
+                    continue
+                if str(job.get('job_state', '')).capitalize() in \
+                        fts3_active_list:
+                    continue
+                counts = [0, 0, 0]
+                for entry in job.get('files', list()):
+                    state = str(entry.get('file_state', '')).capitalize()
+                    dest = str(entry.get('dest_surl', ''))
+                    if state in fts3_finished_list:
+                        counts[2] += 1
+                        self.retries.pop(dest, None)
+                        self.Finished(entry)
+                    elif state in fts3_failed_list:
+                        counts[1] += 1
+                        kind = kCanceled if state == 'Canceled' else \
+                            Classify(str(entry.get('reason') or ''))
+                        if self.Failed(job_id, entry, kind, failures):
+                            duds.append(str(entry['source_surl']))
+                    else:
+                        counts[0] += 1
+                print '%4d active, %4d finished and %4d failed files in %s' \
+                    % (counts[0], counts[2], counts[1], job_id)
+                completed.write('%s: %s\n' % (job_id, job.get('job_state')))
+                nfailed += counts[1]
+                over.add(job_id)
+        finally:
+            failures.close()
+            completed.close()
+
+        self.nJobs += len(over)
+        ND280Replicas.GetReplicaSelector().Save()
+        self.RemoveJobs(logs, over)
+        self.AddDuds(duds)
+        if self.resubmit:
+            self.Resubmit()
+            self.Save()
+        return nfailed
+
+    def LogPath(self, kind, datestring):
+        """the failures or completed log of a day, as RemoveFailedFTS
+        kept them"""
+        directory = os.path.join(self.transfer_dir, kind)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return os.path.join(directory, '%s.%s.log' % (kind, datestring))
+
+    def RemoveJobs(self, logs, over):
+        """take the jobs that are over out of the transfer logs, locked
+        against the TransferScheduler appending to them"""
+        today = 'transfers.%s.log' % \
+            date.today().isoformat().replace('-', '')
+        for path, job_ids in logs.iteritems():
+            if not over.intersection(job_ids):
+                continue
+            with open(path, 'r+') as log:
+                fcntl.flock(log, fcntl.LOCK_EX)
+                kept = [line for line in log if line.strip() and
+                        line.strip() not in over]
+                log.seek(0)
+                log.truncate()
+                log.writelines(kept)
+            # today's log may still be appended to
+            if not kept and os.path.basename(path) != today:
+                print 'Removing empty log file: ' + path
+                os.remove(path)
+
+    def AddDuds(self, sources):
+        """add sources to the dud list"""
+        if not sources:
+            return
+        known = set()
+        if os.path.exists(self.dud_path):
+            with open(self.dud_path) as dud_file:
+                known = set(line.strip() for line in dud_file)
+        new = sorted(set(sources) - known)
+        with open(self.dud_path, 'a') as dud_file:
+            dud_file.writelines(source + '\n' for source in new)
+        self.nDuds += len(new)
+        print '%d new duds in %s' % (len(new), self.dud_path)
+
+    # Resubmission
+    def Resubmit(self):
+        """queue every retry whose backoff is over, and submit them"""
+        now = time.time()
+        due = [retry for retry in self.retries.itervalues()
+               if not retry['submitted'] and retry['due'] <= now]
+        if not due:
+            return
+        scheduler = self.scheduler or ND280Transfers.GetTransferScheduler()
+        for retry in due:
+            try:
+                scheduler.Add(str(retry['source']), str(retry['dest']),
+                              retry['size'])
+            except scheduler.Error as exception:
+                print str(exception)
+                self.retries.pop(retry['dest'], None)
+                continue
+            retry['submitted'] = True
+            self.nRetried += 1
+        print 'Retrying %d transfers' % len(due)
+        scheduler.Flush()
+
+    def Waiting(self):
+        """the number of retries waiting for their backoff"""
+        return len([retry for retry in self.retries.itervalues()
+                    if not retry['submitted']])
+
+    def Run(self, interval=10*StatusWait.kMinute):
+        """harvest every interval seconds, for ever"""
+        while True:
+            try:
+                self.Harvest()
+            except (IOError, OSError, self.Error) as exception:
+                print 'Harvest failed: %s' % exception
+            print self.Summary()
+            time.sleep(interval)
+
+    def Summary(self):
+        failed = ', '.join('%d %s' % (count, kind) for kind, count in
+                           sorted(self.nFailed.iteritems()))
+        return '%d FTS jobs harvested, failures: %s, %d retried, ' \
+            '%d waiting, %d given up, %d duds' % \
+            (self.nJobs, failed or 'none', self.nRetried, self.Waiting(),
+             self.nGivenUp, self.nDuds)
@@ -27,6 +27,7 @@ from ND280GRID import runLCG
 from ND280Configs import ND280Config
 from ND280Software import ND280Software
 import ND280DIRACAPI as ND280DIRAC
+import ND280NameParser
 
 
 class ND280Job(object):
@@ -358,7 +359,7 @@ class ND280Job(object):
         # Create a file dictionary of {stage:filename}
         filedict = {}
         for f in rootfiles:
-            filedict[f.split('_')[5]] = f
+            filedict[ND280NameParser.ParseFileName(f).stage] = f
 
         # Check that all the files to upload are present
         filetags = filedict.keys()
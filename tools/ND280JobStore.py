@@ -0,0 +1,331 @@
+#!/usr/bin/env python2
+"""
+A local SQLite store of the state of grid jobs.
+
+JobStore keeps one row per DIRAC job ID with the .jid file it came from,
+its input LFN, run and subrun, site, status, minor status, timestamps
+and attempt number (its position in the .jid file, resubmissions append
+to it), and every state transition a refresh has seen. Instead of
+re-reading every .jid file and re-querying every job on each run
+
+    ScanJIDFiles()  only reads .jid files that changed since the last scan
+    Refresh()       only queries the latest attempt of jobs that are not
+                    Done, Failed, Killed or Deleted, with bulk
+                    dirac-wms-job-status calls of batch IDs run
+                    max_workers at once
+
+and the running/waiting/failed/ok lists of GetJobStatus.py are queries
+(Jobs(), WriteLists()). Old gLite job URLs in .jid files are ignored.
+"""
+
+from collections import namedtuple
+import os
+from os import getenv
+import re
+import sqlite3
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280NameParser
+
+# DIRAC job states that do not change any more
+TERMINAL = ('Done', 'Failed', 'Killed', 'Deleted')
+
+# The classes of the GetJobStatus lists
+kOK = 'ok'
+kFailed = 'failed'
+kRunning = 'running'
+kWaiting = 'waiting'
+kCleared = 'cleared'
+kUnclear = 'unclear'
+
+CLASSES = {
+    'Done': kOK,
+    'Failed': kFailed,
+    'Running': kRunning, 'Completing': kRunning, 'Completed': kRunning,
+    'Received': kWaiting, 'Checking': kWaiting, 'Staging': kWaiting,
+    'Waiting': kWaiting, 'Matched': kWaiting, 'Submitting': kWaiting,
+    'Rescheduled': kWaiting,
+    'Cleared': kCleared,
+}
+
+# Sites of jobs DIRAC has not matched yet
+UNASSIGNED = ('', 'ANY', 'Multiple', 'Unknown')
+
+# One job, times are seconds since the epoch
+JobRecord = namedtuple('JobRecord', ['jobid', 'jidfile', 'input', 'run',
+                                     'subrun', 'site', 'status', 'minor',
+                                     'submitted', 'updated', 'attempt'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    jobid     TEXT PRIMARY KEY,
+    jidfile   TEXT,
+    input     TEXT,
+    run       INTEGER,
+    subrun    INTEGER,
+    site      TEXT,
+    status    TEXT,
+    minor     TEXT,
+    submitted REAL,
+    updated   REAL,
+    attempt   INTEGER,
+    current   INTEGER
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    jobid  TEXT,
+    status TEXT,
+    minor  TEXT,
+    site   TEXT,
+    time   REAL
+);
+CREATE TABLE IF NOT EXISTS jidfiles (
+    path  TEXT PRIMARY KEY,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_jidfile ON jobs (jidfile);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS transitions_jobid ON transitions (jobid);
+"""
+
+# JobID=5344779 Status=Done; MinorStatus=Execution Complete; Site=LCG.X.uk;
+STATUS_REGEX = re.compile(r'JobID=(\d+) Status=(.*?); MinorStatus=(.*?); '
+                          r'Site=(.*?);')
+
+
+def Classify(status):
+    """the GetJobStatus list a DIRAC status belongs in"""
+    return CLASSES.get(status, kUnclear)
+
+
+def ParseJobStatus(lines):
+    """{jobid: (status, minor status, site)} from dirac-wms-job-status"""
+    statuses = dict()
+    for line in lines:
+        match = STATUS_REGEX.search(line)
+        if match:
+            jobid, status, minor, site = match.groups()
+            statuses[jobid] = (status, minor, site)
+    return statuses
+
+
+def QueryJobStatus(jobids, executor=None):
+    """{jobid: (status, minor status, site)} of jobids from one
+    dirac-wms-job-status call"""
+    executor = executor or ND280Computing.GetRetryPolicy()
+    result = executor.Run('dirac-wms-job-status ' + ' '.join(jobids),
+                          StatusWait.kTimeout)
+    statuses = ParseJobStatus(result.lines)
+    # unknown job IDs fail the command but not the others
+    if result.timedout or (result.returncode != 0 and not statuses):
+        raise JobStore.Error('dirac-wms-job-status failed: ' +
+                             ' '.join(result.errors).strip())
+    return statuses
+
+
+def RawInput(jidfile):
+    """the raw data LFN a processing .jid file ran on"""
+    record = ND280NameParser.ParseFileName(jidfile)
+    if record.run < 0:
+        return ''
+    return 'lfn:/grid/t2k.org/nd280/raw/ND280/ND280/' + \
+        ND280NameParser.FormatRunRange(record.run) + '/' + \
+        ND280NameParser.FormatRawName(record.run, record.subrun)
+
+
+class JobStore(object):
+    """
+    The SQLite job-state store. Refreshes query from worker threads but
+    write from the calling thread, so one connection is shared by every
+    method.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, dbpath=''):
+        self.dbpath = dbpath or getenv('ND280JOBSTORE', 'jobs.db')
+        self.db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+        self.nQueries = 0
+        self.nChanged = 0
+
+    def Close(self):
+        """close the database"""
+        self.db.close()
+
+    # .jid files
+    def ScanJIDFiles(self, paths, input_of=RawInput):
+        """add the jobs of the .jid files that changed since the last
+        scan, input_of gives the input LFN of a .jid file. Returns the
+        number of new jobs"""
+        stored = dict(self.db.execute('SELECT path, mtime FROM jidfiles'))
+        nNew = 0
+        for path in paths:
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path) as jidfile:
+                    jobids = [line.strip() for line in jidfile
+                              if line.strip().isdigit()]
+            except (IOError, OSError):
+                # removed while being resubmitted
+                continue
+            if stored.get(path) == mtime:
+                continue
+            self.db.execute('INSERT OR REPLACE INTO jidfiles VALUES (?, ?)',
+                            (path, mtime))
+            if not jobids:
+                continue
+
+            known = set(row[0] for row in self.db.execute(
+                'SELECT jobid FROM jobs WHERE jidfile = ?', (path,)))
+            record = ND280NameParser.ParseFileName(path)
+            lfn = input_of(path) if input_of else ''
+            for attempt, jobid in enumerate(jobids):
+                if jobid in known:
+                    continue
+                self.db.execute('INSERT OR REPLACE INTO jobs VALUES '
+                                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                                (jobid, path, lfn, record.run,
+                                 record.subrun, '', '', '', mtime, mtime,
+                                 attempt + 1))
+                nNew += 1
+            self.db.execute('UPDATE jobs SET current = (jobid = ?) '
+                            'WHERE jidfile = ?', (jobids[-1], path))
+        self.db.commit()
+        return nNew
+
+    # Status
+    def Active(self):
+        """the job IDs of the latest attempts that are not finished"""
+        return [row[0] for row in self.db.execute(
+            'SELECT jobid FROM jobs WHERE current = 1 AND status NOT IN '
+            '(%s) ORDER BY jobid' % ', '.join('?' * len(TERMINAL)),
+            TERMINAL)]
+
+    def Query(self, jobids, executor=None):
+        """{jobid: (status, minor status, site)} from one
+        dirac-wms-job-status call"""
+        return QueryJobStatus(jobids, executor)
+
+    def Update(self, statuses, now=None):
+        """store statuses, recording the jobs whose state changed"""
+        now = now or time.time()
+        nChanged = 0
+        for jobid, (status, minor, site) in statuses.iteritems():
+            row = self.db.execute('SELECT status, minor, site FROM jobs '
+                                  'WHERE jobid = ?', (jobid,)).fetchone()
+            if row is None or tuple(row) == (status, minor, site):
+                continue
+            self.db.execute('UPDATE jobs SET status = ?, minor = ?, '
+                            'site = ?, updated = ? WHERE jobid = ?',
+                            (status, minor, site, now, jobid))
+            self.db.execute('INSERT INTO transitions VALUES (?, ?, ?, ?, ?)',
+                            (jobid, status, minor, site, now))
+            nChanged += 1
+        self.db.commit()
+        self.nChanged += nChanged
+        return nChanged
+
+    def Refresh(self, max_workers=8, batch=500, executor=None):
+        """query the unfinished jobs, batch IDs per call and max_workers
+        calls at once. Returns the number of jobs whose state changed"""
+        active = self.Active()
+        batches = [active[first:first + batch]
+                   for first in range(0, len(active), batch)]
+        results = ND280Computing.ParallelMap(
+            lambda jobids: self.Query(jobids, executor), batches,
+            max_workers)
+        self.nQueries += len(batches)
+        statuses = dict()
+        for jobids, result in zip(batches, results):
+            if isinstance(result, Exception):
+                print 'Could not get the status of %d jobs: %s' % \
+                    (len(jobids), result)
+                continue
+            statuses.update(result)
+        return self.Update(statuses)
+
+    # Queries
+    def Jobs(self, jidfiles=None, status_class=None):
+        """JobRecords of the latest attempt of every job (of jidfiles),
+        in the list status_class if given"""
+        jobs = [JobRecord(*row) for row in self.db.execute(
+            'SELECT jobid, jidfile, input, run, subrun, site, status, minor, '
+            'submitted, updated, attempt FROM jobs WHERE current = 1 '
+            'ORDER BY jidfile')]
+        if jidfiles is not None:
+            jidfiles = set(jidfiles)
+            jobs = [job for job in jobs if job.jidfile in jidfiles]
+        if status_class:
+            jobs = [job for job in jobs
+                    if Classify(job.status) == status_class]
+        return jobs
+
+    def Backlog(self):
+        """{site: number of latest attempts waiting or running there}, the
+        jobs DIRAC has not matched to a site yet (or not been asked about)
+        are under 'ANY'"""
+        backlog = dict()
+        for site, status in self.db.execute(
+                'SELECT site, status FROM jobs WHERE current = 1 AND '
+                'status NOT IN (%s)' % ', '.join('?' * len(TERMINAL)),
+                TERMINAL):
+            if status and Classify(status) not in (kRunning, kWaiting):
+                continue
+            site = site if site not in UNASSIGNED else 'ANY'
+            backlog[site] = backlog.get(site, 0) + 1
+        return backlog
+
+    def Sites(self, now=None):
+        """the sites jobs have finished or are running at, less those
+        banned now"""
+        statuses = [status for status, name in CLASSES.iteritems()
+                    if name in (kOK, kRunning)]
+        sites = set(row[0] for row in self.db.execute(
+            'SELECT DISTINCT site FROM jobs WHERE status IN (%s)' %
+            ', '.join('?' * len(statuses)), statuses)
+                    if row[0] not in UNASSIGNED)
+        return sorted(sites - set(self.Banned(now)))
+
+    def Banned(self, now=None):
+        """the sites ND280Resubmit has banned until after now, if it has
+        been run on this store"""
+        if not self.db.execute('SELECT name FROM sqlite_master WHERE '
+                               'type = ? AND name = ?',
+                               ('table', 'bans')).fetchone():
+            return list()
+        return sorted(row[0] for row in self.db.execute(
+            'SELECT DISTINCT site FROM bans WHERE until > ?',
+            (now or time.time(),)))
+
+    def Transitions(self, jobid):
+        """(status, minor status, site, time) of every state job went
+        through"""
+        return [tuple(row) for row in self.db.execute(
+            'SELECT status, minor, site, time FROM transitions WHERE '
+            'jobid = ? ORDER BY time', (jobid,))]
+
+
+def WriteLists(jobs, filenames):
+    """write the input LFN of jobs to the list of their class, filenames
+    is {class: list file}; the 'failed_ce' list gets the site too.
+    Returns {class: number of jobs}"""
+    outputs = dict((name, open(filename, 'w'))
+                   for name, filename in filenames.iteritems())
+    counts = dict((name, 0) for name in filenames)
+    try:
+        for job in jobs:
+            name = Classify(job.status)
+            counts[name] = counts.get(name, 0) + 1
+            if name in outputs:
+                outputs[name].write(job.input + '\n')
+            if name == kFailed and 'failed_ce' in outputs:
+                outputs['failed_ce'].write(job.site + ' ' + job.input + '\n')
+    finally:
+        for output in outputs.itervalues():
+            output.close()
+    return counts
@@ -0,0 +1,216 @@
+#!/usr/bin/env python2
+"""
+One place to parse ND280 file names.
+
+Raw, testbeam, processed/MC (oa_*), hadded and job ID (.jid) names are
+matched with precompiled regular expressions into compact FileNameRecords.
+ParseFileNames parses a whole list in one call into FileNameColumns, column
+arrays that can be sorted, grouped by run range and compared as sets
+without touching the names again. The columns are numpy arrays when numpy
+is available and plain lists otherwise.
+
+    nd280_00003998_0000.daq.mid.gz                                 raw
+    dsecal_00000123_0001.daq.mid                                   testbeam
+    oa_nd_spl_00004001-0019_4ofazjmx7xsr_reco_000_v11r31.root      processed
+    oa_nt_beam_90210000-0000_dxf44iaxt3e7_numc_000_prod6amagnet.root   MC
+    nd280.rdp.00004000_00004999.anal.00004001-0000-00004001-0019.hadded.root
+    ND280Raw_spill_v11r31_00004001_0019.jid                        jid
+"""
+
+from collections import namedtuple
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# File kinds, the same letters as ND280File.filetype
+kRaw = 'r'
+kTestbeam = 'c'
+kProcessed = 'p'
+kMC = 'm'
+kHadded = 'h'
+kJID = 'j'
+kOther = 'o'
+
+FileNameRecord = namedtuple('FileNameRecord',
+                            ['name', 'kind', 'run', 'subrun', 'stage',
+                             'hash', 'version', 'comment', 'prefix',
+                             'lastrun', 'lastsubrun'])
+
+RAW_REGEX = re.compile(r'^(?P<prefix>nd280|dsecal)_(?P<run>\d+)_'
+                       r'(?P<subrun>\d+)\.')
+# timeslip files use run_subrun rather than run-subrun
+OA_REGEX = re.compile(r'^(?P<prefix>oa_(?P<oatype>[a-z]{2})_[^_]+)_'
+                      r'(?P<run>\d+)[-_](?P<subrun>\d+)_(?P<hash>[^_]+)_'
+                      r'(?P<stage>[^_]+)_(?P<version>[^_]+)_'
+                      r'(?P<comment>[^.]*)')
+HADDED_REGEX = re.compile(r'^(?P<prefix>.*?)\.?(?P<run>\d{8})-'
+                          r'(?P<subrun>\d{4})-(?P<lastrun>\d{8})-'
+                          r'(?P<lastsubrun>\d{4})\.hadded\.root$')
+JID_REGEX = re.compile(r'^(?P<prefix>.+)_(?P<run>\d+)_(?P<subrun>\d+)\.jid$')
+
+# oa_<type>_ of MC files
+MC_TYPES = ('nt', 'gn')
+
+
+def BaseName(name):
+    """the file name without any directory or lfn: prefix"""
+    return name.strip().rstrip('/').split('/')[-1]
+
+
+def ParseFileName(name):
+    """parse a single file name (or path) into a FileNameRecord,
+    unparsed fields are '' and run/subrun are -1"""
+    name = BaseName(name)
+
+    match = OA_REGEX.match(name)
+    if match:
+        kind = kProcessed
+        if match.group('oatype') in MC_TYPES:
+            kind = kMC
+        return FileNameRecord(name, kind, int(match.group('run')),
+                              int(match.group('subrun')),
+                              match.group('stage'), match.group('hash'),
+                              match.group('version'), match.group('comment'),
+                              match.group('prefix'), -1, -1)
+
+    match = RAW_REGEX.match(name)
+    if match:
+        kind = kRaw
+        if match.group('prefix') == 'dsecal':
+            kind = kTestbeam
+        return FileNameRecord(name, kind, int(match.group('run')),
+                              int(match.group('subrun')), '', '', '', '',
+                              match.group('prefix'), -1, -1)
+
+    match = HADDED_REGEX.match(name)
+    if match:
+        return FileNameRecord(name, kHadded, int(match.group('run')),
+                              int(match.group('subrun')), '', '', '', '',
+                              match.group('prefix'),
+                              int(match.group('lastrun')),
+                              int(match.group('lastsubrun')))
+
+    match = JID_REGEX.match(name)
+    if match:
+        return FileNameRecord(name, kJID, int(match.group('run')),
+                              int(match.group('subrun')), '', '', '', '',
+                              match.group('prefix'), -1, -1)
+
+    return FileNameRecord(name, kOther, -1, -1, '', '', '', '', '', -1, -1)
+
+
+def FormatRun(run):
+    """run number padded to 8 digits"""
+    return '%08d' % int(run)
+
+
+def FormatSubrun(subrun):
+    """subrun number padded to 4 digits"""
+    return '%04d' % int(subrun)
+
+
+def FormatRunRange(run):
+    """the run range directory of a run, e.g. 00004000_00004999"""
+    first = 1000 * (int(run) // 1000)
+    return '%08d_%08d' % (first, first + 999)
+
+
+def FormatRawName(run, subrun):
+    """the raw data file name of a run and subrun"""
+    return 'nd280_%08d_%04d.daq.mid.gz' % (int(run), int(subrun))
+
+
+def RunSubrunTag(record):
+    """the aaaaaaaa-bbbb run-subrun tag of a record, '' if it has none"""
+    if record.run < 0:
+        return ''
+    return '%08d-%04d' % (record.run, record.subrun)
+
+
+class FileNameColumns(object):
+    """A list of parsed names stored column by column.
+
+    Every field of FileNameRecord is an attribute holding one entry per
+    name. run, subrun, lastrun and lastsubrun are integer arrays.
+    """
+
+    def __init__(self, records):
+        for field in FileNameRecord._fields:
+            column = [getattr(record, field) for record in records]
+            if field in ('run', 'subrun', 'lastrun', 'lastsubrun'):
+                column = Array(column, 'int64')
+            else:
+                column = Array(column, object)
+            setattr(self, field, column)
+
+    def __len__(self):
+        return len(self.name)
+
+    def Record(self, index):
+        """the FileNameRecord at index"""
+        return FileNameRecord(*[getattr(self, field)[index]
+                                for field in FileNameRecord._fields])
+
+    def Keys(self):
+        """integer run-subrun keys, run * 10000 + subrun"""
+        if numpy is not None:
+            return self.run * 10000 + self.subrun
+        return [run * 10000 + subrun
+                for run, subrun in zip(self.run, self.subrun)]
+
+    def RunRanges(self):
+        """first run of the run range of each entry"""
+        if numpy is not None:
+            return (self.run // 1000) * 1000
+        return [(run // 1000) * 1000 for run in self.run]
+
+    def Order(self):
+        """indices that sort the entries by run, subrun then name"""
+        if numpy is not None:
+            return numpy.lexsort((self.name, self.subrun, self.run))
+        return sorted(range(len(self)),
+                      key=lambda i: (self.run[i], self.subrun[i],
+                                     self.name[i]))
+
+    def Select(self, indices):
+        """a new FileNameColumns holding the entries at indices"""
+        return FileNameColumns([self.Record(i) for i in indices])
+
+    def IsIn(self, keys):
+        """boolean mask, True where the run-subrun key is in keys"""
+        if numpy is not None:
+            return numpy.in1d(self.Keys(), numpy.asarray(list(keys)))
+        keys = set(keys)
+        return [key in keys for key in self.Keys()]
+
+    def GroupByRunRange(self):
+        """{run range string: [indices]}, names without a run are left out"""
+        groups = dict()
+        for index, first in enumerate(self.RunRanges()):
+            if first < 0:
+                continue
+            groups.setdefault(FormatRunRange(first), list()).append(index)
+        return groups
+
+    def Tags(self):
+        """the run-subrun tag strings"""
+        return [RunSubrunTag(self.Record(i)) for i in range(len(self))]
+
+
+def Array(values, dtype):
+    """a numpy array if numpy is available, else the list itself"""
+    if numpy is None:
+        return list(values)
+    if dtype is object:
+        array = numpy.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    return numpy.array(values, dtype=dtype)
+
+
+def ParseFileNames(names):
+    """parse a list of names (or paths) into FileNameColumns"""
+    return FileNameColumns([ParseFileName(name) for name in names])
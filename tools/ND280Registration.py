@@ -0,0 +1,294 @@
+#!/usr/bin/env python2
+"""
+Bulk registration of job outputs and dark data in the file catalogue.
+
+BulkRegistrar takes a list of (source, LFN, SE) triples, where the source
+is either a local file, to be uploaded to the SE and registered, or a
+SURL of a file already on the SE, to be registered as it is. Rather than
+the DMSFindLFN and DMSAddFile calls per file of ND280File.Register it
+
+    1. looks up which LFNs exist, and where, with one bulk replica query
+       (and the checksums of those that exist with one metadata query)
+    2. uploads the local files with max_workers dirac-dms-add-file at once,
+       or, for LFNs that exist on other SEs, checks the local file against
+       the catalogue and replicates it to the SE with dirac-dms-replicate-lfn
+    3. sizes the SURLs with lcg-ls -l in chunks, checksums them with
+       lcg-get-checksum in parallel and registers them in batches of
+       chunk through the DIRACSession
+    4. checks the adler32 checksum of every upload, and of every SURL of
+       an existing LFN, against the catalogue
+
+and leaves a status on every task: registered, uploaded, replicated,
+exists, bad checksum or failed. Table() gives the per file result table.
+"""
+
+import os
+import time
+import uuid
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280DIRACAPI as ND280DIRAC
+from ND280Download import Adler32, SameChecksum
+
+# Registration states
+kRegistered = 'registered'
+kUploaded = 'uploaded'
+kReplicated = 'replicated'
+kExists = 'exists'
+kBadChecksum = 'bad checksum'
+kFailed = 'failed'
+
+
+def IsSURL(source):
+    """is source a file on a storage element rather than a local file"""
+    return '://' in source and not source.startswith('file://')
+
+
+class RegistrationTask(object):
+    """One file to register"""
+
+    def __init__(self, source, lfn, se):
+        self.source = source
+        self.lfn = lfn.replace('lfn:', '').replace('LFN:', '').replace(
+            '/grid/', '/')
+        self.se = se
+        self.size = 0
+        self.checksum = ''
+        self.known = False
+        self.expected = ''
+        self.expectedSize = 0
+        self.status = ''
+        self.detail = ''
+
+    def IsLocal(self):
+        return not IsSURL(self.source)
+
+    def Set(self, status, detail=''):
+        self.status = status
+        self.detail = detail
+
+
+class BulkRegistrar(object):
+    """
+    Registers RegistrationTasks, uploading local files with max_workers
+    parallel uploads and registering SURLs in batches of chunk. Commands
+    are retried by the shared RetryPolicy.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, max_workers=8, chunk=500, executor=None):
+        self.max_workers = max_workers
+        self.chunk = chunk
+        self.executor = executor or ND280Computing.GetRetryPolicy()
+        self.wallTime = 0.
+
+    def Chunks(self, items):
+        return [items[i:i + self.chunk]
+                for i in xrange(0, len(items), self.chunk)]
+
+    # The catalogue
+    def Lookup(self, tasks):
+        """mark the tasks whose LFN already has a replica on their SE,
+        and note the checksums and sizes of LFNs that exist elsewhere"""
+        replicas, failed = ND280DIRAC.GetBulkReplicas(
+            [task.lfn for task in tasks], self.chunk)
+        known = list()
+        for task in tasks:
+            reps = replicas.get(task.lfn)
+            if reps is None:
+                continue
+            if task.se in reps:
+                task.Set(kExists, reps[task.se])
+                continue
+            task.known = True
+            known.append(task)
+        if not known:
+            return
+        metadata, failed = ND280DIRAC.GetBulkMetadata(
+            [task.lfn for task in known], self.chunk)
+        for task in known:
+            entry = metadata.get(task.lfn, dict())
+            task.expected = str(entry.get('Checksum', '') or '')
+            task.expectedSize = int(float(entry.get('Size', 0) or 0))
+
+    # Local files
+    def Upload(self, task):
+        """upload and register one local file, or replicate it to its SE
+        if the LFN exists on other SEs"""
+        path = task.source.replace('file://', '')
+        if not os.path.isfile(path):
+            task.Set(kFailed, 'no such file ' + path)
+            return task
+        task.size = os.path.getsize(path)
+        task.checksum = Adler32(path)
+        if task.known:
+            # dirac-dms-add-file will not add a replica to an existing LFN,
+            # so make sure it is the same file and replicate that
+            if task.expectedSize and task.expectedSize != task.size:
+                task.Set(kBadChecksum, 'catalogue size %d, local %d' %
+                         (task.expectedSize, task.size))
+                return task
+            if task.expected and \
+                    not SameChecksum(task.expected, task.checksum):
+                task.Set(kBadChecksum, 'catalogue %s, local %s' %
+                         (task.expected, task.checksum))
+                return task
+            command = ND280DIRAC.DMSReplicateLFN(task.lfn, task.se)
+            done, failure = kReplicated, 'replication failed'
+        else:
+            command = ND280DIRAC.DMSAddFile(LFN=task.lfn, FileName=path,
+                                            SE=task.se)
+            done, failure = kUploaded, 'upload failed'
+        result = self.executor.Run(str(command),
+                                   max(StatusWait.kTimeout,
+                                       task.size / 1024**2))
+        lines, errors = command.ParseOutput(result.lines, result.errors)
+        if result.returncode != 0 or result.timedout or errors:
+            task.Set(kFailed, ' '.join(errors) or failure)
+        else:
+            task.Set(done)
+        return task
+
+    def Verify(self, tasks):
+        """compare the checksums of uploaded and replicated files with
+        the catalogue"""
+        if not tasks:
+            return
+        metadata, failed = ND280DIRAC.GetBulkMetadata(
+            [task.lfn for task in tasks], self.chunk)
+        for task in tasks:
+            entry = metadata.get(task.lfn)
+            if entry is None:
+                task.Set(kFailed, failed.get(task.lfn, 'not in catalogue'))
+                continue
+            size = int(float(entry.get('Size', 0) or 0))
+            checksum = str(entry.get('Checksum', '') or '')
+            if size and size != task.size:
+                task.Set(kBadChecksum, 'size %d, expected %d' %
+                         (size, task.size))
+            elif checksum and not SameChecksum(checksum, task.checksum):
+                task.Set(kBadChecksum, 'catalogue %s, local %s' %
+                         (checksum, task.checksum))
+
+    # SURLs
+    def Sizes(self, tasks):
+        """the sizes of SURLs from lcg-ls -l, in chunks"""
+        for chunk in self.Chunks(tasks):
+            by_name = dict()
+            for task in chunk:
+                by_name.setdefault(os.path.basename(task.source),
+                                   list()).append(task)
+            result = self.executor.Run(
+                'lcg-ls -l ' + ' '.join(task.source for task in chunk),
+                StatusWait.kTimeout)
+            for line in result.lines:
+                # -rw-r--r-- 1 2 2 1048576 ONLINE /path/file
+                fields = line.split()
+                if len(fields) < 7:
+                    continue
+                for task in by_name.get(os.path.basename(fields[-1]),
+                                        list()):
+                    if task.source.endswith(fields[-1]):
+                        task.size = int(fields[4])
+
+    def Checksum(self, task):
+        """the adler32 checksum the SE has for a SURL"""
+        result = self.executor.Run('lcg-get-checksum ' + task.source,
+                                   StatusWait.kTimeout)
+        lines = [line for line in result.lines if line.strip()]
+        if result.returncode == 0 and lines:
+            checksum = lines[0].split()[0]
+            if checksum != '(null)':
+                task.checksum = checksum
+        return task
+
+    def Register(self, tasks):
+        """register SURLs that exist, in batches"""
+        self.Sizes(tasks)
+        ND280Computing.ParallelMap(self.Checksum, tasks, self.max_workers)
+
+        files = list()
+        for task in tasks:
+            if not task.size:
+                task.Set(kFailed, 'could not list ' + task.source)
+                continue
+            if task.expected and task.checksum and \
+                    not SameChecksum(task.expected, task.checksum):
+                task.Set(kBadChecksum, 'catalogue %s, SE %s' %
+                         (task.expected, task.checksum))
+                continue
+            files.append({'lfn': task.lfn, 'pfn': task.source,
+                          'se': task.se, 'size': task.size,
+                          'checksum': task.checksum,
+                          'guid': str(uuid.uuid4()).upper()})
+        if not files:
+            return
+        registered, failed = ND280DIRAC.RegisterBulk(files, self.chunk)
+        for task in tasks:
+            if task.status:
+                continue
+            if task.lfn in registered:
+                task.Set(kRegistered,
+                         '' if task.checksum else 'no checksum from the SE')
+            else:
+                task.Set(kFailed, failed.get(task.lfn, 'not registered'))
+
+    def Run(self, tasks):
+        """register every task, returns the tasks that were not
+        registered (failed or with a bad checksum)"""
+        start = time.time()
+        self.Lookup(tasks)
+        todo = [task for task in tasks if not task.status]
+
+        local = [task for task in todo if task.IsLocal()]
+        results = ND280Computing.ParallelMap(self.Upload, local,
+                                             self.max_workers)
+        for task, result in zip(local, results):
+            if isinstance(result, Exception):
+                task.Set(kFailed, str(result))
+        self.Verify([task for task in local
+                     if task.status in (kUploaded, kReplicated)])
+
+        surls = [task for task in todo if not task.IsLocal()]
+        if surls:
+            try:
+                self.Register(surls)
+            except ND280DIRAC.DIRACSession.Error as exception:
+                for task in surls:
+                    if not task.status:
+                        task.Set(kFailed, str(exception))
+
+        self.wallTime = time.time() - start
+        return [task for task in tasks
+                if task.status in (kFailed, kBadChecksum)]
+
+    def Table(self, tasks):
+        """the per file result table"""
+        lines = ['%-13s %-24s %s' % ('status', 'SE', 'LFN')]
+        for task in sorted(tasks, key=lambda task: (task.status, task.lfn)):
+            line = '%-13s %-24s %s' % (task.status, task.se, task.lfn)
+            if task.detail and task.status != kExists:
+                line += '  (' + task.detail + ')'
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def Summary(self, tasks):
+        counts = dict()
+        for task in tasks:
+            counts[task.status] = counts.get(task.status, 0) + 1
+        return '%d files in %.0f s: ' % (len(tasks), self.wallTime) + \
+            ', '.join('%d %s' % (counts[status], status)
+                      for status in sorted(counts))
+
+
+def RegisterMany(triples, max_workers=8, chunk=500):
+    """register (source, LFN, SE) triples, returns the RegistrationTasks
+    and the BulkRegistrar for its Table() and Summary()"""
+    tasks = [RegistrationTask(*triple) for triple in triples]
+    registrar = BulkRegistrar(max_workers, chunk)
+    registrar.Run(tasks)
+    return tasks, registrar
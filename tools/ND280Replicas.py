@@ -0,0 +1,242 @@
+#!/usr/bin/env python2
+"""
+Replica selection from measured storage element performance.
+
+ReplicaSelector keeps rolling statistics for every storage element we copy
+from: success rate, time to first byte (the fixed cost of a transfer),
+throughput and staging latency, as exponentially weighted moving averages
+of our own past transfers. They are saved to a JSON file
+($ND280REPLICASTATS, default ~/.nd280/replica_stats.json) so that every
+job and script learns from the others.
+
+Rank() orders the replicas of a file by expected completion time
+
+    (staging latency + time to first byte + size / throughput) / success rate
+
+and a circuit breaker takes an SE out of the running after a number of
+consecutive failures, until a cool down has passed. SEs with no history
+get default statistics, and ties fall back to the fixed priority ND280File
+used before: the caller's SRM, RAL, then TRIUMF, IN2P3 and QMUL.
+"""
+
+import json
+import os
+from os import getenv
+import tempfile
+import threading
+import time
+from urlparse import urlparse
+
+import ND280Computing
+
+# The old fixed priority, used to break ties
+PRIORITY = ('srm-t2k.gridpp.rl.ac.uk', 't2ksrm.nd280.org', 'in2p3.fr',
+            'qmul')
+
+
+def SEName(surl):
+    """the storage element (host) of a SURL, for local file:// URLs the
+    top directory"""
+    url = urlparse(surl)
+    if not url.netloc:
+        return '%s:/%s' % (url.scheme or 'file', url.path.lstrip('/').split('/')[0])
+    return url.netloc.split(':')[0]
+
+
+class SEStats(object):
+    """Rolling statistics of one storage element"""
+
+    # starting values for an SE we know nothing about
+    kThroughput = 10. * 1024**2
+    kFirstByte = 10.
+    kSuccess = 1.
+
+    def __init__(self, entry=None):
+        entry = entry or dict()
+        self.success = entry.get('success', self.kSuccess)
+        self.firstbyte = entry.get('firstbyte', self.kFirstByte)
+        self.throughput = entry.get('throughput', self.kThroughput)
+        self.staging = entry.get('staging', 0.)
+        self.nTransfers = entry.get('nTransfers', 0)
+        self.nFailures = entry.get('nFailures', 0)
+        self.nConsecutive = entry.get('nConsecutive', 0)
+        self.openUntil = entry.get('openUntil', 0.)
+        self.updated = entry.get('updated', 0.)
+
+    def ToDict(self):
+        return dict(self.__dict__)
+
+    def ExpectedTime(self, size):
+        """expected seconds to copy size bytes, including retries"""
+        seconds = self.staging + self.firstbyte + size / self.throughput
+        return seconds / max(self.success, 0.01)
+
+
+class ReplicaSelector(object):
+    """
+    Picks the replica with the best expected completion time and learns
+    from the outcome of every copy. alpha is the weight of the newest
+    sample in the moving averages, after threshold consecutive failures
+    an SE is skipped for cooldown seconds (doubled each time it fails
+    again straight after a cool down).
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, path='', alpha=0.2, threshold=3,
+                 cooldown=10*ND280Computing.StatusWait.kMinute):
+        if not path:
+            path = getenv('ND280REPLICASTATS',
+                          os.path.join(os.path.expanduser('~'), '.nd280',
+                                       'replica_stats.json'))
+        self.path = path
+        self.alpha = alpha
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.stats = dict()
+        self.Load()
+
+    def Load(self):
+        """read the saved statistics, if any"""
+        try:
+            with open(self.path) as stats_file:
+                saved = json.load(stats_file)
+        except (IOError, ValueError):
+            return
+        with self.lock:
+            for se, entry in saved.iteritems():
+                self.stats[str(se)] = SEStats(entry)
+
+    def Save(self):
+        """write the statistics, through a temporary file so that a
+        reader never sees half a file"""
+        with self.lock:
+            saved = dict((se, stats.ToDict())
+                         for se, stats in self.stats.iteritems())
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temporary = tempfile.mkstemp(dir=directory)
+            with os.fdopen(handle, 'w') as stats_file:
+                json.dump(saved, stats_file, indent=1, sort_keys=True)
+            os.rename(temporary, self.path)
+        except (IOError, OSError) as exception:
+            print 'Could not save replica statistics to %s: %s' % \
+                (self.path, exception)
+
+    def Stats(self, se):
+        """the SEStats of se, created if it is new"""
+        with self.lock:
+            if se not in self.stats:
+                self.stats[se] = SEStats()
+            return self.stats[se]
+
+    def IsOpen(self, se, now=None):
+        """is the circuit breaker of se open, i.e. se is being skipped"""
+        return self.Stats(se).openUntil > (now or time.time())
+
+    def Rank(self, reps, size=0., preferred=''):
+        """reps ordered best first, size is in bytes. SEs with an open
+        circuit breaker go last, soonest to close first"""
+        now = time.time()
+
+        def Key(surl):
+            se = SEName(surl)
+            stats = self.Stats(se)
+            priority = len(PRIORITY) + 1
+            if preferred and preferred in surl:
+                priority = 0
+            else:
+                for index, host in enumerate(PRIORITY):
+                    if host in surl:
+                        priority = index + 1
+                        break
+            if stats.openUntil > now:
+                return (1, stats.openUntil, priority)
+            return (0, stats.ExpectedTime(size), priority)
+
+        return sorted([surl for surl in reps if surl], key=Key)
+
+    def Choose(self, reps, size=0., preferred=''):
+        """the best replica, '' if there are none"""
+        ranked = self.Rank(reps, size, preferred)
+        if ranked:
+            return ranked[0]
+        return ''
+
+    def Average(self, old, new):
+        return (1. - self.alpha) * old + self.alpha * new
+
+    def Record(self, surl, size, duration, ok, save=True):
+        """learn from one copy of size bytes from surl that took duration
+        seconds"""
+        se = SEName(surl)
+        stats = self.Stats(se)
+        with self.lock:
+            stats.nTransfers += 1
+            stats.updated = time.time()
+            stats.success = self.Average(stats.success, float(bool(ok)))
+            if ok:
+                stats.nConsecutive = 0
+                stats.openUntil = 0.
+                # split the duration into the fixed cost and the
+                # size dependent part using the current throughput
+                firstbyte = max(duration - size / stats.throughput, 0.)
+                stats.firstbyte = self.Average(stats.firstbyte, firstbyte)
+                if size > 0 and duration > stats.firstbyte:
+                    stats.throughput = self.Average(
+                        stats.throughput, size / (duration - stats.firstbyte))
+            else:
+                stats.nFailures += 1
+                stats.nConsecutive += 1
+                if stats.nConsecutive >= self.threshold:
+                    extra = stats.nConsecutive - self.threshold
+                    stats.openUntil = time.time() + \
+                        self.cooldown * 2**min(extra, 5)
+                    print 'Skipping %s for %d s after %d failures' % \
+                        (se, stats.openUntil - time.time(),
+                         stats.nConsecutive)
+        if save:
+            self.Save()
+
+    def RecordStaging(self, surl, duration, save=True):
+        """learn from bringing a replica on surl online"""
+        stats = self.Stats(SEName(surl))
+        with self.lock:
+            stats.staging = self.Average(stats.staging, duration)
+        if save:
+            self.Save()
+
+    def Summary(self):
+        """one line per SE"""
+        lines = list()
+        for se in sorted(self.stats):
+            stats = self.stats[se]
+            state = 'open' if stats.openUntil > time.time() else 'ok'
+            lines.append('%-40s %5.2f %8.1fs %8.2f MB/s %8.1fs %6d %s' %
+                         (se, stats.success, stats.firstbyte,
+                          stats.throughput / 1024**2, stats.staging,
+                          stats.nTransfers, state))
+        return '\n'.join(lines)
+
+
+# Shared selector, loaded on first use
+REPLICA_SELECTOR = None
+
+
+def GetReplicaSelector():
+    """simple get'er for the shared ReplicaSelector"""
+    global REPLICA_SELECTOR
+    if REPLICA_SELECTOR is None:
+        REPLICA_SELECTOR = ReplicaSelector()
+    return REPLICA_SELECTOR
+
+
+def SetReplicaSelector(selector):
+    """replace the shared ReplicaSelector"""
+    global REPLICA_SELECTOR
+    REPLICA_SELECTOR = selector
@@ -0,0 +1,378 @@
+#!/usr/bin/env python2
+"""
+Automatic resubmission of failed processing jobs, with learned site bans.
+
+ResubmissionEngine works on a production's job-state store (see
+ND280JobStore, <outdir>/jobs.db). The latest attempt of every job that
+failed is sorted by its DIRAC minor status:
+
+    input data      the input could not be resolved, never retried
+    stalled         the pilot or the node died under the job
+    sandbox         the output sandbox could not be uploaded
+    application     the application finished with errors
+    other           anything else
+
+and resubmitted once a backoff, doubling with every attempt, has passed,
+until max_attempts attempts of the job have failed. A job is resubmitted
+from the description next to its .jid file, the .jdl (with
+dirac-wms-job-submit -f, which adds the new job ID to the .jid file) or
+the DIRAC API script written by ND280DIRACJobDescription. Jobs of bulk
+parametric submissions have neither and are rescheduled in DIRAC.
+
+A site at which at least min_jobs jobs ended in the last window seconds
+and a fraction threshold or more of them failed (input data failures do
+not count) is banned for ban_time seconds. The bans of the moment are
+written into the BannedSites of every resubmitted job. Once a ban is
+over only the jobs that ended since count towards the next one. The
+sites a job was banned from at submission (its BannedSites, or those
+added with ND280DIRACJobDescription.AddBannedSite) stay banned, the
+engine only adds and removes the sites it learned. Every resubmission,
+rescheduling, failed resubmission, give up and ban is recorded in the
+store.
+"""
+
+import os
+import re
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280JobStore
+
+# Failure classes
+kInputData = 'input data'
+kStalled = 'stalled'
+kSandbox = 'sandbox'
+kApplication = 'application'
+kOther = 'other'
+
+# Pieces of DIRAC minor statuses, in lower case, for each class checked
+# in order
+MINOR_STATUSES = [
+    (kInputData, ('input data resolution', 'input data not available',
+                  'inputdata', 'no such file', 'file catalog')),
+    (kStalled, ('stalled', 'pilot not running', 'watchdog',
+                'job has reached the cpu limit', 'node')),
+    (kSandbox, ('sandbox',)),
+    (kApplication, ('application', 'exception during execution')),
+]
+
+# Backoff of the first resubmission of each class, in seconds
+BACKOFF = {kStalled: 10*StatusWait.kMinute,
+           kSandbox: 30*StatusWait.kMinute,
+           kApplication: StatusWait.kHour,
+           kOther: 30*StatusWait.kMinute}
+MAX_BACKOFF = StatusWait.kDay
+
+# What happened to a failed job
+kResubmitted = 'resubmitted'
+kRescheduled = 'rescheduled'
+kGivenUp = 'given up'
+kFailed = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resubmissions (
+    jidfile TEXT,
+    jobid   TEXT,
+    site    TEXT,
+    minor   TEXT,
+    class   TEXT,
+    attempt INTEGER,
+    action  TEXT,
+    bans    TEXT,
+    added   TEXT,
+    time    REAL
+);
+CREATE TABLE IF NOT EXISTS bans (
+    site   TEXT,
+    failed INTEGER,
+    ended  INTEGER,
+    since  REAL,
+    until  REAL
+);
+CREATE INDEX IF NOT EXISTS resubmissions_jidfile ON resubmissions (jidfile);
+CREATE INDEX IF NOT EXISTS resubmissions_jobid ON resubmissions (jobid);
+"""
+
+BANNED_SITES_JDL = re.compile(r'^BannedSites\s*=.*$\n?', re.MULTILINE)
+BANNED_SITES_SCRIPT = re.compile(r'^diracJob\.setBannedSites\(.*$\n?',
+                                 re.MULTILINE)
+QUOTED = re.compile(r'[\'"]([^\'"]+)[\'"]')
+
+
+def Classify(minor):
+    """the failure class of a DIRAC minor status"""
+    lower = minor.lower()
+    for kind, pieces in MINOR_STATUSES:
+        for piece in pieces:
+            if piece in lower:
+                return kind
+    return kOther
+
+
+def Backoff(kind, attempts):
+    """seconds before resubmitting a job of class kind that failed
+    attempts times"""
+    return min(BACKOFF.get(kind, BACKOFF[kOther]) * 2**max(attempts - 1, 0),
+               MAX_BACKOFF)
+
+
+def JDLBannedSites(jdl):
+    """the BannedSites of a JDL file"""
+    with open(jdl) as jdl_file:
+        match = BANNED_SITES_JDL.search(jdl_file.read())
+    return QUOTED.findall(match.group(0)) if match else list()
+
+
+def ScriptBannedSites(script):
+    """the banned sites of a DIRAC API script"""
+    with open(script) as script_file:
+        match = BANNED_SITES_SCRIPT.search(script_file.read())
+    return QUOTED.findall(match.group(0)) if match else list()
+
+
+def SetJDLBannedSites(jdl, sites):
+    """write sites as the BannedSites of a JDL file"""
+    with open(jdl) as jdl_file:
+        text = BANNED_SITES_JDL.sub('', jdl_file.read())
+    if sites:
+        text = text.rstrip('\n') + '\nBannedSites = {"%s"};\n' % \
+            '", "'.join(sites)
+    with open(jdl, 'w') as jdl_file:
+        jdl_file.write(text)
+
+
+def SetScriptBannedSites(script, sites):
+    """write sites as the banned sites of a DIRAC API script from
+    ND280DIRACJobDescription, just before its submission"""
+    with open(script) as script_file:
+        text = BANNED_SITES_SCRIPT.sub('', script_file.read())
+    if sites:
+        where = text.find('print "submitting')
+        if where < 0:
+            raise ResubmissionEngine.Error('No submission in ' + script)
+        text = text[:where] + 'diracJob.setBannedSites(%r)\n' % list(sites) + \
+            text[where:]
+    with open(script, 'w') as script_file:
+        script_file.write(text)
+
+
+class ResubmissionEngine(object):
+    """
+    Resubmits the failed jobs of the JobStore store and bans the sites
+    that fail too many jobs. With resubmit off failures are only
+    classified and bans only learned.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, store, max_attempts=5, threshold=0.5, min_jobs=10,
+                 window=StatusWait.kDay, ban_time=StatusWait.kDay,
+                 resubmit=True, executor=None):
+        self.store = store
+        self.store.db.executescript(SCHEMA)
+        self.max_attempts = max_attempts
+        self.threshold = threshold
+        self.min_jobs = min_jobs
+        self.window = window
+        self.ban_time = ban_time
+        self.resubmit = resubmit
+        self.executor = executor or ND280Computing.GetCommandExecutor()
+
+        # for the summary
+        self.nFailed = dict()
+        self.nResubmitted = 0
+        self.nRescheduled = 0
+        self.nWaiting = 0
+        self.nGivenUp = 0
+        self.nErrors = 0
+        self.nBanned = 0
+
+    def Record(self, job, kind, action, bans=(), now=None, added=()):
+        """add what happened to a failed job to the store, bans are the
+        sites written into its description, added the learned ones among
+        them"""
+        self.store.db.execute('INSERT INTO resubmissions VALUES '
+                              '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (job.jidfile, job.jobid, job.site, job.minor,
+                               kind, self.Attempts(job), action,
+                               ','.join(bans), ','.join(added),
+                               now or time.time()))
+        self.store.db.commit()
+
+    def Added(self, job):
+        """the learned bans ever written into the description of job"""
+        added = set()
+        for (sites,) in self.store.db.execute(
+                'SELECT added FROM resubmissions WHERE jidfile = ?',
+                (job.jidfile,)):
+            added.update(site for site in (sites or '').split(',') if site)
+        return added
+
+    def Attempts(self, job):
+        """the number of times the job of job.jidfile has been run"""
+        resubmitted = self.store.db.execute(
+            'SELECT COUNT(*) FROM resubmissions WHERE jidfile = ? AND '
+            'action IN (?, ?, ?)', (job.jidfile, kResubmitted, kRescheduled,
+                                    kFailed)).fetchone()[0]
+        return max(job.attempt, 1 + resubmitted)
+
+    def GivenUp(self, job):
+        """has job been given up on already"""
+        return self.store.db.execute(
+            'SELECT COUNT(*) FROM resubmissions WHERE jobid = ? AND '
+            'action = ?', (job.jobid, kGivenUp)).fetchone()[0] > 0
+
+    # Site bans
+    def Bans(self, now=None):
+        """the sites banned now"""
+        return self.store.Banned(now)
+
+    def Outcomes(self, since):
+        """{site: [failed, ended]} of the jobs that ended since, input
+        data failures left out"""
+        outcomes = dict()
+        for site, status, minor, updated in self.store.db.execute(
+                'SELECT site, status, minor, updated FROM jobs WHERE '
+                'updated >= ? AND status IN (?, ?)',
+                (since, 'Done', 'Failed')):
+            if site in ND280JobStore.UNASSIGNED:
+                continue
+            if status == 'Failed' and Classify(minor) == kInputData:
+                continue
+            counts = outcomes.setdefault(site, [0, 0])
+            counts[0] += status == 'Failed'
+            counts[1] += 1
+        return outcomes
+
+    def UpdateBans(self, now=None):
+        """ban the sites whose failure rate crossed the threshold,
+        returns the sites banned now"""
+        now = now or time.time()
+        banned = set(self.Bans(now))
+        last = dict(self.store.db.execute(
+            'SELECT site, MAX(until) FROM bans GROUP BY site'))
+        since = now - self.window
+        for site, (failed, ended) in sorted(self.Outcomes(since).iteritems()):
+            if site in banned:
+                continue
+            # only what happened after the last ban counts
+            if site in last and last[site] > since:
+                failed, ended = self.Outcomes(last[site]).get(site, (0, 0))
+            if ended < self.min_jobs or \
+                    failed < self.threshold * ended:
+                continue
+            print 'Banning %s for %.0f h, %d of %d jobs failed' % \
+                (site, self.ban_time / StatusWait.kHour, failed, ended)
+            self.store.db.execute('INSERT INTO bans VALUES (?, ?, ?, ?, ?)',
+                                  (site, failed, ended, now,
+                                   now + self.ban_time))
+            self.nBanned += 1
+            banned.add(site)
+        self.store.db.commit()
+        return sorted(banned)
+
+    # Resubmission
+    def Prepare(self, job, bans):
+        """write the sites job was banned from at submission and the
+        learned bans into its description. Returns the command resubmitting it, the
+        action, the sites banned and the learned ones added"""
+        name = job.jidfile[:-len('.jid')] if job.jidfile.endswith('.jid') \
+            else job.jidfile
+        if os.path.isfile(name + '.jdl'):
+            description = name + '.jdl'
+            Read, Write = JDLBannedSites, SetJDLBannedSites
+            command = 'dirac-wms-job-submit -f %s %s' % (job.jidfile,
+                                                          description)
+        elif os.path.isfile(name + '.py'):
+            description = name + '.py'
+            Read, Write = ScriptBannedSites, SetScriptBannedSites
+            command = '/usr/bin/env python2 ' + description
+        else:
+            # bans cannot be changed on a rescheduled job
+            return ('dirac-wms-job-reschedule %s' % job.jobid, kRescheduled,
+                    list(), list())
+
+        # what was banned at submission, and no expired learned bans
+        learned = self.Added(job)
+        submitted = [site for site in Read(description)
+                     if site not in learned]
+        added = [site for site in bans if site not in submitted]
+        banned = submitted + added
+        Write(description, banned)
+        return command, kResubmitted, banned, added
+
+    def Resubmit(self, job, command, action):
+        """run the command resubmitting or rescheduling job"""
+        result = self.executor.Run(command, StatusWait.kTimeout)
+        if result.timedout or result.returncode != 0:
+            raise self.Error('%s failed: %s' % (command,
+                                                ' '.join(result.errors)))
+        if action == kResubmitted:
+            self.store.ScanJIDFiles([job.jidfile])
+            if self.store.Jobs([job.jidfile])[0].jobid == job.jobid:
+                raise self.Error('No new job ID in ' + job.jidfile)
+        else:
+            # the job is waiting again, so it is queried on refreshes
+            self.store.Update({job.jobid: ('Rescheduled', 'Job Rescheduled',
+                                           job.site)})
+
+    def Run(self, jidfiles=None, now=None):
+        """one pass over the failed jobs (of jidfiles), returns the number
+        resubmitted or rescheduled"""
+        now = now or time.time()
+        bans = self.UpdateBans(now)
+        nDone = 0
+        for job in self.store.Jobs(jidfiles, ND280JobStore.kFailed):
+            kind = Classify(job.minor)
+            self.nFailed[kind] = self.nFailed.get(kind, 0) + 1
+            if self.GivenUp(job):
+                continue
+            attempts = self.Attempts(job)
+            if kind == kInputData or attempts >= self.max_attempts:
+                print 'Giving up on %s after %d attempts: %s' % \
+                    (job.jidfile, attempts, job.minor)
+                self.Record(job, kind, kGivenUp, now=now)
+                self.nGivenUp += 1
+                continue
+            if now < job.updated + Backoff(kind, attempts):
+                self.nWaiting += 1
+                continue
+            if not self.resubmit:
+                continue
+            banned = added = list()
+            try:
+                command, action, banned, added = self.Prepare(job, bans)
+                self.Resubmit(job, command, action)
+            except (self.Error, IOError, OSError) as error:
+                print 'Could not resubmit %s: %s' % (job.jidfile, error)
+                # counts as an attempt, so a job that cannot be
+                # resubmitted is given up on too
+                self.Record(job, kind, kFailed, banned, now, added)
+                self.nErrors += 1
+                continue
+            print '%s %s (%s at %s, attempt %d)' % \
+                (action.capitalize(), job.jidfile, job.minor, job.site,
+                 attempts + 1)
+            self.Record(job, kind, action, banned, now, added)
+            if action == kResubmitted:
+                self.nResubmitted += 1
+            else:
+                self.nRescheduled += 1
+            nDone += 1
+        return nDone
+
+    def Summary(self):
+        """a line per number of the pass"""
+        lines = ['%d %s failures' % (number, kind)
+                 for kind, number in sorted(self.nFailed.iteritems())]
+        lines += ['%d jobs resubmitted' % self.nResubmitted,
+                  '%d jobs rescheduled' % self.nRescheduled,
+                  '%d jobs waiting for their backoff' % self.nWaiting,
+                  '%d jobs given up on' % self.nGivenUp,
+                  '%d resubmissions failed' % self.nErrors,
+                  '%d sites newly banned, banned now: %s' %
+                  (self.nBanned, ', '.join(self.Bans()) or 'none')]
+        return '\n'.join(lines)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python2
+"""
+Storage element space accounting.
+
+SpaceAccountant asks the information system (the first BDII of
+$LCG_GFAL_INFOSYS) for the space t2k.org has on every SE at once, one
+ldapsearch of the SE's GlueSA entries per SE, each with its own deadline.
+A broken SE then costs at most its deadline and shows up as an error row
+instead of holding up the whole report.
+
+Results are cached per SE in $ND280SPACECACHE (~/.nd280/space.json) and
+reused for ttl seconds ($ND280SPACETTL, default one hour), so the cron
+jobs that print the usage at every run only query the SEs whose entry
+has expired. Every fresh entry is also appended to the usage history
+$ND280SPACEHISTORY (~/.nd280/space_history.log), one JSON line per SE
+and space token.
+"""
+
+from collections import namedtuple
+import fcntl
+import json
+import os
+from os import getenv
+import tempfile
+import threading
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait, VO
+
+# One space token of one SE, sizes in TB
+SpaceEntry = namedtuple('SpaceEntry', ['se', 'token', 'used', 'free',
+                                       'nearline_used', 'nearline_free',
+                                       'timestamp', 'error'])
+
+# GlueSA attributes, sizes in GB
+ATTRIBUTES = ['GlueSAName', 'GlueSALocalID', 'GlueSAUsedOnlineSize',
+              'GlueSAFreeOnlineSize', 'GlueSAUsedNearlineSize',
+              'GlueSAFreeNearlineSize']
+
+
+def GetBDII():
+    """the first BDII of $LCG_GFAL_INFOSYS, with its port"""
+    bdii = getenv('LCG_GFAL_INFOSYS', 'lcg-bdii.gridpp.ac.uk:2170')
+    bdii = bdii.split(',')[0].strip()
+    if ':' not in bdii:
+        bdii += ':2170'
+    return bdii
+
+
+def ParseLDIF(lines):
+    """the entries of ldapsearch -LLL output as {attribute: value}"""
+    entries = list()
+    entry = dict()
+    attribute = None
+    for line in lines + ['']:
+        line = line.rstrip('\n')
+        if not line.strip():
+            if entry:
+                entries.append(entry)
+            entry = dict()
+            attribute = None
+        elif line.startswith(' ') and attribute:
+            # continuation of a folded line
+            entry[attribute] += line[1:]
+        elif ':' in line:
+            attribute, value = line.split(':', 1)
+            entry[attribute] = value.strip()
+    return entries
+
+
+def ToTB(entry, attribute):
+    """a GlueSA size in TB, 0 if it is not published"""
+    try:
+        return float(entry.get(attribute, 0)) / 1024.
+    except ValueError:
+        return 0.
+
+
+class SpaceAccountant(object):
+    """
+    Queries, caches and records the space of the SEs ses. Each SE is
+    queried with its own deadline (seconds), at most max_workers at once,
+    and its entries are reused for ttl seconds.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, ses, deadline=StatusWait.kMinute, ttl=None,
+                 max_workers=16, cache='', history='', executor=None):
+        self.ses = list(ses)
+        self.deadline = deadline
+        if ttl is None:
+            ttl = float(getenv('ND280SPACETTL', StatusWait.kHour))
+        self.ttl = ttl
+        self.max_workers = max_workers
+        directory = os.path.join(os.path.expanduser('~'), '.nd280')
+        self.cache = cache or getenv('ND280SPACECACHE',
+                                     os.path.join(directory, 'space.json'))
+        self.history = history or getenv('ND280SPACEHISTORY',
+                                         os.path.join(directory,
+                                                      'space_history.log'))
+        self.executor = executor or ND280Computing.GetCommandExecutor()
+        self.lock = threading.Lock()
+        self.nQueries = 0
+
+    def Command(self, se):
+        """the ldapsearch of the t2k.org GlueSA entries of se"""
+        search = '(&(objectClass=GlueSA)(GlueChunkKey=GlueSEUniqueID=%s)' \
+            '(|(GlueSAAccessControlBaseRule=VO:%s)' \
+            '(GlueSAAccessControlBaseRule=%s)))' % (se, VO, VO)
+        return 'ldapsearch -x -LLL -o nettimeout=%d -H ldap://%s -b o=grid ' \
+            '"%s" %s' % (self.deadline, GetBDII(), search,
+                         ' '.join(ATTRIBUTES))
+
+    def Query(self, se):
+        """the SpaceEntries of se, one error entry if it could not be
+        queried before its deadline"""
+        with self.lock:
+            self.nQueries += 1
+        now = time.time()
+        result = self.executor.Run(self.Command(se), self.deadline)
+        if result.timedout:
+            error = 'no answer in %d s' % self.deadline
+        elif result.returncode != 0:
+            error = ' '.join(result.errors).strip() or \
+                'ldapsearch exit code %s' % result.returncode
+        else:
+            error = ''
+            entries = [SpaceEntry(se, entry.get('GlueSAName') or
+                                  entry.get('GlueSALocalID', ''),
+                                  ToTB(entry, 'GlueSAUsedOnlineSize'),
+                                  ToTB(entry, 'GlueSAFreeOnlineSize'),
+                                  ToTB(entry, 'GlueSAUsedNearlineSize'),
+                                  ToTB(entry, 'GlueSAFreeNearlineSize'),
+                                  now, '')
+                       for entry in ParseLDIF(result.lines)]
+            if entries:
+                return entries
+            error = 'no %s space published' % VO
+        return [SpaceEntry(se, '', 0., 0., 0., 0., now, error)]
+
+    # The cache and the history
+    def Load(self):
+        """the cached entries of every SE as {se: [SpaceEntry]}"""
+        try:
+            with open(self.cache) as cache_file:
+                saved = json.load(cache_file)
+        except (IOError, ValueError):
+            return dict()
+        return dict((str(se), [SpaceEntry(*[str(field) if
+                                            isinstance(field, unicode) else
+                                            field for field in entry])
+                               for entry in entries])
+                    for se, entries in saved.iteritems())
+
+    def Save(self, cached):
+        """write the cache, through a temporary file so that a reader
+        never sees half a file"""
+        directory = os.path.dirname(self.cache) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temporary = tempfile.mkstemp(dir=directory)
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump(cached, cache_file, indent=1, sort_keys=True)
+            os.rename(temporary, self.cache)
+        except (IOError, OSError) as exception:
+            print 'Could not save the SE space cache to %s: %s' % \
+                (self.cache, exception)
+
+    def Record(self, entries):
+        """append entries to the usage history"""
+        directory = os.path.dirname(self.history) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.history, 'a') as history:
+                fcntl.flock(history, fcntl.LOCK_EX)
+                for entry in entries:
+                    history.write(json.dumps(entry._asdict(),
+                                             sort_keys=True) + '\n')
+        except (IOError, OSError) as exception:
+            print 'Could not write the SE space history %s: %s' % \
+                (self.history, exception)
+
+    def IsFresh(self, entries, now=None):
+        """were entries queried less than ttl seconds ago"""
+        now = now or time.time()
+        return bool(entries) and now - entries[0].timestamp < self.ttl
+
+    def Refresh(self, ses=None):
+        """query ses (every SE by default) now, returns {se: [SpaceEntry]}"""
+        ses = list(ses if ses is not None else self.ses)
+        results = ND280Computing.ParallelMap(self.Query, ses,
+                                             self.max_workers)
+        fresh = dict()
+        for se, entries in zip(ses, results):
+            if isinstance(entries, Exception):
+                entries = [SpaceEntry(se, '', 0., 0., 0., 0., time.time(),
+                                      str(entries))]
+            fresh[se] = entries
+        cached = self.Load()
+        cached.update(fresh)
+        self.Save(cached)
+        self.Record([entry for se in ses for entry in fresh[se]])
+        return fresh
+
+    def Table(self, force=False):
+        """the SpaceEntries of every SE, sorted by SE and token, querying
+        only the SEs whose cached entries are older than ttl"""
+        cached = self.Load()
+        stale = [se for se in self.ses
+                 if force or not self.IsFresh(cached.get(se))]
+        if stale:
+            cached.update(self.Refresh(stale))
+        return sorted(entry for se in self.ses for entry in cached[se])
+
+    # Reports
+    def PrintDiskUsage(self, entries=None):
+        """free and used space of every SE, summed over its tokens"""
+        entries = entries if entries is not None else self.Table()
+        print 'Free (TB)  Used(TB)  SE'
+        print '-------------------------------------------------'
+        totals = dict()
+        for entry in entries:
+            if entry.error:
+                continue
+            free, used = totals.get(entry.se, (0., 0.))
+            totals[entry.se] = (free + entry.free, used + entry.used)
+        for se in sorted(totals):
+            free, used = totals[se]
+            # Ignore if free and used both 0
+            if free == 0 and used == 0:
+                continue
+            print '%9.2f %9.2f  %s' % (free, used, se)
+        self.PrintErrors(entries)
+
+    def PrintSpaceUsage(self, entries=None):
+        """online and nearline space of every space token"""
+        entries = entries if entries is not None else self.Table()
+        print '    Free     Used     Free     Used              Tag SE'
+        print '  Online   Online Nearline Nearline (TB)                   '
+        print '-' * 80
+        for entry in entries:
+            # Ignore errors and if used is below 1 TB
+            if entry.error or entry.used <= 1:
+                continue
+            print '%8.2f %8.2f %8.2f %8.2f %16s %s' % \
+                (entry.free, entry.used, entry.nearline_free,
+                 entry.nearline_used, entry.token, entry.se)
+        self.PrintErrors(entries)
+
+    def PrintErrors(self, entries):
+        """the SEs that could not be queried"""
+        for entry in entries:
+            if entry.error:
+                print 'Could not query %s: %s' % (entry.se, entry.error)
+        if entries:
+            oldest = min(entry.timestamp for entry in entries)
+            print 'Oldest entry from %s' % time.strftime('%Y-%m-%d %H:%M:%S',
+                                                        time.localtime(oldest))
+
+
+SPACE_ACCOUNTANT = None
+
+
+def GetSpaceAccountant(ses=None):
+    """simple get'er for the shared SpaceAccountant, created for ses on
+    first use"""
+    global SPACE_ACCOUNTANT
+    if SPACE_ACCOUNTANT is None:
+        if ses is None:
+            raise SpaceAccountant.Error('No SEs to account for')
+        SPACE_ACCOUNTANT = SpaceAccountant(ses)
+    return SPACE_ACCOUNTANT
+
+
+def SetSpaceAccountant(accountant):
+    """replace the shared SpaceAccountant"""
+    global SPACE_ACCOUNTANT
+    SPACE_ACCOUNTANT = accountant
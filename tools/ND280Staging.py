@@ -0,0 +1,210 @@
+#!/usr/bin/env python2
+"""
+Bulk tape recall ahead of FTS transfers.
+
+Files on tape (RAL Castor) have to be brought online before FTS can copy
+them, otherwise the transfer times out. Stager takes every source of a
+transfer plan at once: it looks up their locality with lcg-ls -l in
+chunks, sends one lcg-bringonline per chunk of NEARLINE files without
+waiting for it, then polls the locality of everything still on tape
+together and hands back files as they come ONLINE, so transfers start
+while the rest of the recall is still going.
+
+The number of files waiting for tape is the recall queue depth, printed
+and appended to $ND280TRANSFERS/staging.<date>.log at every poll.
+"""
+
+from datetime import date
+import os
+import threading
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait
+import ND280Replicas
+
+# SEs whose files may be on tape
+TAPE_SES = ('srm-t2k.gridpp.rl.ac.uk',)
+
+# lcg-ls -l locality
+kOnline = 'ONLINE'
+kNearline = 'NEARLINE'
+
+
+def IsTape(surl):
+    """could surl be on tape"""
+    return ND280Replicas.SEName(surl) in TAPE_SES
+
+
+def CleanSURL(surl):
+    """surl without errant '//', as CopySRM copies it"""
+    return surl[:10] + surl[10:].replace('//', '/')
+
+
+def IsOnline(locality):
+    """ONLINE or ONLINE_AND_NEARLINE"""
+    return locality.startswith(kOnline)
+
+
+class Stager(object):
+    """
+    Brings the sources of many transfers online together. Stage() takes
+    (surl, item) pairs and yields lists of the items whose surl is online,
+    as they become so, giving up after timeout seconds; the items that
+    never came online are left in failed. chunk is the number of SURLs
+    per lcg-ls or lcg-bringonline, poll the seconds between polls.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, timeout=2*StatusWait.kHour, poll=StatusWait.kMinute,
+                 chunk=100, executor=None):
+        self.timeout = timeout
+        self.poll = poll
+        self.chunk = chunk
+        self.executor = executor or ND280Computing.GetRetryPolicy()
+        self.lock = threading.Lock()
+        self.waiting = dict()
+        self.requested = dict()
+        self.failed = list()
+        self.nRequests = 0
+        self.nRecalled = 0
+
+    def Chunks(self, surls):
+        surls = list(surls)
+        return [surls[i:i + self.chunk]
+                for i in xrange(0, len(surls), self.chunk)]
+
+    def Locality(self, surls):
+        """{surl: locality} from lcg-ls -l, SURLs that could not be listed
+        are left out"""
+        localities = dict()
+        for chunk in self.Chunks(surls):
+            by_name = dict()
+            for surl in chunk:
+                by_name.setdefault(os.path.basename(surl), list()).append(surl)
+            result = self.executor.Run('lcg-ls -l ' + ' '.join(chunk),
+                                       StatusWait.kTimeout)
+            for line in result.lines:
+                # -rw-r--r-- 1 2 2 1048576 NEARLINE /castor/.../file
+                fields = line.split()
+                if len(fields) < 7:
+                    continue
+                path = fields[-1].replace('//', '/')
+                for surl in by_name.get(os.path.basename(path), list()):
+                    if CleanSURL(surl).endswith(path):
+                        localities[surl] = fields[5]
+            if result.errors:
+                print 'lcg-ls -l: ' + ''.join(result.errors).strip()
+        return localities
+
+    def Request(self, surls):
+        """ask for surls to be brought online, without waiting for them"""
+        now = time.time()
+        for chunk in self.Chunks(surls):
+            command = ND280Computing.LCG(self.timeout).bringonline + \
+                ' '.join(chunk)
+            # lcg-bringonline only returns once the files are online,
+            # which is what the polling is for
+            thread = threading.Thread(target=self.executor.Run,
+                                      args=(command, self.timeout))
+            thread.daemon = True
+            thread.start()
+            self.nRequests += 1
+            with self.lock:
+                for surl in chunk:
+                    self.requested[surl] = now
+
+    def Depth(self):
+        """the recall queue depth: files waiting to come online"""
+        with self.lock:
+            return len(self.waiting)
+
+    def Record(self):
+        """print the recall queue depth and add it to the staging log"""
+        depth = self.Depth()
+        print 'Recall queue depth: %d files' % depth
+        transfer_dir = os.getenv('ND280TRANSFERS') or os.getcwd()
+        datestring = date.today().isoformat().replace('-', '')
+        try:
+            with open(os.path.join(transfer_dir, 'staging.' + datestring +
+                                   '.log'), 'a') as log:
+                log.write('%d %d\n' % (time.time(), depth))
+        except IOError as exception:
+            print 'Could not write the staging log: %s' % exception
+
+    def Released(self, surls, localities):
+        """remove the online surls from waiting, returns their items"""
+        ready = list()
+        now = time.time()
+        selector = ND280Replicas.GetReplicaSelector()
+        with self.lock:
+            for surl in surls:
+                if not IsOnline(localities.get(surl, '')):
+                    continue
+                ready += self.waiting.pop(surl)
+                if surl in self.requested:
+                    self.nRecalled += 1
+                    selector.RecordStaging(surl,
+                                           now - self.requested.pop(surl),
+                                           save=False)
+        return ready
+
+    def Stage(self, pairs):
+        """yield lists of the items of (surl, item) pairs whose surl is
+        online, the first list holds those that need no recall"""
+        ready = list()
+        for surl, item in pairs:
+            if IsTape(surl):
+                with self.lock:
+                    self.waiting.setdefault(surl, list()).append(item)
+            else:
+                ready.append(item)
+
+        surls = self.waiting.keys()
+        localities = self.Locality(surls)
+        ready += self.Released(surls, localities)
+        nearline = [surl for surl in self.waiting if surl in localities]
+        unknown = [surl for surl in self.waiting if surl not in localities]
+        for surl in unknown:
+            print 'Could not determine staging of ' + surl
+            self.failed += self.waiting.pop(surl)
+        if nearline:
+            print 'Recalling %d files from tape' % len(nearline)
+            self.Request(nearline)
+        self.Record()
+        if ready:
+            yield ready
+
+        start = time.time()
+        while self.waiting:
+            if time.time() - start > self.timeout:
+                print '%d files did not come online in %d s' % \
+                    (self.Depth(), self.timeout)
+                with self.lock:
+                    for items in self.waiting.itervalues():
+                        self.failed += items
+                    self.waiting = dict()
+                break
+            time.sleep(self.poll)
+            surls = self.waiting.keys()
+            ready = self.Released(surls, self.Locality(surls))
+            self.Record()
+            if ready:
+                yield ready
+        ND280Replicas.GetReplicaSelector().Save()
+
+    def StageAll(self, pairs):
+        """wait for every surl of pairs, returns the items that are
+        online"""
+        ready = list()
+        for items in self.Stage(pairs):
+            ready += items
+        return ready
+
+    def Summary(self):
+        return '%d bring online requests, %d files recalled, %d failed, ' \
+            '%d waiting' % (self.nRequests, self.nRecalled,
+                            len(self.failed), self.Depth())
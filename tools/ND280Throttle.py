@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+"""
+Submission throttling by site.
+
+SubmissionThrottle keeps the number of jobs of a production that are
+waiting or running at each site near a target. The counts come from the
+production's JobStore (<outdir>/jobs.db, as GetJobStatus.py uses), which
+it rescans and refreshes every poll seconds. Next() hands out the site
+with the most free slots and waits, refreshing, while every site is at
+its target, so a site sitting on a long queue is left alone until it
+drains while the others keep getting work.
+
+Jobs submitted with a single destination site are reported at that site
+by DIRAC while they wait, so the backlog of a site includes the jobs
+queued for it. Submissions handed out since the last refresh are counted
+as pending until the store has seen them.
+
+Without sites given, the sites are those where the production's jobs
+finished or are running, less the sites ND280Resubmit has banned. Until
+there are any (a new production) jobs are submitted anywhere, and at
+most target of them are kept waiting for DIRAC to match them, so the
+first sites are learned before the production floods the queues.
+"""
+
+import glob
+import time
+
+from ND280Computing import StatusWait
+
+
+class SubmissionThrottle(object):
+    """
+    Hands out sites to submit to, keeping at most target waiting plus
+    running jobs at each of sites (the sites the production's jobs ran
+    at so far if none are given) and at most total in the production
+    (no limit if 0). pattern globs the production's .jid files.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, store, target, sites=(), total=0, pattern='',
+                 poll=5*StatusWait.kMinute, max_workers=8, batch=500):
+        if target < 1:
+            raise self.Error('The target per site must be at least 1')
+        self.store = store
+        self.target = target
+        self.sites = [site for site in sites if site]
+        self.total = total
+        self.pattern = pattern
+        self.poll = poll
+        self.max_workers = max_workers
+        self.batch = batch
+        self.backlog = dict()
+        self.pending = dict()
+        self.known = list()
+        self.refreshed = 0
+        self.nWaits = 0
+
+    def Refresh(self):
+        """pick up new .jid files and the state of the unfinished jobs"""
+        if self.pattern:
+            self.store.ScanJIDFiles(glob.glob(self.pattern))
+        self.store.Refresh(self.max_workers, self.batch)
+        self.backlog = self.store.Backlog()
+        self.known = self.store.Sites()
+        self.pending = dict()
+        self.refreshed = time.time()
+
+    def Sites(self):
+        """the sites to spread the jobs over"""
+        return self.sites or self.known
+
+    def Queued(self, site):
+        """waiting plus running jobs at site, including pending ones"""
+        return self.backlog.get(site, 0) + self.pending.get(site, 0)
+
+    def Free(self):
+        """{site: number of jobs it can take before reaching the target},
+        {'': jobs that can wait to be matched} if no site is known"""
+        if not self.Sites():
+            return {'': self.target - self.Queued('ANY')}
+        return dict((site, self.target - self.Queued(site))
+                    for site in self.Sites())
+
+    def Total(self):
+        """waiting plus running jobs of the production"""
+        return sum(self.backlog.itervalues()) + \
+            sum(self.pending.itervalues())
+
+    def Choose(self, n):
+        """the site with the most free slots if it can take n jobs, ''
+        for anywhere when no site is known, None if all are full"""
+        if self.total and self.Total() + n > self.total:
+            return None
+        free = self.Free()
+        site = max(sorted(free), key=free.get)
+        if free[site] < n:
+            return None
+        return site
+
+    def Next(self, n=1, sleep=time.sleep):
+        """the site to submit n jobs to, waiting until one has room for
+        them ('' if no site is known). Counts them as pending"""
+        # a job larger than the target would never fit
+        n = min(n, self.target)
+        if self.total:
+            n = min(n, self.total)
+        if time.time() - self.refreshed > self.poll:
+            self.Refresh()
+        site = self.Choose(n)
+        while site is None:
+            print 'Waiting %d s for a site below %d waiting and running ' \
+                'jobs (%d in the production)' % (self.poll, self.target,
+                                                  self.Total())
+            self.nWaits += 1
+            sleep(self.poll)
+            self.Refresh()
+            site = self.Choose(n)
+        self.pending[site or 'ANY'] = self.pending.get(site or 'ANY', 0) + n
+        return site
+
+    def Print(self):
+        """the backlog of every site"""
+        limited = self.Sites() or ['ANY']
+        print 'Waiting+running  Target  Site'
+        for site in sorted(set(limited) | set(self.backlog)):
+            print '%15d %7s  %s' % (self.Queued(site),
+                                   self.target if site in limited
+                                   else '-', site)
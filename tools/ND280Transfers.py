@@ -0,0 +1,737 @@
+#!/usr/bin/env python2
+"""
+Batched FTS transfer submission.
+
+TransferScheduler keeps one queue of (source, destination) SURL pairs per
+FTS channel, that is per pair of source and destination SEs, and submits
+a queue as one FTS job with fts-transfer-submit -f once it holds max_files
+transfers or max_bytes of data, or its oldest transfer has waited
+max_age seconds. Before a job is submitted the scheduler waits on a
+ChannelMonitor until the channel has room for it under max_inflight
+active transfers.
+
+Every queued transfer is also written to a journal in $ND280TRANSFERS
+(transfer.journal[.tag].txt) which is rewritten as jobs are submitted, so
+transfers queued by a process that died are picked up again by the next
+scheduler with the same tag, or by any scheduler if the tag was the pid
+of a process that is no longer running. Whatever is still queued is
+submitted when the scheduler is closed, which happens at exit.
+
+FTS job IDs are appended to transfers.<date>.log as before.
+
+ChannelMonitor counts the active, failed and finished files of every
+channel from the FTS REST interface, with one query listing the VO's
+unfinished jobs and one fetching the file states of all of them (in
+chunks of kJobsPerQuery), however many jobs and channels there are. The
+counts are cached for an interval, and one poller thread refreshes them
+while any number of submitters wait on a condition for room on their
+channels.
+
+SourceStriper picks the source of each of many transfers among all the
+replicas of the files, to spread them over every source channel.
+"""
+
+import atexit
+from datetime import date
+import fcntl
+import glob
+import json
+import os
+from os import getenv, getcwd
+import tempfile
+import threading
+import time
+
+import ND280Computing
+from ND280Computing import StatusWait, VO
+import ND280Replicas
+import ND280Staging
+import StorageElement as SE
+
+# Number of files put in an FTS transfer limit to 200
+# since monitoring pages only display 200 files
+# http://lcgwww.gridpp.rl.ac.uk/cgi-bin/fts-mon/fts-mon.pl?q=jobs&p=day&v=t2k.org
+NTRANSFERS = 200
+# Data put in an FTS transfer
+MAX_BYTES_PER_TRANSFER = 500 * 1024**3
+# Longest a transfer waits to be submitted
+MAX_QUEUE_AGE = 30 * StatusWait.kMinute
+MAX_TRANSFERS_PER_CHANNEL = 600
+
+# FTS3 job and file states
+fts3_active_list = ['Active', 'Pending', 'Ready', 'Submitted', 'Staging',
+                    'Started', 'Delay']
+fts3_finished_list = ['Finished', 'FinishedDirty']
+fts3_failed_list = ['Canceled', 'Failed']
+
+
+def GetTransferDir():
+    """$ND280TRANSFERS, or the current directory"""
+    return getenv('ND280TRANSFERS') or getcwd()
+
+
+def GetChannel(source, dest):
+    """the (source SE, destination SE) channel of a transfer"""
+    return SE.GetSEFromSRM(source), SE.GetSEFromSRM(dest)
+
+
+def IsRunning(pid):
+    """is process pid still running"""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def BalancedBatches(items, Size, max_files=NTRANSFERS,
+                    max_bytes=MAX_BYTES_PER_TRANSFER):
+    """split items into the fewest batches of at most max_files items and
+    (unless an item is bigger) max_bytes, with as even a number of bytes
+    in each as largest first packing gives. Size(item) is its bytes"""
+    if not items:
+        return list()
+    total = sum(Size(item) for item in items)
+    nbatches = max(-(-len(items) // max_files), int(-(-total // max_bytes)))
+    while True:
+        batches = [[0, list()] for dummy in xrange(nbatches)]
+        for item in sorted(items, key=Size, reverse=True):
+            open_batches = [candidate for candidate in batches
+                            if len(candidate[1]) < max_files]
+            batch = min(open_batches, key=lambda candidate: candidate[0])
+            batch[0] += Size(item)
+            batch[1].append(item)
+        if max(each[0] for each in batches) <= max_bytes or \
+                nbatches >= len(items):
+            return [each[1] for each in batches if each[1]]
+        nbatches += 1
+
+
+class SourceStriper(object):
+    """
+    Spreads the transfers of many files to one destination SE over every
+    SE holding a replica of them, so that all the source channels are
+    used rather than the one best SE. Each file, largest first, goes to
+    the source on whose channel it would finish soonest, counting the
+    files active on the channel (from monitor), the bytes queued for it
+    (in scheduler) and those given to it so far, at the throughput the
+    replica selector has seen from that SE. Only SEs in SE_CHANNELS are
+    used, unless a file has no replica on any of them.
+    """
+
+    def __init__(self, dest, monitor=None, scheduler=None, selector=None):
+        self.dest = SE.GetSEFromSRM(dest) if '://' in dest else dest
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.selector = selector or ND280Replicas.GetReplicaSelector()
+        self.backlog = dict()
+        self.unassigned = list()
+        self.nFiles = dict()
+        self.nBytes = dict()
+
+    def Backlog(self, source, mean_size):
+        """the bytes already waiting on the channel from source"""
+        if source not in self.backlog:
+            channel = (source, self.dest)
+            backlog = 0.
+            if self.monitor:
+                backlog += self.monitor.Counts(*channel)[0] * mean_size
+            if self.scheduler:
+                with self.scheduler.lock:
+                    backlog += sum(transfer.size for transfer in
+                                   self.scheduler.queues.get(channel, []))
+            self.backlog[source] = backlog
+        return self.backlog[source]
+
+    def Candidates(self, surls):
+        """the replicas that can be sources, best first"""
+        ranked = [surl for surl in self.selector.Rank(surls)
+                  if SE.GetSEFromSRM(surl) != self.dest]
+        known = [surl for surl in ranked
+                 if SE.GetSEFromSRM(surl) in SE.SE_CHANNELS]
+        return known or ranked
+
+    def ExpectedTime(self, surl, size, mean_size):
+        """seconds until a file of size bytes from surl would be copied,
+        behind the backlog of its channel"""
+        source = SE.GetSEFromSRM(surl)
+        if self.selector.IsOpen(ND280Replicas.SEName(surl)):
+            return float('inf')
+        stats = self.selector.Stats(ND280Replicas.SEName(surl))
+        seconds = stats.firstbyte + \
+            (self.Backlog(source, mean_size) + size) / stats.throughput
+        if ND280Staging.IsTape(surl):
+            seconds += stats.staging
+        return seconds / max(stats.success, 0.01)
+
+    def Assign(self, items, Replicas, Size):
+        """[(source SURL, item)] for items, Replicas(item) is the list
+        of its replica SURLs and Size(item) its bytes. Items without any
+        replica are left out, in unassigned"""
+        items = sorted(items, key=Size, reverse=True)
+        mean_size = sum(Size(item) for item in items) / max(len(items), 1)
+        assigned = list()
+        for item in items:
+            candidates = self.Candidates(Replicas(item))
+            if not candidates:
+                self.unassigned.append(item)
+                continue
+            size = Size(item)
+            # the first of equals, in the selector's order, wins
+            best = min(candidates, key=lambda surl: self.ExpectedTime(
+                surl, size, mean_size))
+            source = SE.GetSEFromSRM(best)
+            self.backlog[source] = self.Backlog(source, mean_size) + size
+            self.nFiles[source] = self.nFiles.get(source, 0) + 1
+            self.nBytes[source] = self.nBytes.get(source, 0) + size
+            assigned.append((best, item))
+        return assigned
+
+    def Summary(self):
+        """one line per source channel"""
+        return '\n'.join('%-30s -> %s: %6d files %10.3f GB' %
+                         (source, self.dest, self.nFiles[source],
+                          self.nBytes[source] / 1024.**3)
+                         for source in sorted(self.nFiles))
+
+
+class Transfer(object):
+    """One queued transfer"""
+
+    def __init__(self, source, dest, size=0, queued=None):
+        self.source = source
+        self.dest = dest
+        self.size = int(size or 0)
+        self.queued = queued or time.time()
+
+    def Line(self):
+        return '%s %s %d %.0f\n' % (self.source, self.dest, self.size,
+                                    self.queued)
+
+
+class ChannelMonitor(object):
+    """
+    Cached counts of the active, failed and finished files on each FTS
+    channel. service is the FTS REST endpoint, by default $ND280FTSREST
+    or $FTS_SERVICE, counts older than interval seconds are refreshed.
+    After a failed query the previous counts are kept and the next query
+    waits interval seconds, doubling with each failure in a row. Before
+    any query has succeeded the counts are unknown and nothing is let
+    through WaitForCapacity.
+    """
+
+    # job IDs per file state query, to keep URLs short
+    kJobsPerQuery = 100
+    # longest wait after failed queries
+    kMaxRetryWait = StatusWait.kHour
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    class NotFound(Error):
+        """the REST endpoint answered 404"""
+        pass
+
+    def __init__(self, service='', interval=StatusWait.kProcessWait,
+                 executor=None):
+        self.service = (service or getenv('ND280FTSREST') or
+                        getenv('FTS_SERVICE') or '').rstrip('/')
+        self.interval = interval
+        self.executor = executor or ND280Computing.GetRetryPolicy()
+        self.condition = threading.Condition()
+        self.counts = dict()
+        self.reserved = dict()
+        self.updated = 0.
+        self.retry = 0.
+        self.nFailures = 0
+        self.refreshing = False
+        self.poller = None
+        self.nWaiting = 0
+        self.nQueries = 0
+
+    def Curl(self, path):
+        """the JSON at path on the REST endpoint"""
+        command = 'curl -s -S -f'
+        proxy = getenv('X509_USER_PROXY')
+        if proxy and self.service.startswith('https'):
+            command += ' --capath /etc/grid-security/certificates'
+            command += ' -E %s --cacert %s' % (proxy, proxy)
+        command += " '%s%s'" % (self.service, path)
+        result = self.executor.Run(command, StatusWait.kTimeout)
+        self.nQueries += 1
+        if result.returncode != 0 or result.timedout:
+            message = 'Could not query %s%s: %s' % \
+                (self.service, path, ''.join(result.errors).strip())
+            # curl -f exits with 22 on HTTP errors
+            if result.returncode == 22 and \
+                    'error: 404' in ''.join(result.errors):
+                raise self.NotFound(message)
+            raise self.Error(message)
+        try:
+            return json.loads(''.join(result.lines))
+        except ValueError:
+            raise self.Error('Bad reply from %s%s' % (self.service, path))
+
+    def Query(self):
+        """{channel: [active, failed, finished]} from the FTS server"""
+        states = ','.join(state.upper() for state in fts3_active_list)
+        jobs = self.Curl('/jobs?vo_name=%s&state_in=%s'
+                         '&fields=job_id' % (VO, states))
+        job_ids = [str(job['job_id']) for job in jobs]
+        counts = dict()
+        for start in xrange(0, len(job_ids), self.kJobsPerQuery):
+            chunk = job_ids[start:start + self.kJobsPerQuery]
+            try:
+                replies = self.Curl('/jobs/%s?files=file_state,source_surl,'
+                                    'dest_surl' % ','.join(chunk))
+            except self.NotFound:
+                # a single job purged since it was listed
+                if len(chunk) != 1:
+                    raise
+                continue
+            if isinstance(replies, dict):
+                replies = [replies]
+            for job in replies:
+                for entry in job.get('files', list()):
+                    channel = GetChannel(str(entry['source_surl']),
+                                         str(entry['dest_surl']))
+                    state = str(entry['file_state']).capitalize()
+                    count = counts.setdefault(channel, [0, 0, 0])
+                    if state in fts3_active_list:
+                        count[0] += 1
+                    elif state in fts3_failed_list:
+                        count[1] += 1
+                    elif state in fts3_finished_list:
+                        count[2] += 1
+        return counts
+
+    def Refresh(self):
+        """query the counts, unless another thread already is, and wake
+        the waiting submitters"""
+        with self.condition:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        try:
+            counts = self.Query()
+        except self.Error as exception:
+            print str(exception)
+            counts = None
+        with self.condition:
+            self.refreshing = False
+            if counts is not None:
+                self.counts = counts
+                self.reserved = dict()
+                self.updated = time.time()
+                self.nFailures = 0
+            else:
+                # keep the old counts, and do not query again at once
+                self.nFailures += 1
+                self.retry = time.time() + \
+                    min(self.interval * 2**(self.nFailures - 1),
+                        self.kMaxRetryWait)
+            self.condition.notify_all()
+
+    def NextRefresh(self):
+        """the time the counts are next queried"""
+        if self.nFailures:
+            return self.retry
+        return self.updated + self.interval
+
+    def Counts(self, source, dest):
+        """(active, failed, finished) files between two SEs, including
+        files submitted since the last query as active"""
+        if time.time() >= self.NextRefresh():
+            self.Refresh()
+        with self.condition:
+            return self.Cached((source, dest))
+
+    def Cached(self, channel):
+        active, failed, finished = self.counts.get(channel, (0, 0, 0))
+        return active + self.reserved.get(channel, 0), failed, finished
+
+    def Active(self, source, dest):
+        """active files between two SEs"""
+        return self.Counts(source, dest)[0]
+
+    def Reserve(self, channel, nfiles):
+        """count nfiles just submitted on channel until the next query"""
+        with self.condition:
+            self.reserved[channel] = self.reserved.get(channel, 0) + nfiles
+
+    def WaitForCapacity(self, channels, limit, needed=0):
+        """block until the files active on channels, plus needed, are at
+        most limit. Until a query has succeeded the counts are unknown,
+        so it keeps waiting for one"""
+        needed = min(needed, limit)
+        if time.time() >= self.NextRefresh():
+            self.Refresh()
+        with self.condition:
+            self.nWaiting += 1
+            try:
+                while not self.updated or \
+                        sum(self.Cached(channel)[0] for channel in channels) \
+                        + needed > limit:
+                    self.StartPoller()
+                    self.condition.wait(self.interval)
+            finally:
+                self.nWaiting -= 1
+
+    def StartPoller(self):
+        """start the thread refreshing the counts while anyone waits,
+        called with the condition held"""
+        if self.poller and self.poller.is_alive():
+            return
+        self.poller = threading.Thread(target=self.Poll)
+        self.poller.daemon = True
+        self.poller.start()
+
+    def Poll(self):
+        while True:
+            with self.condition:
+                if not self.nWaiting:
+                    return
+            wait = self.NextRefresh() - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.Refresh()
+
+
+class TransferScheduler(object):
+    """
+    Per channel queues of FTS transfers, submitted in batches. monitor, if
+    given, is the ChannelMonitor used to cap the files in flight on each
+    channel at max_inflight.
+    """
+
+    class Error(Exception):
+        """an internal class for errors"""
+        pass
+
+    def __init__(self, tag='', transfer_dir='', max_files=NTRANSFERS,
+                 max_bytes=MAX_BYTES_PER_TRANSFER, max_age=MAX_QUEUE_AGE,
+                 max_inflight=MAX_TRANSFERS_PER_CHANNEL, monitor=None,
+                 executor=None):
+        self.tag = str(tag or '')
+        self.transfer_dir = transfer_dir or GetTransferDir()
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_inflight = max_inflight
+        self.monitor = monitor
+        self.executor = executor or ND280Computing.GetRetryPolicy()
+        self.lock = threading.RLock()
+        self.queues = dict()
+        self.dests = set()
+        self.submitting = list()
+        self.timer = None
+        self.closed = False
+
+        # for the summary
+        self.nQueued = 0
+        self.nSubmitted = 0
+        self.nJobs = 0
+        self.jobs = list()
+
+        self.journal = os.path.join(self.transfer_dir, 'transfer.journal')
+        if self.tag:
+            self.journal += '.' + self.tag
+        self.journal += '.txt'
+        self.Recover()
+        atexit.register(self.Close)
+
+    # The journal
+    def ReadJournal(self, path):
+        """the transfers in a journal file"""
+        transfers = list()
+        with open(path) as journal:
+            for line in journal:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                transfers.append(Transfer(*fields[:2] + [
+                    int(fields[2]) if len(fields) > 2 else 0,
+                    float(fields[3]) if len(fields) > 3 else None]))
+        return transfers
+
+    def Recover(self):
+        """queue the transfers left in our journal, and in the journals
+        of processes that are no longer running"""
+        journals = list()
+        if os.path.exists(self.journal):
+            journals.append(self.journal)
+        pattern = os.path.join(self.transfer_dir, 'transfer.journal.*.txt')
+        for path in glob.glob(pattern):
+            pid = os.path.basename(path).split('.')[2]
+            if path != self.journal and pid.isdigit() and \
+                    not IsRunning(int(pid)):
+                journals.append(path)
+
+        recovered = list()
+        for path in journals:
+            try:
+                recovered += self.ReadJournal(path)
+            except IOError as exception:
+                print 'Could not read %s: %s' % (path, exception)
+                continue
+            print 'Recovered transfers from %s' % path
+        with self.lock:
+            for transfer in recovered:
+                self.Queue(transfer)
+            self.WriteJournal()
+        for path in journals:
+            if path != self.journal:
+                os.remove(path)
+        if recovered:
+            print '%d transfers recovered' % len(recovered)
+
+    def WriteJournal(self):
+        """rewrite the journal with every transfer not yet submitted,
+        through a temporary file so a crash can not leave half of it"""
+        with self.lock:
+            transfers = [transfer for queue in self.queues.itervalues()
+                         for transfer in queue]
+            for batch in self.submitting:
+                transfers += batch
+            if not transfers:
+                if os.path.exists(self.journal):
+                    os.remove(self.journal)
+                return
+            handle, temporary = tempfile.mkstemp(dir=self.transfer_dir)
+            with os.fdopen(handle, 'w') as journal:
+                journal.writelines(transfer.Line() for transfer in transfers)
+            os.rename(temporary, self.journal)
+
+    # Queueing
+    def Queue(self, transfer):
+        """put transfer on its channel's queue unless it is there already,
+        returns the channel"""
+        channel = GetChannel(transfer.source, transfer.dest)
+        if transfer.dest not in self.dests:
+            self.queues.setdefault(channel, list()).append(transfer)
+            self.dests.add(transfer.dest)
+            self.nQueued += 1
+        return channel
+
+    def Add(self, source, dest, size=0):
+        """queue a transfer of size bytes from source to dest, submitting
+        any queue that is due"""
+        if source == dest:
+            raise self.Error('Trying to overwrite %s with itself' % source)
+        for surl in (source, dest):
+            if not surl.startswith('srm://'):
+                raise self.Error(surl + ' not a valid SURL!')
+        transfer = Transfer(source, dest, size)
+        with self.lock:
+            self.Queue(transfer)
+            with open(self.journal, 'a') as journal:
+                journal.write(transfer.Line())
+        self.Start()
+        self.Poll()
+
+    def IsDue(self, channel, now=None):
+        """should the queue of channel be submitted"""
+        queue = self.queues.get(channel)
+        if not queue:
+            return False
+        if len(queue) >= self.max_files:
+            return True
+        if sum(transfer.size for transfer in queue) >= self.max_bytes:
+            return True
+        return (now or time.time()) - queue[0].queued >= self.max_age
+
+    def Poll(self):
+        """submit every queue that is due"""
+        now = time.time()
+        with self.lock:
+            due = [channel for channel in self.queues
+                   if self.IsDue(channel, now)]
+        for channel in due:
+            self.Flush(channel)
+
+    def Flush(self, channel=None):
+        """submit the queue of channel, or of every channel, now. Returns
+        the FTS job IDs"""
+        with self.lock:
+            channels = [channel] if channel else self.queues.keys()
+        job_ids = list()
+        for each in channels:
+            while True:
+                batch = self.Take(each)
+                if not batch:
+                    break
+                job_id = self.Submit(each, batch)
+                if not job_id:
+                    break
+                job_ids.append(job_id)
+        return job_ids
+
+    def Take(self, channel):
+        """remove up to max_files transfers, and at most max_bytes, from
+        the front of channel's queue"""
+        with self.lock:
+            queue = self.queues.get(channel, list())
+            nbytes = 0
+            count = 0
+            for transfer in queue[:self.max_files]:
+                if count and nbytes + transfer.size > self.max_bytes:
+                    break
+                nbytes += transfer.size
+                count += 1
+            batch = queue[:count]
+            self.dests.difference_update(transfer.dest for transfer in batch)
+            self.queues[channel] = queue[count:]
+            if not self.queues[channel]:
+                del self.queues[channel]
+            if batch:
+                self.submitting.append(batch)
+            return batch
+
+    def Requeue(self, channel, batch):
+        """put a batch that could not be submitted back on its queue"""
+        with self.lock:
+            self.submitting.remove(batch)
+            self.dests.update(transfer.dest for transfer in batch)
+            self.queues[channel] = batch + self.queues.get(channel, list())
+
+    # Submission
+    def WaitForChannel(self, channel, nfiles):
+        """wait until nfiles more keep the files active on channel under
+        max_inflight, transfers out of KEK are never held back"""
+        if not self.monitor or 'kek.jp' in channel[0]:
+            return
+        print 'Checking FTS transfers between %s and %s' % channel
+        self.monitor.WaitForCapacity([channel], self.max_inflight, nfiles)
+
+    def Command(self, channel, bulk_file):
+        """the fts-transfer-submit command for a bulk file"""
+        command = 'fts-transfer-submit --verbose -K -o'
+        command += ' -s ' + str(getenv('FTS_SERVICE'))
+        command += ' -m ' + str(getenv('MYPROXY_SERVER'))
+        # Implement space token
+        if SE.SE_SPACETOKENS.get(channel[1]):
+            command += ' -t T2KORGDISK'
+        command += ' -f ' + bulk_file
+        return command
+
+    def Submit(self, channel, batch):
+        """submit batch as one FTS job, returns the job ID or '' if the
+        submission failed, in which case the batch is queued again"""
+        self.WaitForChannel(channel, len(batch))
+
+        handle, bulk_file = tempfile.mkstemp(
+            prefix='transfer.%s-%s.' % channel, suffix='.txt',
+            dir=self.transfer_dir)
+        with os.fdopen(handle, 'w') as bulk:
+            for transfer in batch:
+                bulk.write('%s %s\n' % (transfer.source, transfer.dest))
+        try:
+            print 'Submitting %d transfers between %s and %s' % \
+                ((len(batch),) + channel)
+            result = self.executor.Run(self.Command(channel, bulk_file),
+                                       StatusWait.kTimeout)
+        finally:
+            os.remove(bulk_file)
+
+        lines = [line.strip() for line in result.lines if line.strip()]
+        if result.returncode != 0 or result.timedout or not lines:
+            print 'Could not submit transfers between %s and %s: %s' % \
+                (channel + (''.join(result.errors).strip(),))
+            self.Requeue(channel, batch)
+            return ''
+
+        # the job ID is the last line with --verbose
+        job_id = lines[-1].split()[-1]
+        datestring = date.today().isoformat().replace('-', '')
+        with self.lock:
+            with open(os.path.join(self.transfer_dir, 'transfers.' +
+                                   datestring + '.log'), 'a') as log:
+                # ND280Harvester rewrites the log under the same lock
+                fcntl.flock(log, fcntl.LOCK_EX)
+                log.write(job_id + '\n')
+            self.submitting.remove(batch)
+            self.nSubmitted += len(batch)
+            self.nJobs += 1
+            self.jobs.append((job_id, channel, len(batch)))
+            self.WriteJournal()
+        if self.monitor:
+            self.monitor.Reserve(channel, len(batch))
+        print 'Submitted FTS job %s' % job_id
+        return job_id
+
+    # Timing
+    def Start(self):
+        """start the thread submitting queues that are old enough"""
+        with self.lock:
+            if self.timer or self.closed:
+                return
+            self.timer = threading.Thread(target=self.Tick)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def Tick(self):
+        interval = max(min(self.max_age / 4., StatusWait.kMinute),
+                       StatusWait.kSecond)
+        while not self.closed:
+            time.sleep(interval)
+            if self.closed:
+                break
+            try:
+                self.Poll()
+            except Exception as exception:
+                print 'Transfer submission failed: %s' % exception
+
+    def Pending(self):
+        """the number of transfers not yet submitted"""
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.itervalues())
+
+    def Close(self):
+        """submit everything that is still queued"""
+        if self.closed:
+            return
+        self.Flush()
+        self.closed = True
+        if self.Pending():
+            print '%d transfers left in %s' % (self.Pending(), self.journal)
+
+    def Summary(self):
+        return '%d transfers queued, %d submitted in %d FTS jobs, ' \
+            '%d pending' % (self.nQueued, self.nSubmitted, self.nJobs,
+                            self.Pending())
+
+
+# Shared monitor and scheduler, made on first use
+CHANNEL_MONITOR = None
+TRANSFER_SCHEDULER = None
+
+
+def GetChannelMonitor():
+    """simple get'er for the shared ChannelMonitor"""
+    global CHANNEL_MONITOR
+    if CHANNEL_MONITOR is None:
+        CHANNEL_MONITOR = ChannelMonitor()
+    return CHANNEL_MONITOR
+
+
+def SetChannelMonitor(monitor):
+    """replace the shared ChannelMonitor"""
+    global CHANNEL_MONITOR
+    CHANNEL_MONITOR = monitor
+
+
+def GetTransferScheduler(tag=''):
+    """simple get'er for the shared TransferScheduler, its journal is
+    tagged with tag the first time"""
+    global TRANSFER_SCHEDULER
+    if TRANSFER_SCHEDULER is None:
+        TRANSFER_SCHEDULER = TransferScheduler(tag,
+                                               monitor=GetChannelMonitor())
+    return TRANSFER_SCHEDULER
+
+
+def SetTransferScheduler(scheduler):
+    """replace the shared TransferScheduler"""
+    global TRANSFER_SCHEDULER
+    TRANSFER_SCHEDULER = scheduler
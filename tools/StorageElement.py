@@ -5,9 +5,9 @@ import os
 from os import system, getenv
 from os.path import join
 
-import ND280GRID
 import ND280Computing as ND280Comp
 import ND280DIRACAPI as ND280DIRAC
+import ND280Space
 
 
 class units(object):
@@ -218,10 +218,10 @@ def GetTopLevelDir(storageElement):
         else:
             surl = lines[2]
 
-        top_level_dir = ND280GRID.rmNL(surl.replace(testFileName, ''))
+        top_level_dir = surl.replace(testFileName, '').replace('\n', '')
 
     except Exception as exception:
-        print 'Exception: ' + ND280GRID.rmNL(errors[0])
+        print 'Exception: ' + errors[0].replace('\n', '')
         print 'Exception type', str(exception)
         print 'Please implement a solution!'
         # top_level_dir = ND280GRID.rmNL(errors[0].split('lcgCr')[0])
@@ -297,72 +297,17 @@ def GetSEFromSRM(srm):
 
 
 def PrintSEDiskUsage():
-    """ Print Storage Element Disk Usage """
-    command = "lcg-infosites --vo t2k.org se"
-    lines, errors = ND280Comp.GetListPopenCommand(command)
-
-    print 'Free (TB)  Used(TB)  SE'
-    print '-------------------------------------------------'
-
-    # skip first 2 lines
-    if lines:
-        for line in lines[2:]:
-
-            words = line.split()
-            seFree, seUsed, seName = words[0], words[1], words[2]
-
-            # Ignore manchester and heplnx204.pp.rl.ac.uk (for now)
-            if 'manchester' in seName:
-                continue
-            if 'heplnx204' in seName:
-                continue
-
-            if 'n.a' in seFree:
-                seFree = 0
-            else:
-                seFree = float(seFree) * units().kTerabyte
-            if 'n.a' in seUsed:
-                seUsed = 0
-            else:
-                seUsed = float(seUsed) * units().kTerabyte
-
-            # Ignore if free and used both 0
-            if seFree == 0 and seUsed == 0:
-                continue
-
-            print '%9.2f %9.2f  %s' % (seFree, seUsed, seName)
-    else:
-        if errors:
-            print '\n'.join(errors)
+    """ Print Storage Element Disk Usage, from the SE space cache when
+    it is fresh enough (see ND280Space) """
+    GetSpaceAccountant().PrintDiskUsage()
 
 
 def PrintSESpaceUsage():
-    """ Print Storage Element Space Usage """
-
-    command = "lcg-infosites --vo t2k.org space"
-    lines, errors = ND280Comp.GetListPopenCommand(command)
-
-    print '    Free     Used     Free     Used              Tag SE'
-    print '  Online   Online Nearline Nearline (TB)                   '
-    print '--------------------------------------------------------------------------------'
+    """ Print Storage Element Space Usage, from the SE space cache when
+    it is fresh enough (see ND280Space) """
+    GetSpaceAccountant().PrintSpaceUsage()
 
-    if lines:
-        lines = lines[3:]
-        for line in lines:
 
-            words = line.split()
-            onlineFree = float(words[0]) / 1024.
-            onlineUsed = float(words[1]) / 1024.
-            nearlineFree = float(words[3]) / 1024.
-            nearlineUsed = float(words[4]) / 1024.
-            tag = words[6]
-            se = words[7]
-
-            # Ignore if free and used both 0|1
-            if onlineUsed <= 1 and onlineUsed <= 1:
-                continue
-
-            print '%8.2f %8.2f %8.2f %8.2f %16s %s' % (onlineFree, onlineUsed, nearlineFree, nearlineUsed, tag, se)
-    else:
-        if errors:
-            print '\n'.join(errors)
+def GetSpaceAccountant():
+    """the shared ND280Space.SpaceAccountant of ALL_SE"""
+    return ND280Space.GetSpaceAccountant([se.GetName() for se in ALL_SE])